@@ -1,24 +1,30 @@
 import os
-import httpx
+import re
 import json
+import asyncio
 import logging
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 import models
 from database import SessionLocal
+from classification_cache import classification_cache
+from local_classifier import local_classifier, LOCAL_CLASSIFIER
+from shared_state import shared_state
+from log_writer import read_log_content
+from llm_providers import llm_router, CircuitOpenError
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+# Micro-batching: up to AI_BATCH_SIZE logs or AI_BATCH_WAIT_MS per LLM call (1 disables it)
+AI_BATCH_SIZE = int(os.getenv("AI_BATCH_SIZE", "20"))
+AI_BATCH_WAIT_MS = float(os.getenv("AI_BATCH_WAIT_MS", "50"))
+AI_BATCH_MAX_MESSAGE_CHARS = int(os.getenv("AI_BATCH_MAX_MESSAGE_CHARS", "2000"))
 
-async def classify_log_with_ai(log_content: str):
-    """
-    Classifies the log using OpenAI gpt-4o-mini.
-    Returns: 'normal', 'atenção', 'erro', or 'sucesso'
-    """
-    system_prompt = """You are a log classifier. 
+VALID_CATEGORIES = ["normal", "atenção", "erro", "sucesso"]
+
+CLASSIFY_SYSTEM_PROMPT = """You are a log classifier. 
 Your output MUST be one of these exact words:
 - normal (for routine, heartbeat, info)
 - atenção (for warning, slow, suspicious, potential issues)
@@ -27,43 +33,168 @@ Your output MUST be one of these exact words:
 
 Do NOT use any other words. Output ONLY 'normal', 'atenção', 'erro', or 'sucesso'."""
 
+BATCH_CLASSIFY_SYSTEM_PROMPT = """You are a log classifier.
+You will receive a numbered list of logs. Classify EACH log as one of these exact words:
+- normal (for routine, heartbeat, info)
+- atenção (for warning, slow, suspicious, potential issues)
+- erro (for failure, crash, 500 error, exceptions)
+- sucesso (for success, 200 ok, completed)
+
+Answer with exactly one line per log, in the same order, formatted as '<number>. <category>'.
+Do NOT use any other words."""
+
+def parse_classification(content: str):
+    """Maps a model answer to one of the valid categories ('normal' as fallback)."""
+    content = content.strip().lower()
+    for cat in VALID_CATEGORIES:
+        if cat in content:
+            return cat
+    return "normal" # Default fallback
+
+def format_log_for_prompt(log_content):
+    if not isinstance(log_content, str):
+        log_content = json.dumps(log_content, default=str, ensure_ascii=False)
+    return log_content
+
+async def classify_log_with_ai(log_content: str, fallback="normal"):
+    """
+    Classifies the log with the LLM routed to 'classify' (OpenAI gpt-4o-mini by default).
+    Returns: 'normal', 'atenção', 'erro', or 'sucesso' ('fallback' if the call fails)
+    """
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                "https://api.openai.com/v1/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {OPENAI_API_KEY}",
-                    "Content-Type": "application/json"
-                },
-                json={
-                    "model": "gpt-4o-mini",
-                    "messages": [
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": f"Classify this log:\n{log_content}"}
-                    ],
-                    "temperature": 0.0,
-                    "max_tokens": 10
-                },
-                timeout=10.0
-            )
-            content = response.json()['choices'][0]['message']['content'].strip().lower()
-            
-            valid_categories = ["normal", "atenção", "erro", "sucesso"]
-            for cat in valid_categories:
-                if cat in content:
-                    return cat
-            return "normal" # Default fallback
+        content = await llm_router.chat(
+            "classify",
+            [
+                {"role": "system", "content": CLASSIFY_SYSTEM_PROMPT},
+                {"role": "user", "content": f"Classify this log:\n{format_log_for_prompt(log_content)}"}
+            ],
+            max_tokens=10,
+            timeout=10.0
+        )
+        return parse_classification(content)
+    except CircuitOpenError:
+        return fallback
     except Exception as e:
         logger.error(f"Error classifying log: {e}")
-        return "normal"
+        return fallback
 
-async def generate_ai_report(system_id: str, log_id: int):
+async def classify_logs_batch(log_contents: list, fallback="normal"):
     """
-    Generates a technical report for a specific log and saves it to the database.
-    Returns the report content or None if failed.
+    Classifies several logs with a single LLM call using a numbered list.
+    Returns one category per log, in order ('fallback' for anything missing).
+    """
+    if len(log_contents) == 1:
+        return [await classify_log_with_ai(log_contents[0], fallback)]
+
+    lines = []
+    for i, log_content in enumerate(log_contents, start=1):
+        # One log per line so the numbering stays unambiguous
+        text = " ".join(format_log_for_prompt(log_content).split())
+        lines.append(f"{i}. {text[:AI_BATCH_MAX_MESSAGE_CHARS]}")
+
+    results = [fallback] * len(log_contents)
+    try:
+        content = await llm_router.chat(
+            "classify",
+            [
+                {"role": "system", "content": BATCH_CLASSIFY_SYSTEM_PROMPT},
+                {"role": "user", "content": "Classify these logs:\n" + "\n".join(lines)}
+            ],
+            max_tokens=10 * len(log_contents),
+            timeout=10.0 + len(log_contents) * 0.5
+        )
+    except CircuitOpenError:
+        return results
+    except Exception as e:
+        logger.error(f"Error classifying log batch: {e}")
+        return results
+
+    for line in content.splitlines():
+        match = re.match(r"^\s*(\d+)\s*[.):-]\s*(.+)$", line)
+        if not match:
+            continue
+        index = int(match.group(1)) - 1
+        if 0 <= index < len(results):
+            results[index] = parse_classification(match.group(2))
+    return results
+
+class BatchClassifier:
+    """
+    Collects concurrent classification requests and sends them to the LLM in
+    micro-batches of up to `max_items` logs, waiting at most `max_wait_ms`
+    for a batch to fill. Each caller awaits its own result.
+    """
+
+    def __init__(self, max_items: int, max_wait_ms: float):
+        self.max_items = max_items
+        self.max_wait = max_wait_ms / 1000.0
+        self._pending = [] # (log_content, future)
+        self._timer = None
+
+    async def classify(self, log_content):
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((log_content, future))
+
+        if len(self._pending) >= self.max_items:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending[:self.max_items], self._pending[self.max_items:]
+        if self._pending:
+            self._timer = asyncio.get_running_loop().call_later(self.max_wait, self._flush)
+        if batch:
+            asyncio.create_task(self._run(batch))
+
+    async def _run(self, batch):
+        try:
+            results = await classify_logs_batch([log_content for log_content, _ in batch], fallback=None)
+        except Exception as e:
+            logger.error(f"Error in batch classifier: {e}")
+            results = [None] * len(batch)
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+batch_classifier = BatchClassifier(max_items=AI_BATCH_SIZE, max_wait_ms=AI_BATCH_WAIT_MS)
+
+async def classify_log(log_content):
+    """
+    Entry point used by the ingest path: answers repeated messages from the
+    classification cache, then tries the local rule/model tier, and only sends
+    low-confidence logs to the LLM (batched when AI_BATCH_SIZE > 1).
     """
+    cached = classification_cache.get(log_content)
+    if cached is not None:
+        return cached
+
+    classification = local_classifier.classify(log_content) if LOCAL_CLASSIFIER else None
+    if classification is not None:
+        classification_cache.set(log_content, classification)
+        return classification
+
+    if AI_BATCH_SIZE > 1:
+        classification = await batch_classifier.classify(log_content)
+    else:
+        classification = await classify_log_with_ai(log_content, fallback=None)
+
+    # Failed calls fall back to 'normal' but are not cached
+    if classification is None:
+        return "normal"
+
+    key = classification_cache.set(log_content, classification)
+    if classification_cache.persist:
+        await asyncio.to_thread(classification_cache.save, key, classification)
+    return classification
+
+def build_report_prompt(system_id: str, log_id: int):
+    """Loads the system and the log and builds the report prompt, or None if either is missing (blocking)."""
     db = SessionLocal()
-    
     try:
         system = db.query(models.System).filter(models.System.id == system_id).first()
         log = db.query(models.Log).filter(models.Log.id == log_id).first()
@@ -71,16 +202,9 @@ async def generate_ai_report(system_id: str, log_id: int):
         if not system or not log:
             return None
 
-        # Check if report already exists? 
-        # For now, let's assume we might want to regenerate or just generate fresh.
-        # But if we want to avoid duplicate work, we could check here.
-        # existing_report = db.query(models.Report).filter(models.Report.log_id == log_id).first()
-        # if existing_report:
-        #     return existing_report.content
-
         tech_info = system.technical_info or "Nenhuma ficha técnica disponível."
         
-        prompt = f"""You are a technical support AI.
+        return f"""You are a technical support AI.
 A system error or warning has occurred.
 
 SYSTEM TECHNICAL DETAILS (FICHA TÉCNICA):
@@ -92,44 +216,53 @@ CLIENT INFO:
 - Status: {system.status}
 
 LOG CONTENT:
-{log.content}
+{format_log_for_prompt(read_log_content(log))}
 
 Generate a concise technical report explaining the possible cause and suggested solution.
 Keep it professional and technical.
 Output in Brazilian Portuguese."""
+    finally:
+        db.close()
 
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                "https://api.openai.com/v1/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {OPENAI_API_KEY}",
-                    "Content-Type": "application/json"
-                },
-                json={
-                    "model": "gpt-4o-mini",
-                    "messages": [
-                        {"role": "system", "content": "You are a tech specialist assistant."},
-                        {"role": "user", "content": prompt}
-                    ],
-                    "temperature": 0.7
-                },
-                timeout=60.0
-            )
-            report_content = response.json()['choices'][0]['message']['content']
-            
-            # Save report to DB
-            new_report = models.Report(
-                system_id=system_id,
-                log_id=log_id,
-                content=report_content
-            )
-            db.add(new_report)
-            db.commit()
-            
-            return report_content
+def save_report(system_id: str, log_id: int, content: str):
+    db = SessionLocal()
+    try:
+        new_report = models.Report(
+            system_id=system_id,
+            log_id=log_id,
+            content=content
+        )
+        db.add(new_report)
+        db.commit()
+        return new_report.id
+    finally:
+        db.close()
+
+async def generate_ai_report(system_id: str, log_id: int):
+    """
+    Generates a technical report for a specific log and saves it to the database.
+    No database session is held during the LLM call. Returns (report_id, content)
+    or None if failed; deduplication and caching live in report_jobs.
+    """
+    try:
+        prompt = await asyncio.to_thread(build_report_prompt, system_id, log_id)
+        if prompt is None:
+            return None
+
+        report_content = await llm_router.chat(
+            "report",
+            [
+                {"role": "system", "content": "You are a tech specialist assistant."},
+                {"role": "user", "content": prompt}
+            ],
+            temperature=0.7,
+            timeout=60.0
+        )
+
+        report_id = await asyncio.to_thread(save_report, system_id, log_id, report_content)
+        shared_state.invalidate("reports")
+        return report_id, report_content
             
     except Exception as e:
         logger.error(f"Error generating AI report: {e}")
         return None
-    finally:
-        db.close()
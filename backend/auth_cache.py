@@ -0,0 +1,67 @@
+import os
+from sqlalchemy import select
+import models
+from cache import LRUCache
+
+SYSTEM_CACHE_SIZE = int(os.getenv("SYSTEM_CACHE_SIZE", "10000"))
+SYSTEM_CACHE_TTL = float(os.getenv("SYSTEM_CACHE_TTL", "300"))
+# Unknown keys are remembered for a shorter time so a newly registered system works quickly
+SYSTEM_CACHE_NEGATIVE_TTL = float(os.getenv("SYSTEM_CACHE_NEGATIVE_TTL", "30"))
+
+class CachedSystem:
+    """Detached snapshot of the System fields used by the webhook hot path."""
+    __slots__ = ("id", "name")
+
+    def __init__(self, id: str, name: str):
+        self.id = id
+        self.name = name
+
+class SystemCache:
+    """API key -> System lookup with TTL and negative caching of unknown keys."""
+
+    def __init__(self, max_size: int, ttl: float, negative_ttl: float):
+        self.systems = LRUCache(max_size=max_size, ttl=ttl)
+        self.unknown = LRUCache(max_size=max_size, ttl=negative_ttl)
+
+    def get(self, db, api_key: str):
+        """Returns a CachedSystem, or None if the key is invalid."""
+        found, system = self._lookup(api_key)
+        if found:
+            return system
+        row = db.query(models.System.id, models.System.name).filter(models.System.id == api_key).first()
+        return self._store(api_key, row)
+
+    async def get_async(self, db, api_key: str):
+        """get() with an AsyncSession."""
+        found, system = self._lookup(api_key)
+        if found:
+            return system
+        result = await db.execute(select(models.System.id, models.System.name).where(models.System.id == api_key))
+        return self._store(api_key, result.first())
+
+    def _lookup(self, api_key: str):
+        system = self.systems.get(api_key)
+        if system is not None:
+            return True, system
+        return self.unknown.get(api_key) is not None, None
+
+    def _store(self, api_key: str, row):
+        if row is None:
+            self.unknown.set(api_key, True)
+            return None
+        system = CachedSystem(row.id, row.name)
+        self.systems.set(api_key, system)
+        return system
+
+    def invalidate(self, api_key: str):
+        self.systems.invalidate(api_key)
+        self.unknown.invalidate(api_key)
+
+    def stats(self):
+        return {"systems": self.systems.stats(), "unknown_keys": self.unknown.stats()}
+
+system_cache = SystemCache(
+    max_size=SYSTEM_CACHE_SIZE,
+    ttl=SYSTEM_CACHE_TTL,
+    negative_ttl=SYSTEM_CACHE_NEGATIVE_TTL,
+)
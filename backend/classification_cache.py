@@ -0,0 +1,95 @@
+import os
+import time
+import hashlib
+import logging
+from datetime import datetime, timedelta, timezone
+from sqlalchemy.dialects import postgresql, sqlite
+import models
+from cache import LRUCache
+from fingerprint import normalized_message
+from database import SessionLocal
+
+# Setup logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+CLASSIFY_CACHE_SIZE = int(os.getenv("CLASSIFY_CACHE_SIZE", "50000"))
+CLASSIFY_CACHE_TTL = float(os.getenv("CLASSIFY_CACHE_TTL", "86400")) # seconds
+# Persist entries in the classification_cache table so they survive restarts
+CLASSIFY_CACHE_PERSIST = os.getenv("CLASSIFY_CACHE_PERSIST", "false").lower() == "true"
+
+def cache_key(log_content):
+    """
+    Content-addressed key: hash of the message with only timestamps and request
+    ids masked. Not the template id, which also masks numbers: 'GET /api 500' and
+    'GET /api 200' must not share a label.
+    """
+    return hashlib.sha1(normalized_message(log_content).encode("utf-8")).hexdigest()[:16]
+
+class ClassificationCache:
+    """Classification results keyed by normalized message hash, with optional DB write-through."""
+
+    def __init__(self, max_size: int, ttl: float, persist: bool):
+        self.persist = persist
+        self.entries = LRUCache(max_size=max_size, ttl=ttl)
+
+    def get(self, log_content):
+        return self.entries.get(cache_key(log_content))
+
+    def set(self, log_content, classification: str):
+        key = cache_key(log_content)
+        self.entries.set(key, classification)
+        return key
+
+    def save(self, key: str, classification: str):
+        """Writes one entry to the classification_cache table (blocking)."""
+        db = SessionLocal()
+        try:
+            dialect = postgresql if db.bind.dialect.name == "postgresql" else sqlite
+            stmt = dialect.insert(models.ClassificationCacheEntry).values(
+                key=key,
+                classification=classification,
+                created_at=datetime.now(timezone.utc)
+            )
+            stmt = stmt.on_conflict_do_update(
+                index_elements=["key"],
+                set_={"classification": stmt.excluded.classification, "created_at": stmt.excluded.created_at}
+            )
+            db.execute(stmt)
+            db.commit()
+        except Exception as e:
+            logger.error(f"Error persisting classification cache entry: {e}")
+            db.rollback()
+        finally:
+            db.close()
+
+    def load(self):
+        """Warms the in-memory cache with the newest non-expired persisted entries (blocking)."""
+        if not self.persist:
+            return 0
+        db = SessionLocal()
+        try:
+            query = db.query(models.ClassificationCacheEntry)
+            if self.entries.ttl:
+                cutoff = datetime.now(timezone.utc) - timedelta(seconds=self.entries.ttl)
+                query = query.filter(models.ClassificationCacheEntry.created_at >= cutoff)
+            rows = query.order_by(models.ClassificationCacheEntry.created_at.desc()) \
+                .limit(self.entries.max_size).all()
+        finally:
+            db.close()
+
+        # Oldest first so the newest end up as most recently used
+        for row in reversed(rows):
+            stored_at = row.created_at.timestamp() if row.created_at else time.time()
+            self.entries.set(row.key, row.classification, stored_at=stored_at)
+        logger.info(f"Loaded {len(rows)} persisted classification cache entries")
+        return len(rows)
+
+    def stats(self):
+        return {**self.entries.stats(), "persist": self.persist}
+
+classification_cache = ClassificationCache(
+    max_size=CLASSIFY_CACHE_SIZE,
+    ttl=CLASSIFY_CACHE_TTL,
+    persist=CLASSIFY_CACHE_PERSIST,
+)
@@ -0,0 +1,250 @@
+import os
+import time
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import or_, select, update
+import models
+import ai_service
+import discord_client
+from database import SessionLocal
+from log_writer import parse_legacy_content
+from live_tail import log_broadcaster
+from shared_state import shared_state
+from leadership import leader_election
+
+# Setup logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DISCORD_ERROR_CHANNEL_ID = os.getenv("DISCORD_ERROR_CHANNEL_ID")
+
+# When disabled, /webhook classifies inline like before
+ASYNC_CLASSIFICATION = os.getenv("ASYNC_CLASSIFICATION", "true").lower() == "true"
+CLASSIFY_QUEUE_MAX_SIZE = int(os.getenv("CLASSIFY_QUEUE_MAX_SIZE", "10000"))
+CLASSIFY_WORKERS = int(os.getenv("CLASSIFY_WORKERS", "4"))
+# Maximum classifications per second across all workers (0 = unlimited)
+CLASSIFY_MAX_PER_SECOND = float(os.getenv("CLASSIFY_MAX_PER_SECOND", "0"))
+# Seconds between sweeps for 'pending' rows that didn't fit in the queue
+CLASSIFY_RECOVERY_INTERVAL = float(os.getenv("CLASSIFY_RECOVERY_INTERVAL", "30"))
+CLASSIFY_SHUTDOWN_TIMEOUT = float(os.getenv("CLASSIFY_SHUTDOWN_TIMEOUT", "10"))
+# Seconds before the sweep takes back a claimed 'pending' log (its worker died or its queue was full)
+CLASSIFY_CLAIM_TIMEOUT = float(os.getenv("CLASSIFY_CLAIM_TIMEOUT", "300"))
+
+PENDING_LEVEL = "pending"
+ALERT_LEVELS = ["erro", "atenção"]
+
+class ClassificationJob:
+    """A stored log waiting for its AI classification."""
+    __slots__ = ("log_id", "system_id", "system_name", "message", "container", "template_id")
+
+    def __init__(self, log_id: int, system_id: str, system_name: str, message, container: str | None, template_id: str | None):
+        self.log_id = log_id
+        self.system_id = system_id
+        self.system_name = system_name
+        self.message = message
+        self.container = container
+        self.template_id = template_id
+
+class ClassificationQueue:
+    """
+    In-process asyncio work queue that classifies stored logs in the background.
+    Logs are written with level 'pending'; workers classify them, update Log.level
+    and send the Discord alert once the classification is known.
+    Rows that don't fit in the queue (or were left behind by a restart) stay
+    'pending' in the database and are picked up by the recovery sweep, which
+    only the leader runs. Rows are claimed (logs.claimed_at) when they are
+    queued, at ingest or by the sweep, so a row queued in one worker is never
+    swept into another; a claim older than CLASSIFY_CLAIM_TIMEOUT is taken back.
+    """
+
+    def __init__(self, max_size: int, workers: int, max_per_second: float):
+        self.max_size = max_size
+        self.workers = workers
+        self.max_per_second = max_per_second
+        self.queue = None
+        self._tasks = []
+        self._queued_ids = set()
+        self._overflowed = True # Sweep once on startup
+        self._next_slot = 0.0
+        self._rate_lock = None
+        self.processed = 0
+        self.failed = 0
+        self.dropped = 0
+        shared_state.subscribe("classification_recovery", self._recovery_requested)
+
+    @property
+    def running(self):
+        return bool(self._tasks)
+
+    def start(self):
+        if self.running:
+            return
+        self.queue = asyncio.Queue(maxsize=self.max_size)
+        self._rate_lock = asyncio.Lock()
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._recovery_loop()))
+        logger.info(f"Classification queue started with {self.workers} workers")
+
+    async def stop(self):
+        """Waits (bounded) for queued jobs to finish, then cancels the workers."""
+        if not self.running:
+            return
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout=CLASSIFY_SHUTDOWN_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning(f"Classification queue stopped with {self.queue.qsize()} jobs left (kept as pending)")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def enqueue(self, job: ClassificationJob):
+        """Returns False when the queue is full; the log stays 'pending' for the recovery sweep."""
+        if not self.running or job.log_id in self._queued_ids:
+            return False
+        try:
+            self.queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self.request_recovery()
+            self.dropped += 1
+            return False
+        self._queued_ids.add(job.log_id)
+        return True
+
+    def request_recovery(self):
+        """Makes the next recovery sweep load 'pending' logs written outside the queue."""
+        self._overflowed = True
+
+    def stats(self):
+        return {
+            "running": self.running,
+            "workers": self.workers,
+            "depth": self.queue.qsize() if self.queue else 0,
+            "max_size": self.max_size,
+            "max_per_second": self.max_per_second,
+            "processed": self.processed,
+            "failed": self.failed,
+            "overflowed": self.dropped,
+        }
+
+    async def _throttle(self):
+        if self.max_per_second <= 0:
+            return
+        async with self._rate_lock:
+            now = time.monotonic()
+            wait = self._next_slot - now
+            self._next_slot = max(now, self._next_slot) + 1.0 / self.max_per_second
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    async def _worker(self, worker_id: int):
+        while True:
+            # Take up to one AI batch worth of jobs so the batch classifier can merge them
+            jobs = [await self.queue.get()]
+            while len(jobs) < ai_service.AI_BATCH_SIZE and not self.queue.empty():
+                jobs.append(self.queue.get_nowait())
+            try:
+                for _ in jobs:
+                    await self._throttle()
+                results = await asyncio.gather(*(self._process(job) for job in jobs), return_exceptions=True)
+                for job, result in zip(jobs, results):
+                    if isinstance(result, Exception):
+                        self.failed += 1
+                        logger.error(f"Classification worker {worker_id} failed on log {job.log_id}: {result}")
+                    else:
+                        self.processed += 1
+            finally:
+                for job in jobs:
+                    self._queued_ids.discard(job.log_id)
+                    self.queue.task_done()
+
+    async def _process(self, job: ClassificationJob):
+        classification = await ai_service.classify_log(job.message)
+        if not await asyncio.to_thread(store_classification, job.log_id, classification):
+            return # Classified meanwhile by whoever took back a stale claim: no second alert
+        log_broadcaster.publish_level(job.log_id, job.system_id, classification)
+
+        if classification in ALERT_LEVELS and await discord_client.should_alert(job.system_id, job.template_id):
+            alert_msg = discord_client.build_alert_message(
+                job.system_name, job.log_id, job.container, job.message, classification
+            )
+            await discord_client.send_message(DISCORD_ERROR_CHANNEL_ID, alert_msg)
+
+    def _recovery_requested(self, _):
+        if leader_election.is_leader:
+            self._overflowed = True
+
+    async def _recovery_loop(self):
+        while True:
+            if self._overflowed and not leader_election.is_leader:
+                # Hand the sweep over to the leader (at most once per interval)
+                self._overflowed = False
+                shared_state.publish_soon("classification_recovery", None)
+            elif self._overflowed:
+                free = self.max_size - self.queue.qsize()
+                if free > 0:
+                    try:
+                        jobs = await asyncio.to_thread(claim_pending_jobs, free)
+                        # Only clear the flag once the backlog fits in the queue
+                        self._overflowed = len(jobs) >= free
+                        for job in jobs:
+                            self.enqueue(job)
+                    except Exception as e:
+                        logger.error(f"Error recovering pending logs: {e}")
+            await asyncio.sleep(CLASSIFY_RECOVERY_INTERVAL)
+
+def store_classification(log_id: int, classification: str):
+    """Sets the level of a still 'pending' log. Returns False if it was already classified."""
+    db = SessionLocal()
+    try:
+        updated = db.query(models.Log).filter(models.Log.id == log_id, models.Log.level == PENDING_LEVEL).update(
+            {models.Log.level: classification}, synchronize_session=False
+        )
+        db.commit()
+    finally:
+        db.close()
+    return updated > 0
+
+def claim_pending_jobs(limit: int):
+    """
+    Atomically claims up to `limit` logs still marked 'pending' (oldest first) that
+    no queue holds, or whose claim went stale, and returns them as classification jobs.
+    """
+    now = datetime.now(timezone.utc)
+    claimable = (
+        models.Log.level == PENDING_LEVEL,
+        or_(models.Log.claimed_at.is_(None), models.Log.claimed_at < now - timedelta(seconds=CLASSIFY_CLAIM_TIMEOUT)),
+    )
+    db = SessionLocal()
+    try:
+        candidates = select(models.Log.id).where(*claimable).order_by(models.Log.id).limit(limit)
+        if db.bind.dialect.name == "postgresql":
+            candidates = candidates.with_for_update(skip_locked=True)
+        # The conditions are repeated so a row classified or claimed in between is left alone
+        claimed_ids = db.scalars(
+            update(models.Log).where(models.Log.id.in_(candidates.scalar_subquery()), *claimable)
+            .values(claimed_at=now).returning(models.Log.id)
+        ).all()
+        db.commit()
+        rows = db.query(models.Log.id, models.Log.system_id, models.Log.template_id, models.Log.content,
+                        models.Log.legacy_content, models.System.name) \
+            .join(models.System, models.System.id == models.Log.system_id) \
+            .filter(models.Log.id.in_(claimed_ids)) \
+            .order_by(models.Log.id).all() if claimed_ids else []
+    finally:
+        db.close()
+
+    jobs = []
+    for log_id, system_id, template_id, content, legacy_content, system_name in rows:
+        data = content if content is not None else parse_legacy_content(legacy_content)
+        if not isinstance(data, dict):
+            data = {"message": data, "container": None}
+        jobs.append(ClassificationJob(log_id, system_id, system_name, data.get("message"), data.get("container"), template_id))
+    return jobs
+
+classification_queue = ClassificationQueue(
+    max_size=CLASSIFY_QUEUE_MAX_SIZE,
+    workers=CLASSIFY_WORKERS,
+    max_per_second=CLASSIFY_MAX_PER_SECOND,
+)
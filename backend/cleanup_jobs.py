@@ -0,0 +1,226 @@
+import os
+import uuid
+import asyncio
+import logging
+from datetime import datetime, timezone
+from sqlalchemy import func, or_, cast, delete, exists, Text
+import models
+import discord_client
+from database import SessionLocal
+from shared_state import shared_state
+from leadership import leader_election
+
+# Setup logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DISCORD_REPORT_CHANNEL_ID = os.getenv("DISCORD_REPORT_CHANNEL_ID")
+
+# logs.id range deleted per transaction
+CLEANUP_BATCH_SIZE = int(os.getenv("CLEANUP_BATCH_SIZE", "5000"))
+# Pause between batches, leaves room for ingestion on the same tables
+CLEANUP_BATCH_PAUSE_MS = float(os.getenv("CLEANUP_BATCH_PAUSE_MS", "50"))
+# Recent rows inspected by the dry-run estimate
+CLEANUP_ESTIMATE_SAMPLE = int(os.getenv("CLEANUP_ESTIMATE_SAMPLE", "2000"))
+
+ACTIVE_STATUSES = ["queued", "running"]
+
+def cleanup_filter(system_id: str, pattern: str):
+    """Logs of `system_id` whose content contains `pattern` (JSON payload or legacy text)."""
+    return (
+        models.Log.system_id == system_id,
+        or_(cast(models.Log.content, Text).contains(pattern), models.Log.legacy_content.contains(pattern)),
+    )
+
+def job_progress(job: models.Job):
+    if job.status == "completed":
+        return 1.0
+    if job.cursor is None or job.start_id is None or job.end_id is None:
+        return 0.0
+    return round(min(1.0, (job.cursor - job.start_id) / max(1, job.end_id - job.start_id + 1)), 4)
+
+def estimate_cleanup(db, system_id: str, pattern: str, sample_size: int = CLEANUP_ESTIMATE_SAMPLE):
+    """
+    Dry run: the system's row count (ix_logs_system_id_created_at) times the share
+    of matches among its most recent `sample_size` rows. Nothing is deleted.
+    """
+    total = db.query(func.count()).select_from(models.Log).filter(models.Log.system_id == system_id).scalar()
+    sample = db.query(models.Log.id).filter(models.Log.system_id == system_id) \
+        .order_by(models.Log.created_at.desc()).limit(sample_size).subquery()
+    sampled = db.query(func.count()).select_from(sample).scalar()
+    matches = db.query(func.count()).select_from(models.Log) \
+        .filter(models.Log.id.in_(db.query(sample.c.id)), *cleanup_filter(system_id, pattern)).scalar()
+    return {
+        "status": "dry_run",
+        "estimated_count": round(total * matches / sampled) if sampled else 0,
+        "system_logs": total,
+        "sample_size": sampled,
+        "sample_matches": matches,
+    }
+
+class CleanupJobs:
+    """
+    Runs retroactive cleanups in the background. Each job walks the logs.id range
+    that existed when it was created, deleting the matching rows of one batch per
+    transaction, and stores its cursor in the jobs table after every batch: the
+    progress is visible in GET /jobs/{id} and a restart resumes where it stopped.
+    Jobs run on the leader worker; the others hand new jobs over to it.
+    """
+
+    def __init__(self, batch_size: int, pause_ms: float):
+        self.batch_size = batch_size
+        self.pause_ms = pause_ms
+        self._tasks = {}
+        self.completed = 0
+        self.failed = 0
+        shared_state.subscribe("cleanup_jobs", self._job_submitted)
+
+    async def submit(self, system_id: str, pattern: str):
+        """Creates a cleanup job and starts it on the leader; returns the job row."""
+        job = await asyncio.to_thread(create_job, system_id, pattern)
+        if leader_election.is_leader:
+            self._start(job.id)
+        else:
+            # Left 'queued' if the message is lost: the next leader resumes it
+            await shared_state.publish("cleanup_jobs", {"job_id": job.id})
+        return job
+
+    def resume(self):
+        """Restarts the jobs left unfinished by a previous process or leader."""
+        db = SessionLocal()
+        try:
+            job_ids = [job_id for (job_id,) in db.query(models.Job.id).filter(
+                models.Job.kind == "cleanup", models.Job.status.in_(ACTIVE_STATUSES)
+            )]
+        finally:
+            db.close()
+        for job_id in job_ids:
+            logger.info(f"Resuming cleanup job {job_id}")
+            self._start(job_id)
+
+    async def stop(self):
+        """Cancels the running jobs; they keep their cursor and resume on the next start."""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks = {}
+
+    def stats(self):
+        return {
+            "running": len(self._tasks),
+            "completed": self.completed,
+            "failed": self.failed,
+            "batch_size": self.batch_size,
+            "pause_ms": self.pause_ms,
+        }
+
+    def _job_submitted(self, message: dict):
+        if leader_election.is_leader:
+            self._start(message["job_id"])
+
+    def _start(self, job_id: str):
+        if job_id not in self._tasks:
+            self._tasks[job_id] = asyncio.create_task(self._run(job_id))
+
+    async def _run(self, job_id: str):
+        try:
+            job = await asyncio.to_thread(start_job, job_id)
+            pattern = job.params["pattern"]
+            cursor = job.cursor
+            while cursor is not None and cursor <= job.end_id:
+                upper = min(cursor + self.batch_size, job.end_id + 1)
+                deleted, oldest = await asyncio.to_thread(delete_batch, job.system_id, pattern, cursor, upper)
+                if oldest is not None:
+                    shared_state.invalidate("rollups", oldest)
+                cursor = upper
+                await asyncio.to_thread(update_job, job_id, cursor=cursor, deleted=models.Job.deleted + deleted)
+                if self.pause_ms > 0:
+                    await asyncio.sleep(self.pause_ms / 1000)
+
+            job = await asyncio.to_thread(
+                update_job, job_id, status="completed", finished_at=datetime.now(timezone.utc)
+            )
+            self.completed += 1
+            logger.info(f"Cleanup job {job_id} removed {job.deleted} logs")
+            await send_cleanup_summary(job)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.failed += 1
+            logger.error(f"Cleanup job {job_id} failed: {e}")
+            await asyncio.to_thread(
+                update_job, job_id, status="failed", error=str(e), finished_at=datetime.now(timezone.utc)
+            )
+        finally:
+            self._tasks.pop(job_id, None)
+
+def create_job(system_id: str, pattern: str):
+    db = SessionLocal()
+    try:
+        job = models.Job(id=uuid.uuid4().hex, kind="cleanup", system_id=system_id,
+                         params={"pattern": pattern}, status="queued", deleted=0)
+        db.add(job)
+        db.commit()
+        db.refresh(job)
+        db.expunge(job)
+        return job
+    finally:
+        db.close()
+
+def start_job(job_id: str):
+    """Marks the job running; on its first start fixes the id range it will scan."""
+    db = SessionLocal()
+    try:
+        job = db.query(models.Job).filter(models.Job.id == job_id).one()
+        if job.cursor is None:
+            job.start_id, job.end_id = db.query(func.min(models.Log.id), func.max(models.Log.id)).one()
+            job.cursor = job.start_id
+        job.status = "running"
+        db.commit()
+        db.refresh(job)
+        db.expunge(job)
+        return job
+    finally:
+        db.close()
+
+def update_job(job_id: str, **values):
+    db = SessionLocal()
+    try:
+        db.query(models.Job).filter(models.Job.id == job_id).update(values, synchronize_session=False)
+        db.commit()
+        job = db.query(models.Job).filter(models.Job.id == job_id).one()
+        db.expunge(job)
+        return job
+    finally:
+        db.close()
+
+def delete_batch(system_id: str, pattern: str, lower: int, upper: int):
+    """Deletes the matching logs with lower <= id < upper. Returns (count, oldest created_at)."""
+    db = SessionLocal()
+    try:
+        stmt = delete(models.Log).where(
+            models.Log.id >= lower, models.Log.id < upper,
+            *cleanup_filter(system_id, pattern),
+            # Logs behind an incident report are kept
+            ~exists().where(models.Report.log_id == models.Log.id),
+        ).returning(models.Log.created_at).execution_options(synchronize_session=False)
+        created = [value for value in db.scalars(stmt) if value is not None]
+        db.commit()
+    finally:
+        db.close()
+    return len(created), min(created, default=None)
+
+async def send_cleanup_summary(job: models.Job):
+    db = SessionLocal()
+    try:
+        system_name = db.query(models.System.name).filter(models.System.id == job.system_id).scalar()
+    finally:
+        db.close()
+    discord_message = f"**🧹 RELATÓRIO DE LIMPEZA: {system_name}**\n\n" \
+                      f"Padrão removido: `{job.params['pattern']}`\n" \
+                      f"Total de itens excluídos: **{job.deleted}**\n\n" \
+                      f"Isso ajuda a manter o banco de dados otimizado."
+    await discord_client.send_message(DISCORD_REPORT_CHANNEL_ID, discord_message)
+
+cleanup_jobs = CleanupJobs(batch_size=CLEANUP_BATCH_SIZE, pause_ms=CLEANUP_BATCH_PAUSE_MS)
@@ -1,19 +1,168 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import DBAPIError, OperationalError, InterfaceError, DataError, IntegrityError, TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool, NullPool
+from contextlib import contextmanager
 import os
+import time
+import uuid
+import logging
 from dotenv import load_dotenv
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-if DATABASE_URL and DATABASE_URL.startswith("sqlite"):
-    engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
-else:
-    engine = create_engine(DATABASE_URL)
+# Pool settings apply per engine and per worker process: each uvicorn worker opens up to
+# 2 x (DB_POOL_SIZE + DB_MAX_OVERFLOW) connections (sync + async engine)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800")) # Seconds, -1 = never
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+# Server-side limit per statement (0 = none); migrations and index builds are exempt
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "0"))
+# Behind PgBouncer in transaction mode: no app-side pool and no prepared statement cache
+DB_PGBOUNCER = os.getenv("DB_PGBOUNCER", "false").lower() == "true"
+
+# asyncio drivers for the same database, used by the async request path (webhooks)
+ASYNC_DRIVERS = {"postgresql": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"}
+
+class PoolMetrics:
+    """Checkout wait times of one engine's connection pool."""
+
+    def __init__(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def observe(self, seconds: float):
+        self.checkouts += 1
+        self.wait_total += seconds
+        self.wait_max = max(self.wait_max, seconds)
+
+    def stats(self, pool):
+        stats = {
+            "pool": type(pool).__name__,
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "wait_ms_avg": round(self.wait_total / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+            "wait_ms_max": round(self.wait_max * 1000, 3),
+        }
+        if isinstance(pool, QueuePool):
+            stats.update({"size": pool.size(), "in_use": pool.checkedout(), "overflow": max(0, pool.overflow())})
+        return stats
+
+def metered(pool_class, metrics: PoolMetrics):
+    """`pool_class` recording in `metrics` how long each checkout waited for a connection."""
+    class MeteredPool(pool_class):
+        def _do_get(self):
+            start = time.perf_counter()
+            try:
+                return super()._do_get()
+            except PoolTimeoutError:
+                metrics.timeouts += 1
+                raise
+            finally:
+                metrics.observe(time.perf_counter() - start)
+
+    MeteredPool.__name__ = pool_class.__name__
+    return MeteredPool
+
+def engine_options(url, metrics: PoolMetrics, is_async: bool):
+    if url.get_backend_name() == "sqlite":
+        return {} if is_async else {"connect_args": {"check_same_thread": False}}
+
+    connect_args = {}
+    if DB_PGBOUNCER:
+        options = {"poolclass": NullPool}
+        if is_async:
+            # Prepared statements don't survive PgBouncer switching server connections
+            connect_args.update({
+                "statement_cache_size": 0,
+                "prepared_statement_cache_size": 0,
+                "prepared_statement_name_func": lambda: f"__asyncpg_{uuid.uuid4()}__",
+            })
+    else:
+        options = {
+            "poolclass": metered(AsyncAdaptedQueuePool if is_async else QueuePool, metrics),
+            "pool_size": DB_POOL_SIZE,
+            "max_overflow": DB_MAX_OVERFLOW,
+            "pool_timeout": DB_POOL_TIMEOUT,
+            "pool_recycle": DB_POOL_RECYCLE,
+            "pool_pre_ping": DB_POOL_PRE_PING,
+        }
+
+    if DB_STATEMENT_TIMEOUT_MS:
+        if DB_PGBOUNCER:
+            logger.warning("DB_STATEMENT_TIMEOUT_MS is ignored with DB_PGBOUNCER: set statement_timeout on the database role")
+        elif is_async:
+            connect_args["server_settings"] = {"statement_timeout": str(DB_STATEMENT_TIMEOUT_MS)}
+        else:
+            connect_args["options"] = f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"
+    if connect_args:
+        options["connect_args"] = connect_args
+    return options
+
+def async_database_url(url: str):
+    parsed = make_url(url)
+    return parsed.set(drivername=ASYNC_DRIVERS.get(parsed.get_backend_name(), parsed.drivername))
+
+pool_metrics = PoolMetrics()
+async_pool_metrics = PoolMetrics()
+
+engine = create_engine(DATABASE_URL, **engine_options(make_url(DATABASE_URL), pool_metrics, is_async=False))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+async_url = async_database_url(DATABASE_URL)
+async_engine = create_async_engine(async_url, **engine_options(async_url, async_pool_metrics, is_async=True))
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+# Errors raised by database calls: asyncpg raises plain OSErrors (connection refused, DNS)
+# when the server is down, PoolTimeoutError means every connection is busy
+DATABASE_ERRORS = (DBAPIError, OSError, PoolTimeoutError)
+
+# SQLSTATE classes that go away by themselves: connection exception, transaction rollback
+# (deadlock, serialization), insufficient resources, operator intervention, system error
+TRANSIENT_SQLSTATES = ("08", "40", "53", "57", "58")
+# Data exception, integrity constraint violation: the statement would fail the same way again
+DATA_SQLSTATES = ("22", "23")
+
+def error_sqlstate(exc):
+    """SQLSTATE of a database error (psycopg2 and asyncpg), or None."""
+    orig = getattr(exc, "orig", None)
+    return getattr(orig, "sqlstate", None) or getattr(orig, "pgcode", None)
+
+def is_connection_error(exc):
+    """
+    True when `exc` means the database is unreachable or overloaded, i.e. the
+    same write can succeed later (the ingest path spools it). False for errors
+    caused by the statement or its data.
+    """
+    if isinstance(exc, (OSError, PoolTimeoutError)):
+        return True
+    if not isinstance(exc, DBAPIError):
+        return False
+    if exc.connection_invalidated:
+        return True
+    sqlstate = error_sqlstate(exc)
+    if sqlstate:
+        return sqlstate[:2] in TRANSIENT_SQLSTATES
+    return isinstance(exc, (OperationalError, InterfaceError))
+
+def is_data_error(exc):
+    """True when the database rejected the values themselves (bad payload, out of range, NUL byte...)."""
+    if isinstance(exc, (DataError, IntegrityError)):
+        return True
+    sqlstate = error_sqlstate(exc)
+    return bool(sqlstate) and sqlstate[:2] in DATA_SQLSTATES
+
 Base = declarative_base()
 
 def get_db():
@@ -22,3 +171,58 @@ def get_db():
         yield db
     finally:
         db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+@contextmanager
+def maintenance_connection(bind=None):
+    """Autocommit connection without DB_STATEMENT_TIMEOUT_MS, for DDL that scans large tables."""
+    bind = bind or engine
+    with bind.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        exempt = DB_STATEMENT_TIMEOUT_MS and bind.dialect.name == "postgresql"
+        if exempt:
+            conn.execute(text("SET statement_timeout = 0"))
+        try:
+            yield conn
+        finally:
+            if exempt:
+                conn.execute(text("RESET statement_timeout"))
+
+@contextmanager
+def advisory_lock(key: int, wait: bool = True, bind=None):
+    """
+    Postgres session advisory lock held for the block, on its own connection, so
+    that only one process (worker, replica, CLI) runs the guarded DDL at a time.
+    Yields whether it was acquired: False without waiting when `wait` is False and
+    another process holds it. Other databases (SQLite, one process) always get True.
+    """
+    bind = bind or engine
+    if bind.dialect.name != "postgresql":
+        yield True
+        return
+    with bind.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        if wait:
+            conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": key})
+            acquired = True
+        else:
+            acquired = conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": key}).scalar()
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": key})
+
+def index_state(conn, name: str):
+    """Postgres: 'valid', 'invalid' (left by an interrupted CONCURRENTLY build) or None if missing."""
+    valid = conn.execute(text("SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:name)"), {"name": name}).first()
+    if valid is None:
+        return None
+    return "valid" if valid[0] else "invalid"
+
+def pool_stats():
+    return {
+        "sync": pool_metrics.stats(engine.pool),
+        "async": async_pool_metrics.stats(async_engine.sync_engine.pool),
+    }
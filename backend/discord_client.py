@@ -3,13 +3,19 @@ import logging
 import discord
 import asyncio
 import re
-import ai_service
+from report_jobs import report_jobs
+from cache import LRUCache
+from shared_state import shared_state
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 DISCORD_BOT_TOKEN = os.getenv("DISCORD_BOT_TOKEN")
+# Seconds during which repeated alerts for the same system + message template are suppressed (0 = off)
+ALERT_TEMPLATE_COOLDOWN = float(os.getenv("ALERT_TEMPLATE_COOLDOWN", "0"))
+
+recent_alerts = LRUCache(max_size=10000, ttl=ALERT_TEMPLATE_COOLDOWN)
 
 # Intent setup
 intents = discord.Intents.default()
@@ -31,7 +37,8 @@ class LogBotClient(discord.Client):
         # Check if the bot is mentioned OR if it's a direct reply or just specific keywords
         # User asked to just mention the bot with the ID.
         if self.user.mentioned_in(message):
-            content = message.content.lower()
+            # Drop the mentions themselves, their user ids would match as log ids
+            content = re.sub(r'<@[!&]?\d+>', '', message.content).lower()
             
             # Simple regex to find a number in the message
             # e.g. "@Bot 123", "analyze 123", "relatorio 123"
@@ -39,35 +46,22 @@ class LogBotClient(discord.Client):
             
             if match:
                 log_id = int(match.group(1))
-                await message.reply(f"🔍 Analisando log **#{log_id}**, aguarde um momento...")
-                
-                # We need the system_id logic. But generate_ai_report takes system_id and log_id.
-                # However, from the ID alone we might retrieve the log and find the system_id.
-                # Let's adjust ai_service to maybe fetch system_id from the log if we only have log_id?
-                # Or we can just look up the log first here.
-                # Actually, `ai_service.generate_ai_report` takes `system_id` AND `log_id`.
-                # Let's verify if we can get system_id from just log_id in DB.
-                # We don't have DB access here easily unless we import SessionLocal etc.
-                # Let's import it.
-                
-                from database import SessionLocal
-                from models import Log
-                
-                db = SessionLocal()
+                # e.g. "@Bot regenerar 123" asks for a fresh report
+                regenerate = "regenera" in content
                 try:
-                    log_entry = db.query(Log).filter(Log.id == log_id).first()
-                    if not log_entry:
+                    # Stored reports come back right away; new ones run in report_jobs
+                    result = await report_jobs.request(log_id, regenerate=regenerate, wait=False)
+                    if result["status"] == "not_found":
                         await message.reply(f"❌ Log #{log_id} não encontrado.")
                         return
-                    
-                    system_id = log_entry.system_id
-                    
-                    report = await ai_service.generate_ai_report(system_id, log_id)
-                    
-                    if report:
+                    if result["status"] == "queued":
+                        await message.reply(f"🔍 Analisando log **#{log_id}**, aguarde um momento...")
+                        result = await report_jobs.join(log_id)
+
+                    if result["content"]:
                         # Chunk the report if too long
                         header = f"📋 **RELATÓRIO TÉCNICO: Log #{log_id}**\n\n"
-                        full_msg = header + report
+                        full_msg = header + result["content"]
                         
                         if len(full_msg) > 2000:
                              # rudimentary chunking
@@ -81,32 +75,82 @@ class LogBotClient(discord.Client):
                 except Exception as e:
                     logger.error(f"Error executing command: {e}")
                     await message.reply("❌ Ocorreu um erro interno ao processar seu pedido.")
-                finally:
-                    db.close()
 
 bot_client = LogBotClient(intents=intents)
 
-async def start_bot():
-    """Starts the persistent Discord bot connection."""
+gateway_task = None
+
+async def login():
+    """
+    REST session used to send messages. Every worker logs in; only the leader
+    also opens the gateway connection that receives mentions (start_gateway).
+    """
     if not DISCORD_BOT_TOKEN:
         logger.error("DISCORD_BOT_TOKEN is not set")
         return
-    
+
+    try:
+        await asyncio.wait_for(bot_client.login(DISCORD_BOT_TOKEN), timeout=10)
+    except Exception as e:
+        logger.error(f"Error logging in the Discord bot: {e}")
+
+def start_gateway():
+    """Starts the persistent Discord bot connection (leader only)."""
+    global gateway_task
+    if DISCORD_BOT_TOKEN and gateway_task is None:
+        gateway_task = asyncio.create_task(connect_gateway())
+
+async def connect_gateway():
     try:
-        await bot_client.start(DISCORD_BOT_TOKEN)
+        await bot_client.connect()
     except Exception as e:
         logger.error(f"Error starting Discord bot: {e}")
 
+async def stop_gateway():
+    """Closes the gateway connection and falls back to a REST-only session."""
+    global gateway_task
+    if gateway_task is None:
+        return
+    await bot_client.close()
+    await asyncio.gather(gateway_task, return_exceptions=True)
+    gateway_task = None
+    bot_client.clear()
+    await login()
+
+async def close():
+    await bot_client.close()
+
+async def should_alert(system_id: str, template_id: str | None):
+    """Returns False if the same template already alerted for this system within the cooldown."""
+    if ALERT_TEMPLATE_COOLDOWN <= 0 or not template_id:
+        return True
+    key = (system_id, template_id)
+    if recent_alerts.get(key) is not None:
+        return False
+    recent_alerts.set(key, True)
+    # The local cache answers repeats in this worker, the shared key across workers
+    try:
+        return await shared_state.add(f"alert/{system_id}/{template_id}", True, ttl=ALERT_TEMPLATE_COOLDOWN)
+    except Exception as e:
+        logger.error(f"Error checking shared alert cooldown: {e}")
+        return True
+
+def build_alert_message(system_name: str, log_id: int, container: str, message, classification: str):
+    """Formats the alert sent to the error channel for 'erro' / 'atenção' logs."""
+    icon = "🔴" if classification == "erro" else "⚠️"
+
+    # "coloca pra ele enviar também o ID do log"
+    return f"{icon} **{classification.upper()}: {system_name}**\n" \
+           f"**Log ID:** `{log_id}`\n" \
+           f"Container: `{container}`\n" \
+           f"```{str(message)[:1000]}```\n" \
+           f"💡 *Para gerar relatório, marque-me com o ID: @LogBot {log_id}*"
+
 async def send_message(channel_id: str, content: str):
     """
     Sends a message using the persistent client if available.
     """
-    if not bot_client.is_ready():
-        logger.warning("Bot is not ready yet, attempting to wait or skip...")
-        # In a real app we might wait or queue. For now let's hope it connects fast.
-        # or we can use a temporary rest call if the bot gateway isn't ready?
-        # But `bot_client.start` should have been called.
-        pass
+    # Workers without the gateway connection send through the REST session (fetch_channel below)
 
     try:
         channel = bot_client.get_channel(int(channel_id))
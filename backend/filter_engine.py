@@ -0,0 +1,135 @@
+import os
+import re
+import logging
+from collections import deque
+from sqlalchemy import select
+import models
+from cache import LRUCache
+
+# Setup logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Compiled indexes are invalidated on add/delete (in every worker, see shared_state.py); the TTL bounds staleness if a message is lost
+FILTER_CACHE_TTL = float(os.getenv("FILTER_CACHE_TTL", "60"))
+FILTER_CACHE_SIZE = int(os.getenv("FILTER_CACHE_SIZE", "10000"))
+
+# Backreferences change meaning once group numbers shift inside a combined regex
+BACKREFERENCE = re.compile(r"\\[1-9]|\(\?P=")
+
+class AhoCorasick:
+    """Aho-Corasick automaton over literal patterns: finds whether any occurs in one pass."""
+
+    def __init__(self, patterns):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [False]
+        for pattern in patterns:
+            if pattern:
+                self._add(pattern)
+        self._build()
+
+    def _add(self, pattern: str):
+        node = 0
+        for char in pattern:
+            next_node = self.goto[node].get(char)
+            if next_node is None:
+                next_node = len(self.goto)
+                self.goto[node][char] = next_node
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append(False)
+            node = next_node
+        self.output[node] = True
+
+    def _build(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self.goto[node].items():
+                queue.append(child)
+                fail = self.fail[node]
+                while fail and char not in self.goto[fail]:
+                    fail = self.fail[fail]
+                self.fail[child] = self.goto[fail].get(char, 0)
+                self.output[child] = self.output[child] or self.output[self.fail[child]]
+
+    def search(self, text: str):
+        goto, fail, output = self.goto, self.fail, self.output
+        node = 0
+        for char in text:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if output[node]:
+                return True
+        return False
+
+class FilterIndex:
+    """Compiled filters of one system: literal patterns + one combined regex."""
+
+    def __init__(self, literals: list, regexes: list):
+        self.size = len(literals) + len(regexes)
+        self.automaton = AhoCorasick(literals) if literals else None
+        # Patterns that can't be combined (backreferences, global flags) run one by one
+        combinable = [p for p in regexes if not BACKREFERENCE.search(p)]
+        self.regexes = [re.compile(p) for p in regexes if BACKREFERENCE.search(p)]
+        if combinable:
+            try:
+                self.regexes.insert(0, re.compile("|".join(f"(?:{p})" for p in combinable)))
+            except re.error:
+                self.regexes.extend(re.compile(p) for p in combinable)
+
+    def matches(self, text: str):
+        if self.automaton is not None and self.automaton.search(text):
+            return True
+        return any(regex.search(text) for regex in self.regexes)
+
+EMPTY_INDEX = FilterIndex([], [])
+
+class FilterEngine:
+    """Per-system FilterIndex cache, loaded from log_filters on first use."""
+
+    def __init__(self, max_size: int, ttl: float):
+        self.indexes = LRUCache(max_size=max_size, ttl=ttl)
+
+    def get_index(self, db, system_id: str):
+        index = self.indexes.get(system_id)
+        if index is None:
+            filters = db.execute(filters_query(system_id)).all()
+            index = build_index(filters) if filters else EMPTY_INDEX
+            self.indexes.set(system_id, index)
+        return index
+
+    async def get_index_async(self, db, system_id: str):
+        """get_index() with an AsyncSession."""
+        index = self.indexes.get(system_id)
+        if index is None:
+            filters = (await db.execute(filters_query(system_id))).all()
+            index = build_index(filters) if filters else EMPTY_INDEX
+            self.indexes.set(system_id, index)
+        return index
+
+    def invalidate(self, system_id: str):
+        self.indexes.invalidate(system_id)
+
+    def stats(self):
+        return self.indexes.stats()
+
+def filters_query(system_id: str):
+    return select(models.LogFilter.pattern, models.LogFilter.is_regex).where(models.LogFilter.system_id == system_id)
+
+def build_index(filters):
+    literals, regexes = [], []
+    for pattern, is_regex in filters:
+        if not is_regex:
+            literals.append(pattern)
+            continue
+        try:
+            re.compile(pattern)
+            regexes.append(pattern)
+        except re.error as e:
+            logger.error(f"Ignoring invalid filter regex {pattern!r}: {e}")
+    return FilterIndex(literals, regexes)
+
+filter_engine = FilterEngine(max_size=FILTER_CACHE_SIZE, ttl=FILTER_CACHE_TTL)
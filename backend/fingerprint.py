@@ -0,0 +1,74 @@
+import re
+import json
+import hashlib
+
+# Masking rules, applied in a single pass (earlier rules win on overlaps).
+# Each variable token is replaced by its placeholder and kept as a parameter.
+MASK_RULES = [
+    ("TS", r"\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}(?:[.,]\d+)?(?:Z|[+-]\d{2}:?\d{2})?"),
+    ("DATE", r"\b\d{4}[-/]\d{2}[-/]\d{2}\b|\b\d{2}/\d{2}/\d{4}\b"),
+    ("TIME", r"\b\d{2}:\d{2}:\d{2}(?:[.,]\d+)?\b"),
+    ("UUID", r"\b[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}\b"),
+    ("EMAIL", r"\b[\w.+-]+@[\w-]+\.[\w.-]+\b"),
+    ("IP", r"\b(?:\d{1,3}\.){3}\d{1,3}(?::\d{1,5})?\b|\b(?:[0-9a-fA-F]{1,4}:){7}[0-9a-fA-F]{1,4}\b"),
+    ("HEX", r"\b0x[0-9a-fA-F]+\b|\b(?=[0-9a-fA-F]*\d)(?=[0-9a-fA-F]*[a-fA-F])[0-9a-fA-F]{8,}\b"),
+    # HTTP-like status codes carry meaning ("Error 500" vs "Error 404"), see STATUS_CONTEXT
+    ("STATUS", r"\b[1-5]\d{2}\b(?![.\w])"),
+    ("NUM", r"(?<![\w.])-?\d+(?:\.\d+)?"),
+]
+
+# A 3-digit number is only kept as a status code right after one of these words
+STATUS_CONTEXT = re.compile(r"(?:http\S*|status|code|error|erro|response|returned)\W{0,3}$", re.IGNORECASE)
+
+MASK_PATTERN = re.compile("|".join(f"(?P<{name}>{pattern})" for name, pattern in MASK_RULES))
+
+# Tokens that say when a message happened or which request it belongs to, never what it means
+VOLATILE_KINDS = ("TS", "DATE", "TIME", "UUID", "HEX")
+VOLATILE_PATTERN = re.compile("|".join(
+    f"(?P<{name}>{pattern})" for name, pattern in MASK_RULES if name in VOLATILE_KINDS
+))
+
+class Fingerprint:
+    """Template of a log message: variable tokens masked, plus the masked values."""
+    __slots__ = ("template", "template_id", "params")
+
+    def __init__(self, template: str, template_id: str, params: list):
+        self.template = template
+        self.template_id = template_id
+        self.params = params
+
+def message_text(message):
+    """Stable text form of a LogCreate.message (str or dict)."""
+    if isinstance(message, str):
+        return message
+    return json.dumps(message, default=str, sort_keys=True, ensure_ascii=False)
+
+def fingerprint(message):
+    """
+    Turns a log message into a template (e.g. 'Slow query detected: <NUM>s')
+    and a template id, so messages that only differ in numbers, ids, IPs or
+    timestamps share the same id.
+    """
+    params = []
+
+    def mask(match):
+        kind = match.lastgroup
+        if kind == "STATUS":
+            if STATUS_CONTEXT.search(match.string, max(0, match.start() - 24), match.start()):
+                return match.group()
+            kind = "NUM"
+        params.append(match.group())
+        return f"<{kind}>"
+
+    text = " ".join(message_text(message).split())
+    template = MASK_PATTERN.sub(mask, text)
+    template_id = hashlib.sha1(template.encode("utf-8")).hexdigest()[:16]
+    return Fingerprint(template, template_id, params)
+
+def normalized_message(message):
+    """
+    Message text with only timestamps and request ids masked. Unlike the template,
+    numbers (status codes, exit codes, counts) are kept: 'exit code 1' != 'exit code 0'.
+    """
+    text = " ".join(message_text(message).split())
+    return VOLATILE_PATTERN.sub(lambda match: f"<{match.lastgroup}>", text)
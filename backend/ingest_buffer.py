@@ -0,0 +1,290 @@
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from sqlalchemy import func, insert, text
+import models
+from database import SessionLocal, is_connection_error
+from log_writer import register_templates, remember_templates
+from spool import spool, spool_record, highest_spooled_id
+from classification_queue import classification_queue
+from live_tail import log_broadcaster
+
+# Setup logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# direct: one transaction per request (default) | buffered: write-behind with group commit
+INGEST_MODE = os.getenv("INGEST_MODE", "direct").lower()
+INGEST_BUFFER_SIZE = int(os.getenv("INGEST_BUFFER_SIZE", "50000"))
+INGEST_FLUSH_ROWS = int(os.getenv("INGEST_FLUSH_ROWS", "500"))
+INGEST_FLUSH_INTERVAL_MS = float(os.getenv("INGEST_FLUSH_INTERVAL_MS", "200"))
+# Number of log ids reserved from the database per allocation
+INGEST_ID_BLOCK = int(os.getenv("INGEST_ID_BLOCK", "1000"))
+INGEST_RETRY_DELAY = float(os.getenv("INGEST_RETRY_DELAY", "1"))
+
+class BufferFull(Exception):
+    """Raised when the write-behind buffer can't take more rows (caller answers 429)."""
+
+class IdAllocator:
+    """
+    Hands out log ids from ranges reserved in advance, so /webhook can return an
+    id before the row is written. On Postgres the range comes from the logs id
+    sequence; on SQLite (development) it continues from MAX(id) or the highest
+    id still in the spool, and assumes this process is the only writer while
+    buffered mode is on.
+    """
+
+    def __init__(self, block_size: int):
+        self.block_size = block_size
+        self._ids = deque()
+        self._lock = asyncio.Lock()
+
+    async def allocate(self, count: int):
+        async with self._lock:
+            if len(self._ids) < count:
+                self._ids.extend(await asyncio.to_thread(reserve_ids, max(count, self.block_size)))
+            return [self._ids.popleft() for _ in range(count)]
+
+_sqlite_next_id = 0
+
+def reserve_ids(count: int):
+    global _sqlite_next_id
+    db = SessionLocal()
+    try:
+        if db.bind.dialect.name == "postgresql":
+            rows = db.execute(
+                text("SELECT nextval(pg_get_serial_sequence('logs', 'id')) FROM generate_series(1, :n)"),
+                {"n": count}
+            ).scalars().all()
+            return sorted(rows)
+        current_max = db.query(func.coalesce(func.max(models.Log.id), 0)).scalar()
+        if not _sqlite_next_id:
+            # First block since startup: spooled rows hold ids the table doesn't have yet, and
+            # handing them out again would make the replay skip those rows as duplicates
+            current_max = max(current_max, highest_spooled_id())
+        start = max(_sqlite_next_id, current_max + 1)
+        _sqlite_next_id = start + count
+        return list(range(start, start + count))
+    finally:
+        db.close()
+
+class IngestBuffer:
+    """
+    Bounded in-memory write-behind buffer for /webhook. Rows get a pre-allocated
+    id on append and a background flusher writes them with one multi-row INSERT
+    every INGEST_FLUSH_ROWS rows or INGEST_FLUSH_INTERVAL_MS, whichever comes first.
+    Classification jobs are queued once their rows are committed.
+    """
+
+    def __init__(self, max_size: int, flush_rows: int, flush_interval_ms: float, id_block: int):
+        self.max_size = max_size
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.ids = IdAllocator(id_block)
+        self._entries = deque() # (row, fingerprint, classification job | None)
+        self._reserved = 0 # Slots taken by appends still waiting for their ids
+        self._wakeup = None
+        self._task = None
+        self._stopping = False
+        self.flushed_rows = 0
+        self.flushes = 0
+        self.rejected = 0
+        self.failed_flushes = 0
+        self.spooled_rows = 0
+        self.last_flush_ms = 0.0
+
+    @property
+    def running(self):
+        return self._task is not None
+
+    def start(self):
+        if self.running:
+            return
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._task = asyncio.create_task(self._flush_loop())
+        logger.info(f"Write-behind ingest buffer started (max {self.max_size} rows)")
+
+    async def stop(self):
+        """Drains everything still buffered before returning (graceful shutdown)."""
+        if not self.running:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        await self._task
+        self._task = None
+
+    def free_slots(self):
+        return self.max_size - len(self._entries) - self._reserved
+
+    async def append(self, entries: list):
+        """
+        Reserves ids for the given (row, fingerprint, job) entries and buffers
+        them all, or raises BufferFull without buffering any.
+        Returns the assigned log ids in order.
+        """
+        if self._stopping or len(entries) > self.free_slots():
+            self.rejected += len(entries)
+            raise BufferFull()
+
+        # Reserved before the await, so concurrent appends can't all pass the check above
+        self._reserved += len(entries)
+        try:
+            log_ids = await self.ids.allocate(len(entries))
+        finally:
+            self._reserved -= len(entries)
+        for (row, fp, job), log_id in zip(entries, log_ids):
+            row["id"] = log_id
+            if job is not None:
+                job.log_id = log_id
+            self._entries.append((row, fp, job))
+
+        if len(self._entries) >= self.flush_rows:
+            self._wakeup.set()
+        return log_ids
+
+    def stats(self):
+        return {
+            "mode": INGEST_MODE,
+            "running": self.running,
+            "depth": len(self._entries),
+            "max_size": self.max_size,
+            "flush_rows": self.flush_rows,
+            "flush_interval_ms": self.flush_interval * 1000,
+            "flushed_rows": self.flushed_rows,
+            "flushes": self.flushes,
+            "failed_flushes": self.failed_flushes,
+            "spooled_rows": self.spooled_rows,
+            "rejected": self.rejected,
+            "last_flush_ms": round(self.last_flush_ms, 2),
+        }
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                if await self._flush_pass():
+                    return
+            except Exception as e:
+                # An unexpected error must not kill the flusher: the buffer would only fill up
+                logger.exception(f"Ingest flusher failed, restarting: {e}")
+                await asyncio.sleep(INGEST_RETRY_DELAY)
+
+    async def _flush_pass(self):
+        """Waits for the next flush and writes what's due. Returns True once stopped and drained."""
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+        except asyncio.TimeoutError:
+            pass
+        self._wakeup.clear()
+
+        while self._entries:
+            if not await self._flush_once() and not self._stopping:
+                await asyncio.sleep(INGEST_RETRY_DELAY)
+                break
+            if self._stopping:
+                continue
+            if len(self._entries) < self.flush_rows:
+                break
+
+        return self._stopping and not self._entries
+
+    async def _flush_once(self):
+        count = min(len(self._entries), self.flush_rows)
+        batch = [self._entries[i] for i in range(count)]
+        start = time.perf_counter()
+        try:
+            try:
+                rejected = await asyncio.to_thread(write_entries, batch)
+            except Exception as e:
+                if is_connection_error(e):
+                    raise
+                # Bad data, not an outage: write row by row so one refused row doesn't hold up the rest
+                logger.warning(f"Flushing {count} buffered logs failed ({e}), retrying row by row")
+                rejected = await asyncio.to_thread(write_entries, batch, True)
+        except Exception as e:
+            self.failed_flushes += 1
+            logger.error(f"Error flushing {count} buffered logs: {e}")
+            if spool.enabled:
+                # Rows keep their ids in the spool; the replayer writes them once the
+                # database is back and the recovery sweep classifies them
+                if is_connection_error(e):
+                    spool.mark_db_unhealthy(e)
+                try:
+                    await spool.append([spool_record(row, fp) for row, fp, _ in batch])
+                except Exception as spool_error:
+                    # Disk full, fsync failure: keep the rows and retry like without a spool
+                    # (a partial write is replayed idempotently, the rows have their ids)
+                    logger.error(f"Error spooling {count} buffered logs: {spool_error}")
+                else:
+                    for _ in range(count):
+                        self._entries.popleft()
+                    self.spooled_rows += count
+                    return True
+            # Rows stay at the head of the buffer and are retried on the next pass
+            if self._stopping:
+                logger.error(f"Dropping {len(self._entries)} buffered logs on shutdown")
+                self._entries.clear()
+            return False
+
+        for _ in range(count):
+            self._entries.popleft()
+        if rejected:
+            try:
+                await asyncio.to_thread(spool.quarantine, [(spool_record(row, fp), error) for (row, fp, _), error in rejected])
+            except Exception as e:
+                logger.error(f"Error quarantining {len(rejected)} refused logs, dropping them: {e}")
+            refused = {id(entry) for entry, _ in rejected}
+            batch = [entry for entry in batch if id(entry) not in refused]
+        self.flushes += 1
+        self.flushed_rows += len(batch)
+        self.last_flush_ms = (time.perf_counter() - start) * 1000
+        log_broadcaster.publish_logs([row for row, _, _ in batch])
+
+        for _, _, job in batch:
+            if job is not None:
+                classification_queue.enqueue(job)
+        return True
+
+def write_entries(entries, isolate: bool = False):
+    """
+    Group commit: templates + all rows in one transaction (blocking). With
+    `isolate`, each row gets its own savepoint and the ones the database
+    refuses are returned as (entry, error) instead of failing the transaction.
+    """
+    db = SessionLocal()
+    rejected = []
+    try:
+        if not isolate:
+            template_ids = register_templates(db, [fp for _, fp, _ in entries])
+            db.execute(insert(models.Log), [row for row, _, _ in entries])
+        else:
+            template_ids = []
+            for entry in entries:
+                row, fp, _ = entry
+                try:
+                    with db.begin_nested():
+                        new_ids = register_templates(db, [fp])
+                        db.execute(insert(models.Log), [row])
+                except Exception as e:
+                    if is_connection_error(e):
+                        raise
+                    rejected.append((entry, e))
+                    continue
+                template_ids += new_ids
+        db.commit()
+        remember_templates(template_ids)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+    return rejected
+
+ingest_buffer = IngestBuffer(
+    max_size=INGEST_BUFFER_SIZE,
+    flush_rows=INGEST_FLUSH_ROWS,
+    flush_interval_ms=INGEST_FLUSH_INTERVAL_MS,
+    id_block=INGEST_ID_BLOCK,
+)
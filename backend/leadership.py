@@ -0,0 +1,94 @@
+import os
+import asyncio
+import logging
+from shared_state import shared_state, INSTANCE_ID
+
+# Setup logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Seconds a dead leader keeps its role before another worker takes over
+LEADER_LEASE_TTL = float(os.getenv("LEADER_LEASE_TTL", "15"))
+
+class LeaderElection:
+    """
+    Elects one worker among all processes sharing SHARED_STATE through a lease
+    renewed every third of its TTL. The leader runs the singleton work (Discord
+    gateway, schedulers, recovery sweeps); when it dies or can't renew, its
+    lease expires and another worker takes over. With SHARED_STATE=memory every
+    process is its own leader, which is only correct with a single worker.
+    """
+
+    def __init__(self, name: str, lease_ttl: float):
+        self.name = name
+        self.lease_ttl = lease_ttl
+        self.is_leader = False
+        self._on_elected = None
+        self._on_demoted = None
+        self._task = None
+        self._elected = asyncio.Event()
+        self.elections = 0
+
+    def start(self, on_elected, on_demoted):
+        """on_elected() / on_demoted() are coroutines run when this worker gains or loses the role."""
+        self._on_elected = on_elected
+        self._on_demoted = on_demoted
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        """Gives up the role at shutdown; the caller stops the leader's work itself."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self.is_leader:
+            self.is_leader = False
+            self._elected.clear()
+            try:
+                # Hand over right away instead of waiting for the lease to expire
+                await shared_state.release_lease(self.name)
+            except Exception as e:
+                logger.error(f"Error releasing leader lease: {e}")
+
+    async def wait_for_leadership(self, timeout: float):
+        """Sleeps up to `timeout` seconds, waking up as soon as this worker is the leader."""
+        try:
+            await asyncio.wait_for(self._elected.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def stats(self):
+        return {
+            "instance": INSTANCE_ID,
+            "is_leader": self.is_leader,
+            "lease_ttl": self.lease_ttl,
+            "elections": self.elections,
+        }
+
+    async def _loop(self):
+        while True:
+            try:
+                leader = await shared_state.acquire_lease(self.name, self.lease_ttl)
+            except Exception as e:
+                # Can't prove we still hold the lease: step down until we can
+                logger.error(f"Error renewing leader lease: {e}")
+                leader = False
+            if leader != self.is_leader:
+                await self._set_leader(leader)
+            await asyncio.sleep(self.lease_ttl / 3)
+
+    async def _set_leader(self, leader: bool):
+        self.is_leader = leader
+        if leader:
+            self._elected.set()
+            self.elections += 1
+            logger.info(f"Worker {INSTANCE_ID} elected leader")
+        else:
+            self._elected.clear()
+            logger.warning(f"Worker {INSTANCE_ID} is no longer the leader")
+        try:
+            await (self._on_elected() if leader else self._on_demoted())
+        except Exception as e:
+            logger.error(f"Error switching leader role: {e}")
+
+leader_election = LeaderElection(name="leader", lease_ttl=LEADER_LEASE_TTL)
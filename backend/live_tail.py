@@ -0,0 +1,257 @@
+import os
+import json
+import asyncio
+import logging
+import time
+import threading
+from collections import deque
+from datetime import datetime
+from fastapi.encoders import jsonable_encoder
+import models
+from database import SessionLocal
+from log_writer import read_log_content
+from shared_state import shared_state, INSTANCE_ID
+
+# Setup logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Events queued per client; a client that falls further behind is disconnected
+# (it reconnects with Last-Event-ID and resumes)
+LIVE_TAIL_CLIENT_BUFFER = int(os.getenv("LIVE_TAIL_CLIENT_BUFFER", "1000"))
+# Recent log events kept in memory to resume reconnecting clients without the database
+LIVE_TAIL_HISTORY = int(os.getenv("LIVE_TAIL_HISTORY", "2000"))
+LIVE_TAIL_HEARTBEAT = float(os.getenv("LIVE_TAIL_HEARTBEAT", "15"))
+# Distributed SHARED_STATE: events are relayed in one message per interval, only while
+# another worker has clients, and at most LIVE_TAIL_RELAY_MAX_EVENTS wait for the next one
+LIVE_TAIL_RELAY_INTERVAL_MS = float(os.getenv("LIVE_TAIL_RELAY_INTERVAL_MS", "200"))
+LIVE_TAIL_RELAY_MAX_EVENTS = int(os.getenv("LIVE_TAIL_RELAY_MAX_EVENTS", "5000"))
+# Seconds a worker's client count stays registered without being refreshed
+LIVE_TAIL_LISTENERS_TTL = float(os.getenv("LIVE_TAIL_LISTENERS_TTL", "15"))
+# After a worker gets its first client, the others need this long to start relaying:
+# its history only serves resumes from events received after that
+LIVE_TAIL_RELAY_GRACE = 2.0
+
+# Shared hash: worker -> number of /logs/stream clients
+LISTENERS_KEY = "live_tail_listeners"
+
+class Subscriber:
+    __slots__ = ("system_id", "queue", "dropped")
+
+    def __init__(self, system_id: str | None, buffer_size: int):
+        self.system_id = system_id
+        self.queue = asyncio.Queue(maxsize=buffer_size)
+        self.dropped = False
+
+class LogBroadcaster:
+    """
+    Fan-out of ingest events to the /logs/stream clients. Events are built from
+    the rows the ingest path just wrote, so live views never query the database.
+    With a distributed SHARED_STATE they are relayed to the other workers too,
+    so a client sees every log whichever worker it's connected to. Relaying
+    only happens while some other worker has clients (registered in the
+    LISTENERS_KEY hash), in coalesced messages with at most one in flight.
+    publish() may be called from worker threads.
+    """
+
+    def __init__(self, buffer_size: int, history_size: int):
+        self.buffer_size = buffer_size
+        self.history = deque(maxlen=history_size) # (log_id, event) of recent 'log' events
+        self._subscribers = set()
+        self._loop = None
+        self._lock = threading.Lock()
+        self.published = 0
+        self.dropped_clients = 0
+        self._task = None
+        self._relay_pending = []
+        self._remote_listeners = False # Another worker has clients: relay our events
+        self._next_listeners_sync = 0.0
+        self._history_since = 0.0
+        self._registered = False
+        self.relayed = 0
+        self.relay_dropped = 0
+        shared_state.subscribe("live_tail", self._receive)
+        shared_state.subscribe("live_tail_listeners", self._listeners_joined)
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        if shared_state.distributed:
+            self._task = asyncio.create_task(self._relay_loop())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        try:
+            await shared_state.hdel(LISTENERS_KEY, INSTANCE_ID)
+        except Exception as e:
+            logger.error(f"Error unregistering live tail clients: {e}")
+
+    def subscribe(self, system_id: str | None = None):
+        subscriber = Subscriber(system_id, self.buffer_size)
+        self._subscribers.add(subscriber)
+        if len(self._subscribers) == 1 and self._task is not None:
+            # The other workers weren't relaying to us: our history has gaps until they do
+            with self._lock:
+                self.history.clear()
+            self._history_since = time.monotonic() + LIVE_TAIL_RELAY_GRACE
+            self._next_listeners_sync = 0.0
+            shared_state.publish_soon("live_tail_listeners", INSTANCE_ID)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        self._subscribers.discard(subscriber)
+        if not self._subscribers:
+            self._next_listeners_sync = 0.0
+
+    def replay(self, last_id: int, system_id: str | None = None):
+        """
+        Log events after `last_id` still in memory, or None when the history no
+        longer reaches back that far (the caller then reads the database).
+        """
+        with self._lock:
+            history = list(self.history)
+        # Relayed events may arrive slightly out of order: look at the lowest id
+        if not history or min(log_id for log_id, _ in history) > last_id + 1:
+            return None
+        return [event for log_id, event in history
+                if log_id > last_id and (system_id is None or event["system_id"] == system_id)]
+
+    def publish_logs(self, rows, log_ids=None):
+        """'log' events for freshly stored rows (build_log_row dicts); ids default to row['id']."""
+        if log_ids is None:
+            log_ids = [row.get("id") for row in rows]
+        events = [log_event(row, log_id) for row, log_id in zip(rows, log_ids) if log_id is not None]
+        if events:
+            self._remember(events)
+            self._dispatch(events)
+
+    def publish_level(self, log_id: int, system_id: str, level: str):
+        """The classification of a log changed ('pending' -> result)."""
+        self._dispatch([{"type": "level", "id": log_id, "system_id": system_id, "level": level}])
+
+    def publish_status(self, log_id: int, system_id: str, status: str):
+        """Progress of the AI report of a log (see report_jobs.ANALYSIS_STATUS)."""
+        self._dispatch([{"type": "status", "id": log_id, "system_id": system_id, "status": status}])
+
+    def stats(self):
+        return {
+            "clients": len(self._subscribers),
+            "published": self.published,
+            "dropped_clients": self.dropped_clients,
+            "history": len(self.history),
+            "relayed": self.relayed,
+            "relay_dropped": self.relay_dropped,
+            "remote_listeners": self._remote_listeners,
+        }
+
+    def _remember(self, events):
+        if time.monotonic() < self._history_since:
+            return
+        with self._lock:
+            self.history.extend((event["id"], event) for event in events if event["type"] == "log")
+
+    def _receive(self, events):
+        """Events relayed by another worker (runs in the event loop)."""
+        self._remember(events)
+        self._fan_out(events, relay=False)
+
+    def _dispatch(self, events):
+        if self._loop is None:
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            self._fan_out(events)
+        else:
+            self._loop.call_soon_threadsafe(self._fan_out, events)
+
+    def _listeners_joined(self, _):
+        self._remote_listeners = True
+
+    async def _relay_loop(self):
+        while True:
+            await asyncio.sleep(LIVE_TAIL_RELAY_INTERVAL_MS / 1000)
+            try:
+                if time.monotonic() >= self._next_listeners_sync:
+                    await self._sync_listeners()
+                events, self._relay_pending = self._relay_pending, []
+                if events and self._remote_listeners:
+                    await shared_state.publish("live_tail", events)
+                    self.relayed += len(events)
+            except Exception as e:
+                logger.error(f"Error relaying live tail events: {e}")
+
+    async def _sync_listeners(self):
+        """Registers this worker's client count and checks whether another worker has clients."""
+        self._next_listeners_sync = time.monotonic() + LIVE_TAIL_LISTENERS_TTL / 3
+        if self._subscribers:
+            await shared_state.hset(LISTENERS_KEY, INSTANCE_ID, len(self._subscribers), ttl=LIVE_TAIL_LISTENERS_TTL)
+            self._registered = True
+        elif self._registered:
+            await shared_state.hdel(LISTENERS_KEY, INSTANCE_ID)
+            self._registered = False
+        listeners = await shared_state.hgetall(LISTENERS_KEY)
+        self._remote_listeners = any(count for worker, count in listeners.items() if worker != INSTANCE_ID)
+
+    def _fan_out(self, events, relay: bool = True):
+        self.published += len(events)
+        if relay and self._task is not None and self._remote_listeners:
+            if len(self._relay_pending) + len(events) > LIVE_TAIL_RELAY_MAX_EVENTS:
+                self.relay_dropped += len(events)
+            else:
+                self._relay_pending.extend(events)
+        for subscriber in list(self._subscribers):
+            if subscriber.dropped:
+                continue
+            for event in events:
+                if subscriber.system_id is not None and event["system_id"] != subscriber.system_id:
+                    continue
+                try:
+                    subscriber.queue.put_nowait(event)
+                except asyncio.QueueFull:
+                    # Slow consumer: stop feeding it, its stream ends and the client resumes
+                    subscriber.dropped = True
+                    self.dropped_clients += 1
+                    break
+
+def log_event(row: dict, log_id: int):
+    created_at = row.get("created_at")
+    return {
+        "type": "log",
+        "id": log_id,
+        "system_id": row["system_id"],
+        "content": row.get("content"),
+        "level": row.get("level"),
+        "container": row.get("container"),
+        "created_at": created_at.isoformat() if isinstance(created_at, datetime) else created_at,
+    }
+
+def load_backlog(last_id: int, system_id: str | None = None, limit: int = LIVE_TAIL_HISTORY):
+    """'log' events after `last_id` from the database, for clients resuming past the history."""
+    db = SessionLocal()
+    try:
+        query = db.query(models.Log).filter(models.Log.id > last_id)
+        if system_id:
+            query = query.filter(models.Log.system_id == system_id)
+        logs = query.order_by(models.Log.id).limit(limit).all()
+        return [
+            log_event({"system_id": log.system_id, "content": read_log_content(log), "level": log.level,
+                       "container": log.container, "created_at": log.created_at}, log.id)
+            for log in logs
+        ]
+    finally:
+        db.close()
+
+def format_sse(event: dict):
+    """One Server-Sent Events frame; log events carry their id for Last-Event-ID resume."""
+    data = json.dumps(jsonable_encoder(event), ensure_ascii=False)
+    if event["type"] == "log":
+        return f"id: {event['id']}\nevent: log\ndata: {data}\n\n"
+    return f"event: {event['type']}\ndata: {data}\n\n"
+
+log_broadcaster = LogBroadcaster(buffer_size=LIVE_TAIL_CLIENT_BUFFER, history_size=LIVE_TAIL_HISTORY)
@@ -0,0 +1,433 @@
+import os
+import re
+import time
+import httpx
+import random
+import asyncio
+import logging
+import importlib.util
+from abc import ABC, abstractmethod
+from local_classifier import local_classifier
+
+# Setup logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Provider and model used for each task: openai | ollama | stub (deterministic, offline).
+# E.g. LLM_CLASSIFY_PROVIDER=ollama with LLM_REPORT_PROVIDER=openai classifies on our own hardware
+LLM_CLASSIFY_PROVIDER = os.getenv("LLM_CLASSIFY_PROVIDER", "openai").lower()
+LLM_CLASSIFY_MODEL = os.getenv("LLM_CLASSIFY_MODEL") # Default: the provider's default model
+LLM_REPORT_PROVIDER = os.getenv("LLM_REPORT_PROVIDER", "openai").lower()
+LLM_REPORT_MODEL = os.getenv("LLM_REPORT_MODEL")
+
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+# Any OpenAI-compatible endpoint, e.g. a local stub server in tests
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
+OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+# How long Ollama keeps the model loaded after a call, so classifications don't pay the load time
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+# A local model serves few requests at once; the rest wait here instead of in Ollama
+OLLAMA_MAX_CONCURRENCY = int(os.getenv("OLLAMA_MAX_CONCURRENCY", "2"))
+
+DEFAULT_MODELS = {"openai": "gpt-4o-mini", "ollama": "llama3.2:1b", "stub": "stub"}
+
+# Shared HTTP clients: pooled keep-alive connections, HTTP/2 when the h2 package is installed
+LLM_HTTP2 = os.getenv("LLM_HTTP2", "true").lower() == "true"
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "20"))
+# Requests in flight per provider (retries included)
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+# Client-side request budget until the provider's rate-limit headers take over (0 = headers only)
+LLM_REQUESTS_PER_MINUTE = float(os.getenv("LLM_REQUESTS_PER_MINUTE", "0"))
+# Requests wait for the token window to reset below this many remaining tokens
+LLM_TOKEN_HEADROOM = int(os.getenv("LLM_TOKEN_HEADROOM", "1000"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_BACKOFF_BASE_MS = float(os.getenv("LLM_BACKOFF_BASE_MS", "500"))
+LLM_BACKOFF_MAX_MS = float(os.getenv("LLM_BACKOFF_MAX_MS", "20000"))
+# Consecutive failed calls that open the circuit, and seconds it stays open
+LLM_BREAKER_THRESHOLD = int(os.getenv("LLM_BREAKER_THRESHOLD", "5"))
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Errors that say the provider is unusable, not that this one request was wrong
+BREAKER_STATUSES = RETRY_STATUSES | {401, 403}
+
+class LLMError(Exception):
+    """An LLM call failed (after retries); callers fall back to their default."""
+
+class CircuitOpenError(LLMError):
+    """The circuit breaker is open: the call was not attempted."""
+
+def parse_duration(value: str | None):
+    """OpenAI reset durations ('1s', '6m0s', '250ms') -> seconds, or None."""
+    if not value:
+        return None
+    parts = re.findall(r"(\d+(?:\.\d+)?)(ms|h|m|s)", value)
+    if not parts:
+        return None
+    scale = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    return sum(float(amount) * scale[unit] for amount, unit in parts)
+
+def parse_retry_after(headers):
+    """Seconds to wait from Retry-After / retry-after-ms, or None."""
+    if headers.get("retry-after-ms"):
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    try:
+        return float(headers["retry-after"]) if headers.get("retry-after") else None
+    except ValueError:
+        return None # HTTP-date form: use our own backoff
+
+def header_int(headers, name: str):
+    try:
+        return int(headers[name]) if headers.get(name) else None
+    except ValueError:
+        return None
+
+class TokenBucket:
+    """
+    Request budget of the LLM provider. Starts from LLM_REQUESTS_PER_MINUTE and
+    follows the x-ratelimit-* headers of every response: the per-minute limit
+    sets the refill rate, the remaining counts cap the bucket, and an exhausted
+    request or token window blocks every caller until its reset.
+    """
+
+    def __init__(self, per_minute: float):
+        self.rate = per_minute / 60 # Requests per second, 0 = unlimited
+        self.capacity = max(1.0, per_minute)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = asyncio.Lock()
+        self.waits = 0
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                wait = self.blocked_until - now
+                if wait <= 0 and self.rate > 0:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+                elif wait <= 0:
+                    return
+                self.waits += 1
+                await asyncio.sleep(wait)
+
+    def pause(self, seconds: float):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def update(self, headers):
+        limit = header_int(headers, "x-ratelimit-limit-requests")
+        if limit:
+            self.rate = limit / 60
+            self.capacity = float(limit)
+        remaining = header_int(headers, "x-ratelimit-remaining-requests")
+        if remaining is not None:
+            self.tokens = min(self.tokens, float(remaining))
+            if remaining == 0:
+                self.pause(parse_duration(headers.get("x-ratelimit-reset-requests")) or 1.0)
+        remaining_tokens = header_int(headers, "x-ratelimit-remaining-tokens")
+        if remaining_tokens is not None and remaining_tokens < LLM_TOKEN_HEADROOM:
+            self.pause(parse_duration(headers.get("x-ratelimit-reset-tokens")) or 1.0)
+
+class CircuitBreaker:
+    """
+    Opens after `threshold` consecutive failed calls; while open, calls fail
+    immediately. After `cooldown` seconds one trial call is let through: it
+    closes the circuit on success or reopens it on failure.
+    """
+
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._trial_at = None # Start of the trial call let through while half open
+        self.opens = 0
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if time.monotonic() - self.opened_at >= self.cooldown else "open"
+
+    def allow(self):
+        state = self.state
+        if state == "closed":
+            return True
+        now = time.monotonic()
+        # A trial that never reported back (e.g. cancelled) doesn't block the next one forever
+        if state == "half_open" and (self._trial_at is None or now - self._trial_at >= self.cooldown):
+            self._trial_at = now
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._trial_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.failures >= self.threshold:
+            if self.state != "open":
+                self.opens += 1
+                logger.warning(f"LLM circuit open for {self.cooldown}s after {self.failures} failures")
+            self.opened_at = time.monotonic()
+        self._trial_at = None
+
+class HTTPProvider(ABC):
+    """
+    Long-lived client for a chat API over HTTP. It keeps pooled keep-alive
+    connections, caps requests in flight, paces them by the provider's
+    rate-limit headers, retries 429/5xx with jittered exponential backoff and
+    stops calling a failing provider for a while (circuit breaker), so callers
+    fall back fast. Subclasses define the endpoint and the wire format.
+    """
+
+    name = None
+    path = None
+
+    def __init__(self, base_url: str, headers: dict, max_concurrency: int, max_connections: int,
+                 requests_per_minute: float, max_retries: int):
+        self.base_url = base_url.rstrip("/")
+        self.headers = headers
+        self.max_connections = max_connections
+        self.max_retries = max_retries
+        self.bucket = TokenBucket(requests_per_minute)
+        self.breaker = CircuitBreaker(LLM_BREAKER_THRESHOLD, LLM_BREAKER_COOLDOWN)
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._client = None
+        self.in_flight = 0
+        self.requests = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.failures = 0
+        self.short_circuited = 0
+
+    @abstractmethod
+    def build_payload(self, messages: list, model: str, temperature: float, max_tokens: int | None):
+        """JSON body of a chat request."""
+
+    @abstractmethod
+    def parse_content(self, data: dict):
+        """Reply text out of the decoded response body."""
+
+    def _http(self):
+        if self._client is None:
+            http2 = LLM_HTTP2 and importlib.util.find_spec("h2") is not None
+            if LLM_HTTP2 and not http2:
+                logger.warning("LLM_HTTP2 is on but the h2 package is missing, using HTTP/1.1")
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers={"Content-Type": "application/json", **self.headers},
+                limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections),
+                http2=http2,
+            )
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def chat(self, messages: list, model: str, temperature: float = 0.0,
+                   max_tokens: int | None = None, timeout: float = 10.0):
+        """Returns the reply text; raises LLMError (CircuitOpenError when not attempted)."""
+        if not self.breaker.allow():
+            self.short_circuited += 1
+            raise CircuitOpenError(f"{self.name} circuit breaker is open")
+
+        payload = self.build_payload(messages, model, temperature, max_tokens)
+        error = None
+        async with self._semaphore:
+            self.in_flight += 1
+            try:
+                for attempt in range(self.max_retries + 1):
+                    if attempt:
+                        self.retries += 1
+                    await self.bucket.acquire()
+                    self.requests += 1
+                    retry_after = None
+                    try:
+                        response = await self._http().post(self.path, json=payload, timeout=timeout)
+                    except httpx.TransportError as e: # Connection failures and timeouts
+                        error = e
+                    else:
+                        self.bucket.update(response.headers)
+                        if response.status_code < 400:
+                            self.breaker.record_success()
+                            return self.parse_content(response.json())
+                        error = LLMError(f"HTTP {response.status_code}: {response.text[:200]}")
+                        if response.status_code not in RETRY_STATUSES:
+                            if response.status_code in BREAKER_STATUSES:
+                                self._failed()
+                            else:
+                                self.breaker.record_success() # The provider answered, the request was bad
+                            raise error
+                        retry_after = parse_retry_after(response.headers)
+                        if response.status_code == 429:
+                            self.rate_limited += 1
+                            self.bucket.pause(retry_after if retry_after is not None else self.backoff(attempt))
+                    if attempt < self.max_retries:
+                        await asyncio.sleep(retry_after if retry_after is not None else self.backoff(attempt))
+            finally:
+                self.in_flight -= 1
+
+        self._failed()
+        raise LLMError(f"{self.name} call failed after {self.max_retries + 1} attempts: {error!r}")
+
+    def backoff(self, attempt: int):
+        """Full jitter: uniform in [0, min(max, base * 2^attempt)] seconds."""
+        return random.uniform(0, min(LLM_BACKOFF_MAX_MS, LLM_BACKOFF_BASE_MS * 2 ** attempt)) / 1000
+
+    def stats(self):
+        return {
+            "base_url": self.base_url,
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "retries": self.retries,
+            "rate_limited": self.rate_limited,
+            "failures": self.failures,
+            "short_circuited": self.short_circuited,
+            "circuit": self.breaker.state,
+            "circuit_opens": self.breaker.opens,
+            "rate_limit_waits": self.bucket.waits,
+        }
+
+    def _failed(self):
+        self.failures += 1
+        self.breaker.record_failure()
+
+class OpenAIProvider(HTTPProvider):
+    """OpenAI chat completions API, or any endpoint compatible with it."""
+
+    name = "openai"
+    path = "/chat/completions"
+
+    def build_payload(self, messages: list, model: str, temperature: float, max_tokens: int | None):
+        payload = {"model": model, "messages": messages, "temperature": temperature}
+        if max_tokens is not None:
+            payload["max_tokens"] = max_tokens
+        return payload
+
+    def parse_content(self, data: dict):
+        return data["choices"][0]["message"]["content"]
+
+class OllamaProvider(HTTPProvider):
+    """Local Ollama server (native /api/chat), keeping the model loaded between calls."""
+
+    name = "ollama"
+    path = "/api/chat"
+
+    def build_payload(self, messages: list, model: str, temperature: float, max_tokens: int | None):
+        options = {"temperature": temperature}
+        if max_tokens is not None:
+            options["num_predict"] = max_tokens
+        return {"model": model, "messages": messages, "stream": False, "keep_alive": OLLAMA_KEEP_ALIVE, "options": options}
+
+    def parse_content(self, data: dict):
+        return data["message"]["content"]
+
+class StubProvider:
+    """
+    Deterministic offline provider for tests and air-gapped runs: classification
+    prompts are answered with the local keyword rules (one 'N. category' line per
+    numbered log in batch prompts), anything else with a fixed report built from
+    the prompt. Never touches the network.
+    """
+
+    name = "stub"
+
+    def __init__(self):
+        self.requests = 0
+
+    async def chat(self, messages: list, model: str, temperature: float = 0.0,
+                   max_tokens: int | None = None, timeout: float = 10.0):
+        self.requests += 1
+        system = " ".join(m["content"] for m in messages if m["role"] == "system")
+        prompt = messages[-1]["content"]
+        if "log classifier" not in system:
+            return f"Relatório gerado pelo provedor stub (modelo '{model}').\n\n{prompt[:1000]}"
+
+        # The first line is the instruction, the logs follow
+        body = prompt.split("\n", 1)[1] if "\n" in prompt else prompt
+        numbered = [re.match(r"^(\d+)\.\s?(.*)$", line) for line in body.splitlines()]
+        if numbered and all(numbered):
+            return "\n".join(f"{m.group(1)}. {stub_category(m.group(2))}" for m in numbered)
+        return stub_category(body)
+
+    async def aclose(self):
+        pass
+
+    def stats(self):
+        return {"requests": self.requests}
+
+def stub_category(text: str):
+    category, _, _ = local_classifier.predict(text)
+    return category or "normal"
+
+def create_provider(name: str):
+    if name == "ollama":
+        return OllamaProvider(
+            base_url=OLLAMA_BASE_URL,
+            headers={},
+            max_concurrency=OLLAMA_MAX_CONCURRENCY,
+            max_connections=LLM_MAX_CONNECTIONS,
+            requests_per_minute=0,
+            max_retries=LLM_MAX_RETRIES,
+        )
+    if name == "stub":
+        return StubProvider()
+    return OpenAIProvider(
+        base_url=OPENAI_BASE_URL,
+        headers={"Authorization": f"Bearer {OPENAI_API_KEY}"},
+        max_concurrency=LLM_MAX_CONCURRENCY,
+        max_connections=LLM_MAX_CONNECTIONS,
+        requests_per_minute=LLM_REQUESTS_PER_MINUTE,
+        max_retries=LLM_MAX_RETRIES,
+    )
+
+class LLMRouter:
+    """
+    Sends each task ('classify', 'report') to its configured provider and model.
+    Tasks routed to the same provider share its client, connection pool,
+    rate limit and circuit breaker.
+    """
+
+    def __init__(self, routes: dict):
+        """routes: task -> (provider name, model or None for the provider's default)."""
+        self.providers = {}
+        self.routes = {}
+        for task, (name, model) in routes.items():
+            if name not in DEFAULT_MODELS:
+                logger.warning(f"Unknown LLM provider '{name}' for '{task}', using openai")
+                name = "openai"
+            if name not in self.providers:
+                self.providers[name] = create_provider(name)
+            self.routes[task] = (name, model or DEFAULT_MODELS[name])
+
+    async def chat(self, task: str, messages: list, **kwargs):
+        name, model = self.routes[task]
+        return await self.providers[name].chat(messages, model=model, **kwargs)
+
+    async def aclose(self):
+        for provider in self.providers.values():
+            await provider.aclose()
+
+    def stats(self):
+        return {
+            "routes": {task: f"{name}:{model}" for task, (name, model) in self.routes.items()},
+            "providers": {name: provider.stats() for name, provider in self.providers.items()},
+        }
+
+llm_router = LLMRouter(routes={
+    "classify": (LLM_CLASSIFY_PROVIDER, LLM_CLASSIFY_MODEL),
+    "report": (LLM_REPORT_PROVIDER, LLM_REPORT_MODEL),
+})
@@ -0,0 +1,146 @@
+import os
+import re
+import sqlite3
+import logging
+from fingerprint import fingerprint
+
+# Optional dependency: without scikit-learn only the rule tier is used
+try:
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.pipeline import make_pipeline
+except ImportError:
+    make_pipeline = None
+
+# Setup logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+LOCAL_CLASSIFIER = os.getenv("LOCAL_CLASSIFIER", "true").lower() == "true"
+# Below this confidence the log goes to the LLM
+LOCAL_CLASSIFIER_THRESHOLD = float(os.getenv("LOCAL_CLASSIFIER_THRESHOLD", "0.8"))
+# Labeled set built by tools/generate_finetune_data.py (training_logs table)
+LOCAL_MODEL_DB = os.getenv("LOCAL_MODEL_DB", "finetune_logs.db")
+LOCAL_MODEL_MIN_SAMPLES = int(os.getenv("LOCAL_MODEL_MIN_SAMPLES", "50"))
+
+# Confidence given to a rule match when only one category matched
+RULE_CONFIDENCE = 0.9
+# ... and when several categories matched (left for the model / LLM by default)
+RULE_CONFLICT_CONFIDENCE = 0.5
+
+# Keyword rules per category, in priority order (used to break ties)
+RULES = [
+    ("erro", r"\b(?:errors?|erro|exception|traceback|fatal|critical|crash(?:ed)?|panic|segfault|"
+             r"fail(?:ed|ure)?|falh(?:a|ou)|refused|unreachable|timed out|timeout|out of memory|oom|"
+             r"(?:http|status|code|error)\W{0,3}5\d{2})\b"),
+    ("atenção", r"\b(?:warn(?:ing)?|aten[çc][ãa]o|deprecated?|slow|lento|retry(?:ing)?|"
+                r"high (?:cpu|memory|load|latency)|suspicious|unauthorized|forbidden|denied|"
+                r"failed (?:to )?log ?in|login failed|invalid (?:password|credentials|token)|"
+                r"(?:http|status|code)\W{0,3}4\d{2})\b"),
+    ("sucesso", r"\b(?:success(?:ful(?:ly)?)?|sucesso|conclu[íi]d[oa]|completed?|passed|"
+                r"(?:http|status|code)\W{0,3}2\d{2})\b"),
+    ("normal", r"\b(?:heartbeat|health ?check|healthy|ping|listening|debug)\b"),
+]
+
+COMPILED_RULES = [(category, re.compile(pattern, re.IGNORECASE)) for category, pattern in RULES]
+
+class LocalClassifier:
+    """
+    In-process classifier tier used before the LLM: a compiled keyword rule set,
+    then (when trained) a TF-IDF + logistic regression model over message templates.
+    """
+
+    def __init__(self, threshold: float):
+        self.threshold = threshold
+        self.model = None
+        self.rule_hits = 0
+        self.model_hits = 0
+        self.misses = 0
+
+    def classify_rules(self, text: str):
+        matched = [category for category, pattern in COMPILED_RULES if pattern.search(text)]
+        if not matched:
+            return None, 0.0
+        confidence = RULE_CONFIDENCE if len(matched) == 1 else RULE_CONFLICT_CONFIDENCE
+        return matched[0], confidence
+
+    def classify_model(self, text: str):
+        if self.model is None:
+            return None, 0.0
+        probabilities = self.model.predict_proba([text])[0]
+        best = probabilities.argmax()
+        return self.model.classes_[best], float(probabilities[best])
+
+    def predict(self, message):
+        """Returns (category, confidence, tier) from the most confident tier, ignoring the threshold."""
+        text = fingerprint(message).template
+        category, confidence = self.classify_rules(text)
+        if confidence >= self.threshold:
+            return category, confidence, "rules"
+
+        model_category, model_confidence = self.classify_model(text)
+        if model_confidence > confidence:
+            return model_category, model_confidence, "model"
+        return category, confidence, "rules"
+
+    def classify(self, message):
+        """Returns a category, or None when no tier is confident enough."""
+        category, confidence, tier = self.predict(message)
+        if category is None or confidence < self.threshold:
+            self.misses += 1
+            return None
+        if tier == "rules":
+            self.rule_hits += 1
+        else:
+            self.model_hits += 1
+        return category
+
+    def train(self, messages: list, labels: list):
+        if make_pipeline is None:
+            logger.warning("scikit-learn is not installed, local model tier disabled")
+            return False
+        model = make_pipeline(
+            TfidfVectorizer(analyzer="char_wb", ngram_range=(3, 5), sublinear_tf=True, min_df=2),
+            LogisticRegression(max_iter=1000, class_weight="balanced")
+        )
+        model.fit([fingerprint(m).template for m in messages], labels)
+        self.model = model
+        return True
+
+    def train_from_db(self, path: str):
+        """Trains the model tier from the training_logs table of a finetune_logs.db file."""
+        if not os.path.exists(path):
+            return 0
+        conn = sqlite3.connect(path)
+        try:
+            rows = conn.execute("SELECT message, category FROM training_logs").fetchall()
+        finally:
+            conn.close()
+        if len(rows) < LOCAL_MODEL_MIN_SAMPLES:
+            logger.warning(f"Only {len(rows)} labeled logs in {path}, local model tier disabled")
+            return 0
+        if not self.train([m for m, _ in rows], [c for _, c in rows]):
+            return 0
+        logger.info(f"Local classifier model trained on {len(rows)} labeled logs")
+        return len(rows)
+
+    def load(self):
+        """Trains the model tier at startup if the labeled set is available (blocking)."""
+        if not LOCAL_CLASSIFIER:
+            return
+        try:
+            self.train_from_db(LOCAL_MODEL_DB)
+        except Exception as e:
+            logger.error(f"Error training local classifier: {e}")
+
+    def stats(self):
+        return {
+            "enabled": LOCAL_CLASSIFIER,
+            "threshold": self.threshold,
+            "model_loaded": self.model is not None,
+            "rule_hits": self.rule_hits,
+            "model_hits": self.model_hits,
+            "misses": self.misses,
+        }
+
+local_classifier = LocalClassifier(threshold=LOCAL_CLASSIFIER_THRESHOLD)
@@ -0,0 +1,108 @@
+import json
+from sqlalchemy import insert
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+import models, schemas
+from cache import LRUCache
+
+# Template ids already known to be in log_templates (saves a write per log)
+known_templates = LRUCache(max_size=100000)
+
+def strip_nul(value):
+    """
+    Removes NUL characters from strings, also inside dicts and lists. Postgres
+    refuses them in text and JSONB, and container output often has some.
+    """
+    if isinstance(value, str):
+        return value.replace("\x00", "")
+    if isinstance(value, dict):
+        return {strip_nul(k): strip_nul(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [strip_nul(v) for v in value]
+    return value
+
+def log_payload(log: schemas.LogCreate):
+    """Structured log payload stored in the JSON content column."""
+    return {
+        "message": strip_nul(log.message),
+        "container": strip_nul(log.container)
+    }
+
+def parse_legacy_content(text: str):
+    """
+    Payload of a row written before the JSON column (Text holding json.dumps output).
+    An escaped \\u0000 in that text would make the JSON column refuse the backfilled row.
+    """
+    try:
+        data = json.loads(text)
+    except (TypeError, ValueError):
+        data = None
+    if not isinstance(data, dict):
+        data = {"message": text, "container": None}
+    return strip_nul(data)
+
+def read_log_content(log):
+    """Payload of a Log row, whether or not the backfill already reached it."""
+    if log.content is None and log.legacy_content is not None:
+        return parse_legacy_content(log.legacy_content)
+    return log.content
+
+def build_log_row(system_id: str, log: schemas.LogCreate, fp, classification: str, now, claimed: bool = False):
+    """
+    Column values for one logs row, as used by the bulk insert paths. `claimed`:
+    the row goes straight to a classification queue, the recovery sweep must skip it.
+    """
+    return {
+        "system_id": system_id,
+        "content": log_payload(log),
+        "level": classification,
+        "template_id": fp.template_id,
+        "container": strip_nul(log.container),
+        "created_at": log.created_at or now,
+        "claimed_at": now if claimed else None,
+    }
+
+def new_templates(fingerprints):
+    """log_templates rows for templates not known to be stored yet."""
+    new = {}
+    for fp in fingerprints:
+        if fp.template_id not in new and known_templates.get(fp.template_id) is None:
+            new[fp.template_id] = {"id": fp.template_id, "template": strip_nul(fp.template)}
+    return list(new.values())
+
+def templates_insert(dialect_name: str):
+    dialect = postgresql if dialect_name == "postgresql" else sqlite
+    return dialect.insert(models.LogTemplate).on_conflict_do_nothing(index_elements=["id"])
+
+def register_templates(db: Session, fingerprints):
+    """
+    Inserts unseen message templates into log_templates (ignores ones already stored).
+    Returns their ids: pass them to remember_templates() once the transaction commits.
+    """
+    rows = new_templates(fingerprints)
+    if rows:
+        db.execute(templates_insert(db.bind.dialect.name), rows)
+    return [row["id"] for row in rows]
+
+async def register_templates_async(db: AsyncSession, fingerprints):
+    """register_templates for the async request path."""
+    rows = new_templates(fingerprints)
+    if rows:
+        await db.execute(templates_insert(db.bind.dialect.name), rows)
+    return [row["id"] for row in rows]
+
+def remember_templates(template_ids):
+    """Marks committed templates as stored; a rolled back insert must not be cached."""
+    for template_id in template_ids:
+        known_templates.set(template_id, True)
+
+def insert_log_rows(db: Session, rows: list):
+    """Writes all rows with one multi-row INSERT ... RETURNING; returns the ids in row order."""
+    stmt = insert(models.Log).returning(models.Log.id, sort_by_parameter_order=True)
+    return db.scalars(stmt, rows).all()
+
+async def insert_log_rows_async(db: AsyncSession, rows: list):
+    """insert_log_rows for the async request path."""
+    stmt = insert(models.Log).returning(models.Log.id, sort_by_parameter_order=True)
+    return (await db.scalars(stmt, rows)).all()
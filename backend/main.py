@@ -1,29 +1,60 @@
-from fastapi import FastAPI, Depends, HTTPException, Header, Request, status, BackgroundTasks
+from fastapi import FastAPI, Depends, HTTPException, Header, Request, Response, status, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import func, tuple_
+from pydantic import ValidationError
+import re
 import secrets
 import string
 import os
 import json
 import httpx
 import asyncio
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import models, schemas
 import discord_client
 import ai_service
-from database import engine, get_db, SessionLocal
+from fingerprint import fingerprint, message_text
+from filter_engine import filter_engine
+from auth_cache import system_cache
+from ingest_buffer import ingest_buffer, BufferFull, INGEST_MODE
+from spool import spool, spool_record, SPOOL_MODE
+from migrations import run_migrations, build_indexes, backfill_log_payloads, SCHEMA_LOCK_KEY
+from timeseries import format_bucket
+from search import setup_search, build_search_index, search_logs
+from pagination import encode_cursor, decode_cursor, parse_cursor_datetime
+from response_cache import cached_json_response, stats_responses, systems_responses, reports_responses
+from rollups import rollup_compactor, stats_from_rollups, log_counts, ROLLUPS
+from partitioning import check_partitioning, partition_conversion, LOG_PARTITIONING
+from retention import retention_scheduler, RETENTION
+from cleanup_jobs import cleanup_jobs, estimate_cleanup, job_progress
+from report_jobs import report_jobs, ANALYSIS_STATUS
+from live_tail import log_broadcaster, load_backlog, format_sse, LIVE_TAIL_HEARTBEAT
+from shared_state import shared_state
+from leadership import leader_election
+from log_writer import read_log_content, build_log_row, register_templates_async, remember_templates, insert_log_rows_async
+from classification_cache import classification_cache
+from local_classifier import local_classifier
+from classification_queue import classification_queue, ClassificationJob, ASYNC_CLASSIFICATION, PENDING_LEVEL, ALERT_LEVELS
+from database import engine, async_engine, get_db, get_async_db, SessionLocal, DATABASE_ERRORS, PoolTimeoutError, pool_stats, is_connection_error, is_data_error, advisory_lock
 
 # Create tables with retry logic
 import time
-from sqlalchemy.exc import OperationalError
+from sqlalchemy.exc import OperationalError, DBAPIError
 
 MAX_RETRIES = 60
 RETRY_DELAY = 1
 
 for i in range(MAX_RETRIES):
     try:
-        models.Base.metadata.create_all(bind=engine)
+        # One worker at a time: concurrent CREATE/ALTER TABLE from several workers collide
+        with advisory_lock(SCHEMA_LOCK_KEY):
+            models.Base.metadata.create_all(bind=engine)
+            run_migrations(engine)
+            setup_search(engine)
+            check_partitioning(engine)
         print("Database connected and tables created.")
         break
     except OperationalError:
@@ -42,19 +73,99 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
 
 MASTER_KEY = os.getenv("MASTER_KEY")
 DISCORD_ERROR_CHANNEL_ID = os.getenv("DISCORD_ERROR_CHANNEL_ID")
 DISCORD_REPORT_CHANNEL_ID = os.getenv("DISCORD_REPORT_CHANNEL_ID")
 
-# Status tracking for logs being analyzed by AI
-analyzing_logs = {}
+# Batch ingestion limits
+WEBHOOK_BATCH_MAX_ITEMS = int(os.getenv("WEBHOOK_BATCH_MAX_ITEMS", "5000"))
+WEBHOOK_BATCH_AI_CONCURRENCY = int(os.getenv("WEBHOOK_BATCH_AI_CONCURRENCY", "10"))
+
+# Page size cap for GET /logs
+LOGS_MAX_LIMIT = int(os.getenv("LOGS_MAX_LIMIT", "1000"))
+
+def invalidate_system(system_id):
+    system_cache.invalidate(system_id)
+    systems_responses.clear()
+
+# Caches every worker drops on shared_state.invalidate()
+shared_state.on_invalidate("filters", filter_engine.invalidate)
+shared_state.on_invalidate("systems", invalidate_system)
+shared_state.on_invalidate("reports", lambda _: reports_responses.clear())
+shared_state.on_invalidate("rollups", rollup_compactor.invalidate_since)
 
 @app.on_event("startup")
 async def startup_event():
-    # Start Discord Bot in background
-    asyncio.create_task(discord_client.start_bot())
+    await shared_state.start()
+    log_broadcaster.start()
+    # REST session for alerts; the leader also connects the gateway
+    await discord_client.login()
+    await asyncio.to_thread(classification_cache.load)
+    await asyncio.to_thread(local_classifier.load)
+    if ASYNC_CLASSIFICATION:
+        classification_queue.start()
+    if INGEST_MODE == "buffered":
+        ingest_buffer.start()
+    if SPOOL_MODE != "off":
+        spool.start()
+    leader_election.start(on_elected=start_leader_tasks, on_demoted=stop_leader_tasks)
+    # Both run in every worker but only work on the leader
+    if ROLLUPS:
+        rollup_compactor.start()
+    if RETENTION:
+        retention_scheduler.start()
+
+async def start_leader_tasks():
+    """Singleton work of the elected worker (see leadership.py)."""
+    discord_client.start_gateway()
+    # Postgres indexes are built CONCURRENTLY while the API serves traffic, not at boot
+    asyncio.create_task(asyncio.to_thread(build_indexes, engine, build_search_index))
+    # Rows from before the JSON content column are converted in the background
+    asyncio.create_task(asyncio.to_thread(backfill_log_payloads, engine))
+    classification_queue.request_recovery()
+    await asyncio.to_thread(cleanup_jobs.resume)
+
+async def stop_leader_tasks():
+    await discord_client.stop_gateway()
+    await cleanup_jobs.stop()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await leader_election.stop()
+    # Flush buffered rows first: the flush queues their classification jobs
+    await ingest_buffer.stop()
+    await classification_queue.stop()
+    await spool.stop()
+    await rollup_compactor.stop()
+    await retention_scheduler.stop()
+    await cleanup_jobs.stop()
+    await report_jobs.stop()
+    await log_broadcaster.stop()
+    await discord_client.close()
+    await ai_service.llm_router.aclose()
+    await shared_state.stop()
+    await async_engine.dispose()
+
+@app.exception_handler(DBAPIError)
+@app.exception_handler(ConnectionError) # asyncpg: server unreachable
+async def database_error_handler(request: Request, exc: Exception):
+    if is_data_error(exc):
+        # The values themselves were refused (e.g. out of range): retrying won't help
+        return JSONResponse(status_code=422, content={"detail": "Rejected by the database: invalid log data"})
+    if not is_connection_error(exc):
+        print(f"Database error on {request.url.path}: {exc}")
+        return JSONResponse(status_code=500, content={"detail": "Internal Server Error"})
+    # e.g. an uncached API key while the database is down: ask the agent to retry
+    spool.mark_db_unhealthy(exc)
+    return JSONResponse(status_code=503, content={"detail": "Database unavailable"}, headers={"Retry-After": "5"})
+
+@app.exception_handler(PoolTimeoutError)
+async def pool_timeout_handler(request: Request, exc: PoolTimeoutError):
+    # Every pooled connection stayed busy for DB_POOL_TIMEOUT: shed load instead of a 500
+    return JSONResponse(status_code=503, content={"detail": "Database busy"}, headers={"Retry-After": "1"})
 
 def generate_system_id():
     """Generates a key like pbpm-<random_64_chars>"""
@@ -87,11 +198,13 @@ def register_system(
         client_phone=system.client_phone,
         maintenance_email=system.maintenance_email,
         status=system.status,
-        technical_info=system.technical_info
+        technical_info=system.technical_info,
+        retention_days=system.retention_days
     )
     db.add(db_system)
     db.commit()
     db.refresh(db_system)
+    shared_state.invalidate("systems", db_system.id)
     return db_system
 
 @app.put("/systems/{system_id}", response_model=schemas.SystemResponse)
@@ -110,6 +223,7 @@ def update_system(
     
     db.commit()
     db.refresh(db_system)
+    shared_state.invalidate("systems", system_id)
     return db_system
 
 @app.get("/systems/{system_id}", response_model=schemas.SystemResponse)
@@ -124,134 +238,423 @@ async def collect_log(
     log: schemas.LogCreate, 
     background_tasks: BackgroundTasks,
     x_api_key: str = Header(..., alias="x-api-key"),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    system = db.query(models.System).filter(models.System.id == x_api_key).first()
+    system = await system_cache.get_async(db, x_api_key)
     if not system:
         raise HTTPException(status_code=401, detail="Invalid API Key")
 
-    # Store structured data in the content column
-    log_data = {
-        "message": log.message,
-        "container": log.container
-    }
-    content_str = json.dumps(log_data, default=str)
-    
     # --- LOG FILTERING LOGIC ---
-    filters = db.query(models.LogFilter).filter(models.LogFilter.system_id == system.id).all()
-    for f in filters:
-        if f.pattern in log.message:
-            return {"status": "filtered", "message": "Log blocked by system filter"}
+    filters = await filter_engine.get_index_async(db, system.id)
+    if filters.size and filters.matches(message_text(log.message)):
+        return {"status": "filtered", "message": "Log blocked by system filter"}
     # ---------------------------
 
-    # 1. Classify with AI immediately
-    classification = await ai_service.classify_log_with_ai(log.message)
-    
-    new_log = models.Log(
-        system_id=system.id,
-        content=content_str,
-        level=classification, # Store the AI classification
-    )
-    if log.created_at:
-        new_log.created_at = log.created_at
+    fp = fingerprint(log.message)
 
-    db.add(new_log)
-    db.commit()
-    db.refresh(new_log)
-    
-    # 2. Handle Alerts - BUT NO AUTO REPORT
-    if classification in ["erro", "atenção"]:
-        # Send Alert to ERROR Channel with Call to Action
-        icon = "🔴" if classification == "erro" else "⚠️"
-        
-        # User requested: send the mention to him (e.g. @Helios) if possible, but we don't know his ID here.
-        # He said "enviar a marcação dele".
-        # For now we will just put a generic message, or we can tag a role if checking env var?
-        # The user's request: "Eu vou enviar a marcação dele (@Helios ali) e ele vai responder..."
-        # It implies he will mention the bot.
-        # But for the alert the bot sends, he wants the bot to send the ID.
-        
-        # "coloca pra ele enviar também o ID do log"
-        
-        alert_msg = f"{icon} **{classification.upper()}: {system.name}**\n" \
-                    f"**Log ID:** `{new_log.id}`\n" \
-                    f"Container: `{log.container}`\n" \
-                    f"```{log.message[:1000]}```\n" \
-                    f"💡 *Para gerar relatório, marque-me com o ID: @LogBot {new_log.id}*"
+    # 1. Classify with AI inline only when the background queue is disabled
+    if classification_queue.running:
+        classification = PENDING_LEVEL
+        job = ClassificationJob(None, system.id, system.name, log.message, log.container, fp.template_id)
+    else:
+        classification = await ai_service.classify_log(log.message)
+        job = None
+
+    row = build_log_row(system.id, log, fp, classification, datetime.now(timezone.utc), claimed=job is not None)
+    log_id = None
+    status_label = None
+    if not spool.diverting:
+        try:
+            if ingest_buffer.running:
+                # Write-behind: the row gets its id now and is group-committed by the flusher,
+                # which also queues the classification job once the row exists
+                try:
+                    [log_id] = await ingest_buffer.append([(row, fp, job)])
+                except BufferFull:
+                    raise HTTPException(status_code=429, detail="Ingest buffer full, retry later", headers={"Retry-After": "1"})
+                status_label = "accepted"
+            else:
+                template_ids = await register_templates_async(db, [fp])
+                # Structured payload in the JSON content column, the AI classification as level and
+                # an explicit created_at (the keyset cursor of /logs must match the stored value)
+                new_log = models.Log(**row)
+                db.add(new_log)
+                await db.commit()
+                remember_templates(template_ids)
+                log_id = new_log.id
+                status_label = "stored"
+                log_broadcaster.publish_logs([row], [log_id])
+
+                # 2. Queue AI classification; the worker sends the alert once the level is known
+                if job is not None:
+                    job.log_id = log_id
+                    classification_queue.enqueue(job)
+        except DATABASE_ERRORS as e:
+            # Only an unreachable database is spooled: rejected data would fail the replay too
+            if not spool.enabled or not is_connection_error(e):
+                raise
+            await db.rollback()
+            spool.mark_db_unhealthy(e)
+
+    if status_label is None:
+        # Database down (or SPOOL_MODE=always): the replayer writes the row later and
+        # the classification queue picks it up from there while it is still 'pending'
+        await spool.append([spool_record(row, fp)])
+        status_label = "spooled"
 
+    # 3. Handle Alerts - BUT NO AUTO REPORT
+    if classification in ALERT_LEVELS and await discord_client.should_alert(system.id, fp.template_id):
+        alert_msg = discord_client.build_alert_message(system.name, log_id, log.container, log.message, classification)
         background_tasks.add_task(discord_client.send_message, DISCORD_ERROR_CHANNEL_ID, alert_msg)
         
     return {
-        "status": "stored", 
-        "log_id": new_log.id, 
+        "status": status_label, 
+        "log_id": log_id, 
         "classification": classification,
         "triggered_report": False # No auto report anymore
     }
 
+async def parse_log_batch(request: Request):
+    """
+    Parses a batch body, either a JSON array or an NDJSON stream (one log per line).
+    Returns a list of (LogCreate | None, error | None) in request order.
+    """
+    raw = await request.body()
+    content_type = request.headers.get("content-type", "")
+
+    if "ndjson" in content_type or "jsonlines" in content_type:
+        try:
+            items = [json.loads(line) for line in raw.splitlines() if line.strip()]
+        except json.JSONDecodeError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid NDJSON body: {e}")
+    else:
+        try:
+            items = json.loads(raw)
+        except json.JSONDecodeError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid JSON body: {e}")
+        if not isinstance(items, list):
+            raise HTTPException(status_code=400, detail="Batch body must be a JSON array or NDJSON stream")
+
+    if len(items) > WEBHOOK_BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Batch too large ({len(items)} items, max {WEBHOOK_BATCH_MAX_ITEMS})"
+        )
+
+    parsed = []
+    for item in items:
+        try:
+            parsed.append((schemas.LogCreate.model_validate(item), None))
+        except ValidationError as e:
+            parsed.append((None, e.errors(include_url=False)))
+    return parsed
+
+@app.post("/webhook/batch")
+async def collect_log_batch(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    x_api_key: str = Header(..., alias="x-api-key"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Bulk version of /webhook: authenticates once, filters in memory and writes
+    every surviving log with a single multi-row INSERT in one transaction.
+    """
+    system = await system_cache.get_async(db, x_api_key)
+    if not system:
+        raise HTTPException(status_code=401, detail="Invalid API Key")
+
+    parsed = await parse_log_batch(request)
+    filters = await filter_engine.get_index_async(db, system.id)
+
+    results = [None] * len(parsed)
+    accepted = [] # (index, LogCreate)
+    for index, (log, error) in enumerate(parsed):
+        if error is not None:
+            results[index] = {"index": index, "status": "invalid", "errors": error}
+        elif filters.size and filters.matches(message_text(log.message)):
+            results[index] = {"index": index, "status": "filtered"}
+        else:
+            accepted.append((index, log))
+
+    if classification_queue.running:
+        classifications = [PENDING_LEVEL] * len(accepted)
+    else:
+        # Classify concurrently, bounded so a large batch doesn't flood the AI API
+        semaphore = asyncio.Semaphore(WEBHOOK_BATCH_AI_CONCURRENCY)
+
+        async def classify(log: schemas.LogCreate):
+            async with semaphore:
+                return await ai_service.classify_log(log.message)
+
+        classifications = await asyncio.gather(*(classify(log) for _, log in accepted))
+
+    fingerprints = [fingerprint(log.message) for _, log in accepted]
+    now = datetime.now(timezone.utc)
+    rows = [
+        build_log_row(system.id, log, fp, classification, now, claimed=classification == PENDING_LEVEL)
+        for (_, log), classification, fp in zip(accepted, classifications, fingerprints)
+    ]
+    jobs = [
+        ClassificationJob(None, system.id, system.name, log.message, log.container, fp.template_id)
+        if classification == PENDING_LEVEL else None
+        for (_, log), classification, fp in zip(accepted, classifications, fingerprints)
+    ]
+
+    status_label = None
+    if not rows:
+        log_ids = []
+        status_label = "stored"
+    elif not spool.diverting:
+        try:
+            if ingest_buffer.running:
+                # Write-behind: all or nothing, so the agent can simply retry the batch on 429
+                try:
+                    log_ids = await ingest_buffer.append(list(zip(rows, fingerprints, jobs)))
+                except BufferFull:
+                    raise HTTPException(status_code=429, detail="Ingest buffer full, retry later", headers={"Retry-After": "1"})
+                status_label = "accepted"
+            else:
+                template_ids = await register_templates_async(db, fingerprints)
+                log_ids = await insert_log_rows_async(db, rows)
+                await db.commit()
+                remember_templates(template_ids)
+                status_label = "stored"
+                log_broadcaster.publish_logs(rows, log_ids)
+                for job, log_id in zip(jobs, log_ids):
+                    if job is not None:
+                        job.log_id = log_id
+                        classification_queue.enqueue(job)
+        except DATABASE_ERRORS as e:
+            # Only an unreachable database is spooled: rejected data would fail the replay too
+            if not spool.enabled or not is_connection_error(e):
+                raise
+            await db.rollback()
+            spool.mark_db_unhealthy(e)
+
+    if status_label is None:
+        await spool.append([spool_record(row, fp) for row, fp in zip(rows, fingerprints)])
+        log_ids = [None] * len(rows)
+        status_label = "spooled"
+
+    for (index, log), classification, fp, log_id in zip(accepted, classifications, fingerprints, log_ids):
+        results[index] = {
+            "index": index,
+            "status": status_label,
+            "log_id": log_id,
+            "classification": classification
+        }
+        if classification in ALERT_LEVELS and await discord_client.should_alert(system.id, fp.template_id):
+            alert_msg = discord_client.build_alert_message(system.name, log_id, log.container, log.message, classification)
+            background_tasks.add_task(discord_client.send_message, DISCORD_ERROR_CHANNEL_ID, alert_msg)
+
+    return {
+        "status": "processed",
+        "received": len(parsed),
+        "stored": len(log_ids), # Accepted into the buffer in write-behind mode
+        "filtered": sum(1 for r in results if r["status"] == "filtered"),
+        "invalid": sum(1 for r in results if r["status"] == "invalid"),
+        "results": results
+    }
+
 @app.get("/logs", response_model=list[schemas.LogResponse])
 def get_logs(
+    response: Response,
     system_id: str = None, 
     limit: int = 100, 
+    level: str = None, # One level or a comma-separated list
+    container: str = None,
+    since: datetime = None,
+    until: datetime = None,
+    cursor: str = None, # X-Next-Cursor of the previous page
     db: Session = Depends(get_db)
 ):
+    limit = max(1, min(limit, LOGS_MAX_LIMIT))
     query = db.query(models.Log)
     if system_id:
         query = query.filter(models.Log.system_id == system_id)
+    if level:
+        query = query.filter(models.Log.level.in_([l.strip() for l in level.split(",") if l.strip()]))
+    if container:
+        query = query.filter(models.Log.container == container)
+    if since:
+        query = query.filter(models.Log.created_at >= since)
+    if until:
+        query = query.filter(models.Log.created_at < until)
+    if cursor:
+        # Keyset pagination: seek past the last row of the previous page, no OFFSET
+        created_at, log_id = decode_cursor(cursor, 2)
+        query = query.filter(
+            tuple_(models.Log.created_at, models.Log.id) < tuple_(parse_cursor_datetime(created_at), log_id)
+        )
+
+    logs = query.order_by(models.Log.created_at.desc(), models.Log.id.desc()).limit(limit + 1).all()
+    if len(logs) > limit:
+        logs = logs[:limit]
+        response.headers["X-Next-Cursor"] = encode_cursor(logs[-1].created_at, logs[-1].id)
     
-    logs = query.order_by(models.Log.created_at.desc()).limit(limit).all()
-    
-    # Parse JSON content back to dict for response
+    # Content is native JSON; only rows the backfill hasn't reached yet need parsing
     for log in logs:
-        try:
-            log.content = json.loads(log.content)
-        except:
-            pass
-            
+        if log.content is None:
+            log.content = read_log_content(log)
+
     return logs
 
+@app.get("/logs/search", response_model=list[schemas.LogSearchResult])
+def search_logs_endpoint(
+    response: Response,
+    q: str,
+    system_id: str = None,
+    level: str = None,
+    since: datetime = None,
+    until: datetime = None,
+    sort: str = "rank", # rank | recent
+    limit: int = 50,
+    cursor: str = None,
+    db: Session = Depends(get_db)
+):
+    """Full-text search over log messages (see search.py), paginated with X-Next-Cursor."""
+    if not q.strip():
+        raise HTTPException(status_code=400, detail="Empty search query")
+    rows, next_cursor = search_logs(
+        db, q, sort=sort, limit=limit, cursor=cursor,
+        system_id=system_id, level=level, since=since, until=until
+    )
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+
+    return [
+        schemas.LogSearchResult(
+            id=log.id,
+            system_id=log.system_id,
+            content=read_log_content(log),
+            level=log.level,
+            container=log.container,
+            created_at=log.created_at,
+            rank=rank,
+            highlight=highlight,
+        )
+        for log, rank, highlight in rows
+    ]
+
+@app.get("/logs/stream")
+async def stream_logs(
+    system_id: str = None,
+    last_id: int = None,
+    last_event_id: str | None = Header(None, alias="last-event-id")
+):
+    """
+    Server-Sent Events live tail: 'log' events for new logs and 'level' events
+    when a classification finishes, pushed from the ingest path (no polling).
+    Resumes after `last_id` (or the Last-Event-ID sent by a reconnecting EventSource).
+    """
+    if last_event_id and last_event_id.isdigit():
+        last_id = int(last_event_id)
+    # Subscribe before reading the backlog so nothing falls in between
+    subscriber = log_broadcaster.subscribe(system_id)
+    backlog = []
+    if last_id is not None:
+        backlog = log_broadcaster.replay(last_id, system_id)
+        if backlog is None:
+            backlog = await asyncio.to_thread(load_backlog, last_id, system_id)
+
+    async def events():
+        try:
+            yield "retry: 1000\n\n"
+            sent = {event["id"] for event in backlog}
+            for event in backlog:
+                yield format_sse(event)
+            while not (subscriber.dropped and subscriber.queue.empty()):
+                try:
+                    event = await asyncio.wait_for(subscriber.queue.get(), timeout=LIVE_TAIL_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                if event["type"] == "log" and event["id"] in sent:
+                    continue
+                yield format_sse(event)
+        finally:
+            log_broadcaster.unsubscribe(subscriber)
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 @app.get("/systems", response_model=list[schemas.SystemResponse])
-def get_systems(db: Session = Depends(get_db)):
-    return db.query(models.System).all()
+def get_systems(request: Request, db: Session = Depends(get_db)):
+    return cached_json_response(request, systems_responses, "all", lambda: [
+        schemas.SystemResponse.model_validate(system) for system in db.query(models.System).all()
+    ])
 
 @app.get("/stats")
-def get_stats(range: str = "7d", db: Session = Depends(get_db)):
+def get_stats(request: Request, range: str = "7d", db: Session = Depends(get_db)):
+    return cached_json_response(request, stats_responses, range, lambda: compute_stats(db, range))
+
+def compute_stats(db: Session, range: str):
     # Determine start date and grouping
     now = datetime.now()
     
     if range == "1h":
         start_date = now - timedelta(hours=1)
-        # Group by minute: YYYY-MM-DD HH:MM
-        date_format_len = 16 
+        granularity = "minute" # YYYY-MM-DD HH:MM
     elif range == "24h":
         start_date = now - timedelta(hours=24)
-        # Group by hour: YYYY-MM-DD HH
-        date_format_len = 13
+        granularity = "hour" # YYYY-MM-DD HH
     elif range == "30d":
         start_date = now - timedelta(days=30)
-        date_format_len = 10 # YYYY-MM-DD
+        granularity = "day" # YYYY-MM-DD
     else: # Default 7d
         start_date = now - timedelta(days=7)
-        date_format_len = 10
-    
-    # Query logs
-    results = db.query(
-        func.substr(models.Log.created_at, 1, date_format_len).label('time_bucket'),
-        models.System.name,
-        func.count(models.Log.id).label('count')
-    ).join(models.System).filter(models.Log.created_at >= start_date).group_by('time_bucket', models.System.name).all()
-    
-    # Format for Recharts
+        granularity = "day"
+
+    if rollup_compactor.ready:
+        # Pre-aggregated counts (O(buckets) instead of O(logs)) plus the logs since the last compaction
+        granularity, results = stats_from_rollups(db, range, start_date, rollup_compactor.covered_until)
+    else:
+        results = log_counts(db, granularity, start_date)
+
+    # Format for Recharts: one key per system, plus per-level counts under "levels"
     formatted = {}
-    for bucket, name, count in results:
-        if bucket not in formatted:
-            formatted[bucket] = {"date": bucket}
-        formatted[bucket][name] = count
-        
+    for bucket_value, name, level, count in results:
+        bucket_label = format_bucket(bucket_value, granularity)
+        if bucket_label not in formatted:
+            formatted[bucket_label] = {"date": bucket_label, "levels": {}}
+        entry = formatted[bucket_label]
+        entry[name] = entry.get(name, 0) + count
+        levels = entry["levels"].setdefault(name, {})
+        levels[level] = levels.get(level, 0) + count
+
     return sorted(list(formatted.values()), key=lambda x: x['date'])
 
+@app.get("/stats/templates")
+def get_template_stats(range: str = "24h", system_id: str = None, limit: int = 20, db: Session = Depends(get_db)):
+    """Most frequent message templates (see fingerprint.py) in the time range."""
+    deltas = {"1h": timedelta(hours=1), "24h": timedelta(hours=24), "30d": timedelta(days=30)}
+    start_date = datetime.now() - deltas.get(range, timedelta(days=7))
+
+    query = db.query(
+        models.Log.template_id,
+        models.LogTemplate.template,
+        func.count(models.Log.id).label('count'),
+        func.max(models.Log.created_at).label('last_seen')
+    ).join(models.LogTemplate, models.LogTemplate.id == models.Log.template_id) \
+     .filter(models.Log.created_at >= start_date)
+    if system_id:
+        query = query.filter(models.Log.system_id == system_id)
+
+    results = query.group_by(models.Log.template_id, models.LogTemplate.template) \
+        .order_by(func.count(models.Log.id).desc()).limit(limit).all()
+
+    return [
+        {"template_id": template_id, "template": template, "count": count, "last_seen": last_seen}
+        for template_id, template, count, last_seen in results
+    ]
+
 @app.get("/reports", response_model=list[schemas.ReportResponse])
-def get_reports(limit: int = 50, db: Session = Depends(get_db)):
-    return db.query(models.Report).order_by(models.Report.created_at.desc()).limit(limit).all()
+def get_reports(request: Request, limit: int = 50, db: Session = Depends(get_db)):
+    return cached_json_response(request, reports_responses, limit, lambda: [
+        schemas.ReportResponse.model_validate(report)
+        for report in db.query(models.Report).order_by(models.Report.created_at.desc()).limit(limit).all()
+    ])
 
 @app.get("/reports/{report_id}")
 def get_report(report_id: int, db: Session = Depends(get_db)):
@@ -260,9 +663,57 @@ def get_report(report_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Report not found")
     return report
 
+@app.post("/logs/{log_id}/report")
+async def request_report(log_id: int, regenerate: bool = False, _: str = Depends(verify_master_key)):
+    """Returns the stored report of a log, or starts generating it (progress in /logs/status)."""
+    result = await report_jobs.request(log_id, regenerate=regenerate, wait=False)
+    if result["status"] == "not_found":
+        raise HTTPException(status_code=404, detail="Log not found")
+    if result["status"] == "queued":
+        return JSONResponse(status_code=202, content=result)
+    return result
+
 @app.get("/logs/status")
-def get_analysis_status():
-    return analyzing_logs
+async def get_analysis_status():
+    return await shared_state.hgetall(ANALYSIS_STATUS)
+
+@app.get("/metrics")
+def get_metrics():
+    return {
+        "classification_queue": classification_queue.stats(),
+        "classification_cache": classification_cache.stats(),
+        "local_classifier": local_classifier.stats(),
+        "llm": ai_service.llm_router.stats(),
+        "filter_cache": filter_engine.stats(),
+        "system_cache": system_cache.stats(),
+        "ingest_buffer": ingest_buffer.stats(),
+        "spool": spool.stats(),
+        "rollups": rollup_compactor.stats(),
+        "retention": retention_scheduler.stats(),
+        "partitioning": partition_conversion.stats(),
+        "cleanup_jobs": cleanup_jobs.stats(),
+        "report_jobs": report_jobs.stats(),
+        "database_pool": pool_stats(),
+        "live_tail": log_broadcaster.stats(),
+        "shared_state": shared_state.stats(),
+        "leader": leader_election.stats(),
+        "response_cache": {
+            "stats": stats_responses.stats(),
+            "systems": systems_responses.stats(),
+            "reports": reports_responses.stats(),
+        }
+    }
+
+@app.post("/partitioning/convert", status_code=202)
+async def convert_partitioning(_: str = Depends(verify_master_key)):
+    """
+    Converts logs into a table partitioned by created_at (LOG_PARTITIONING,
+    Postgres). Runs on the leader in the background; progress in /metrics.
+    """
+    if not LOG_PARTITIONING or engine.dialect.name != "postgresql":
+        raise HTTPException(status_code=400, detail="Partitioning needs LOG_PARTITIONING=true on Postgres")
+    await partition_conversion.request()
+    return {"status": "started"}
 
 # --- LOG FILTERING ENDPOINTS ---
 
@@ -277,10 +728,17 @@ def add_filter(
     db: Session = Depends(get_db),
     _: str = Depends(verify_master_key)
 ):
-    new_filter = models.LogFilter(system_id=system_id, pattern=filter_data.pattern)
+    if filter_data.is_regex:
+        try:
+            re.compile(filter_data.pattern)
+        except re.error as e:
+            raise HTTPException(status_code=400, detail=f"Invalid regex: {e}")
+
+    new_filter = models.LogFilter(system_id=system_id, pattern=filter_data.pattern, is_regex=filter_data.is_regex)
     db.add(new_filter)
     db.commit()
     db.refresh(new_filter)
+    shared_state.invalidate("filters", system_id)
     return new_filter
 
 @app.delete("/systems/{system_id}/filters/{filter_id}")
@@ -298,39 +756,37 @@ def delete_filter(
         raise HTTPException(status_code=404, detail="Filter not found")
     db.delete(f)
     db.commit()
+    shared_state.invalidate("filters", system_id)
     return {"status": "deleted"}
 
 @app.post("/systems/{system_id}/cleanup")
 async def cleanup_logs(
     system_id: str, 
     cleanup_data: schemas.CleanupRequest, 
-    background_tasks: BackgroundTasks,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     _: str = Depends(verify_master_key)
 ):
-    system = db.query(models.System).filter(models.System.id == system_id).first()
+    system = await db.get(models.System, system_id)
     if not system:
         raise HTTPException(status_code=404, detail="System not found")
-        
-    pattern = cleanup_data.pattern
-    
-    logs_to_delete = db.query(models.Log).filter(
-        models.Log.system_id == system_id,
-        models.Log.content.contains(pattern)
+
+    if cleanup_data.dry_run:
+        return await db.run_sync(estimate_cleanup, system_id, cleanup_data.pattern)
+
+    # Deleted in batches by a background job, which posts the Discord summary when done
+    job = await cleanup_jobs.submit(system_id, cleanup_data.pattern)
+    return JSONResponse(status_code=202, content={"status": "accepted", "job_id": job.id})
+
+@app.get("/jobs/{job_id}", response_model=schemas.JobResponse)
+def get_job(job_id: str, db: Session = Depends(get_db)):
+    job = db.query(models.Job).filter(models.Job.id == job_id).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return schemas.JobResponse(
+        id=job.id, kind=job.kind, system_id=job.system_id, params=job.params, status=job.status,
+        deleted=job.deleted or 0, progress=job_progress(job), error=job.error,
+        created_at=job.created_at, finished_at=job.finished_at,
     )
-    count = logs_to_delete.count()
-    logs_to_delete.delete(synchronize_session=False)
-    db.commit()
-    
-    # Send validation to Discord
-    discord_message = f"**🧹 RELATÓRIO DE LIMPEZA: {system.name}**\n\n" \
-                      f"Padrão removido: `{pattern}`\n" \
-                      f"Total de itens excluídos: **{count}**\n\n" \
-                      f"Isso ajuda a manter o banco de dados otimizado."
-                      
-    background_tasks.add_task(discord_client.send_message, DISCORD_REPORT_CHANNEL_ID, discord_message)
-    
-    return {"status": "success", "cleaned_count": count}
 
 @app.get("/")
 def read_root():
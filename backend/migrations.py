@@ -0,0 +1,169 @@
+import os
+import logging
+from sqlalchemy import inspect, text, update
+from sqlalchemy.orm import Session
+import models
+from database import Base, maintenance_connection, advisory_lock, index_state
+from log_writer import parse_legacy_content
+from partitioning import is_partitioned
+
+# Setup logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Rows per transaction when moving legacy Text content into the JSON column
+LOG_BACKFILL_BATCH = int(os.getenv("LOG_BACKFILL_BATCH", "5000"))
+
+# Advisory locks (see partitioning.CONVERSION_LOCK_KEY): boot schema changes, background index builds
+SCHEMA_LOCK_KEY = 4217002
+INDEX_BUILD_LOCK_KEY = 4217003
+
+def add_missing_columns(engine):
+    """
+    create_all() only creates missing tables. For tables that already exist,
+    adds any model column missing from the database as a nullable column.
+    """
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+                logger.info(f"Added column {table.name}.{column.name}")
+
+def build_index(engine, name: str, table: str, definition: str, unique: bool = False):
+    """
+    Postgres: CREATE INDEX CONCURRENTLY `name` ON `table` `definition` (e.g.
+    "(system_id, created_at)" or "USING GIN (...)") unless a valid one exists.
+    An INVALID index left by an interrupted build is dropped first: IF NOT
+    EXISTS would otherwise skip it forever. Plain CREATE INDEX on a partitioned
+    table, where Postgres doesn't support CONCURRENTLY. Returns True if it built it.
+    """
+    with maintenance_connection(engine) as conn:
+        state = index_state(conn, name)
+        if state == "valid":
+            return False
+        concurrently = "" if is_partitioned(conn, table) else "CONCURRENTLY "
+        if state == "invalid":
+            logger.warning(f"Index {name} is invalid (interrupted build), rebuilding it")
+            conn.execute(text(f"DROP INDEX {concurrently}IF EXISTS {name}"))
+        logger.info(f"Building index {name} on {table}")
+        unique_sql = "UNIQUE " if unique else ""
+        conn.execute(text(f"CREATE {unique_sql}INDEX {concurrently}IF NOT EXISTS {name} ON {table} {definition}"))
+    return True
+
+def create_missing_indexes(engine):
+    """
+    Creates model indexes that don't exist yet (or are invalid) on already existing
+    tables. On Postgres they are built CONCURRENTLY, which takes as long as a scan
+    of the table: only call it from build_indexes(), never at boot. Returns their names.
+    """
+    inspector = inspect(engine)
+    created = []
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        if engine.dialect.name == "postgresql":
+            for index in table.indexes:
+                columns = ", ".join(column.name for column in index.columns)
+                if build_index(engine, index.name, table.name, f"({columns})", unique=index.unique):
+                    created.append(index.name)
+            continue
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(bind=engine, checkfirst=True)
+                created.append(index.name)
+    if created:
+        logger.info(f"Created indexes: {', '.join(created)}")
+    return created
+
+def build_indexes(engine, *builders):
+    """
+    Background index builds of the leader (Postgres): the missing model indexes,
+    then each of `builders` (callables taking the engine, e.g. the full-text
+    index). The API keeps serving, and reads and writes keep going, meanwhile.
+    One process at a time: returns without doing anything if another holds the lock.
+    """
+    if engine.dialect.name != "postgresql":
+        return
+    with advisory_lock(INDEX_BUILD_LOCK_KEY, wait=False, bind=engine) as acquired:
+        if not acquired:
+            logger.info("Index builds already running in another process")
+            return
+        try:
+            create_missing_indexes(engine)
+            for builder in builders:
+                builder(engine)
+        except Exception as e:
+            logger.error(f"Background index build failed (retried on the next leader election): {e}")
+
+def normalize_sqlite_timestamps(engine):
+    """
+    SQLite (development): logs that took the CURRENT_TIMESTAMP default are stored
+    as 'YYYY-MM-DD HH:MM:SS', while SQLAlchemy writes and binds microseconds. The
+    text comparison of the keyset cursor then never gets past such a row, so
+    they are padded to the same format.
+    """
+    if engine.dialect.name != "sqlite":
+        return
+    with engine.begin() as conn:
+        count = conn.execute(text(
+            "UPDATE logs SET created_at = created_at || '.000000' WHERE length(created_at) = 19"
+        )).rowcount
+    if count:
+        logger.info(f"Normalized the created_at of {count} logs")
+
+def run_migrations(engine):
+    """
+    Boot-time schema changes, all cheap. Postgres index builds are left to the
+    leader in the background (build_indexes) so the API doesn't wait for them.
+    """
+    add_missing_columns(engine)
+    if engine.dialect.name != "postgresql":
+        create_missing_indexes(engine)
+    normalize_sqlite_timestamps(engine)
+
+def backfill_log_payloads(engine, batch_size: int = LOG_BACKFILL_BATCH):
+    """
+    Moves the JSON text of rows written before logs.payload existed into the
+    JSON column (and logs.container), emptying the old column. Walks the table
+    by id, one batch per transaction, so it can run while the API serves
+    traffic. Returns the number of migrated rows.
+    """
+    migrated = 0
+    last_id = 0
+    try:
+        while True:
+            with Session(engine) as db:
+                rows = db.query(models.Log.id, models.Log.legacy_content) \
+                    .filter(models.Log.id > last_id, models.Log.legacy_content.isnot(None)) \
+                    .order_by(models.Log.id).limit(batch_size).all()
+                if not rows:
+                    break
+                updates = []
+                for log_id, legacy_content in rows:
+                    data = parse_legacy_content(legacy_content) # Also drops NULs the JSON column refuses
+                    container = data.get("container")
+                    updates.append({
+                        "id": log_id,
+                        "content": data,
+                        "container": container if isinstance(container, str) else None,
+                        "legacy_content": None,
+                    })
+                db.execute(update(models.Log), updates)
+                db.commit()
+            last_id = rows[-1][0]
+            migrated += len(rows)
+    except Exception as e:
+        logger.error(f"Log payload backfill stopped after {migrated} rows: {e}")
+        return migrated
+
+    if migrated:
+        logger.info(f"Backfilled JSON content of {migrated} logs")
+    return migrated
@@ -1,6 +1,8 @@
-from sqlalchemy import Column, String, Integer, DateTime, ForeignKey, Text
+from sqlalchemy import Column, String, Integer, DateTime, ForeignKey, Text, Boolean, Index, JSON
 from sqlalchemy.orm import relationship
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.sql import func
+from datetime import datetime, timezone
 from database import Base
 
 class System(Base):
@@ -14,6 +16,7 @@ class System(Base):
     maintenance_email = Column(String)
     status = Column(String, default="development") # development / production
     technical_info = Column(Text, nullable=True) # "Ficha Técnica"
+    retention_days = Column(Integer, nullable=True) # Days of logs to keep (None: LOG_RETENTION_DAYS)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     # Relationship to filters
@@ -24,6 +27,7 @@ class LogFilter(Base):
     id = Column(Integer, primary_key=True, index=True)
     system_id = Column(String, ForeignKey("systems.id"))
     pattern = Column(String) # The exact text or regex to match
+    is_regex = Column(Boolean, default=False) # False: exact text, True: regex
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
 class Report(Base):
@@ -31,7 +35,7 @@ class Report(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     system_id = Column(String, ForeignKey("systems.id"))
-    log_id = Column(Integer, ForeignKey("logs.id"))
+    log_id = Column(Integer, ForeignKey("logs.id"), index=True) # Cached report lookup (report_jobs)
     content = Column(Text)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
@@ -40,6 +44,84 @@ class Log(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     system_id = Column(String, ForeignKey("systems.id")) # Changed to match System.id
-    content = Column(Text)
+    content = Column("payload", JSON().with_variant(JSONB(), "postgresql")) # {"message", "container"}
+    legacy_content = Column("content", Text, nullable=True) # JSON text of older rows, emptied by the backfill
     level = Column(String, default="info") # info, warning, error, success
+    template_id = Column(String, index=True, nullable=True) # fingerprint.fingerprint() template
+    container = Column(String, nullable=True) # Copy of content["container"] for filtering
+    claimed_at = Column(DateTime(timezone=True), nullable=True) # 'pending' log taken by a classification queue
+    # Set by the application: SQLite stores its CURRENT_TIMESTAMP default without microseconds,
+    # which breaks the (created_at, id) keyset cursors of /logs and /logs/search
+    created_at = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), server_default=func.now(), index=True)
+
+    __table_args__ = (
+        # Per-system time range scans (/logs?system_id=, /stats, cleanup)
+        Index("ix_logs_system_id_created_at", "system_id", "created_at"),
+        # 'pending' backlog lookups (classification recovery, rollup refresh)
+        Index("ix_logs_level_created_at", "level", "created_at"),
+        Index("ix_logs_container_created_at", "container", "created_at"),
+    )
+
+class ClassificationCacheEntry(Base):
+    __tablename__ = "classification_cache"
+
+    key = Column(String, primary_key=True) # classification_cache.cache_key() of the message
+    classification = Column(String)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
+
+class LogTemplate(Base):
+    __tablename__ = "log_templates"
+
+    id = Column(String, primary_key=True) # template_id
+    template = Column(Text) # Message with variable tokens masked, e.g. "Slow query detected: <NUM>s"
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class RollupMixin:
+    """Log counts per (system, level, bucket) maintained by rollups.py."""
+    system_id = Column(String, primary_key=True)
+    level = Column(String, primary_key=True)
+    bucket_start = Column(DateTime(timezone=True), primary_key=True, index=True)
+    count = Column(Integer, default=0)
+
+class LogRollupMinute(RollupMixin, Base):
+    __tablename__ = "log_rollups_minute"
+
+class LogRollupHour(RollupMixin, Base):
+    __tablename__ = "log_rollups_hour"
+
+class LogRollupDay(RollupMixin, Base):
+    __tablename__ = "log_rollups_day"
+
+class Job(Base):
+    """Background maintenance job (cleanup_jobs.py); progress survives restarts."""
+    __tablename__ = "jobs"
+
+    id = Column(String, primary_key=True) # uuid4 hex
+    kind = Column(String) # cleanup
+    system_id = Column(String, ForeignKey("systems.id"))
+    params = Column(JSON) # e.g. {"pattern": "..."}
+    status = Column(String, default="queued") # queued, running, completed, failed
+    start_id = Column(Integer, nullable=True) # logs.id range scanned by the job
+    end_id = Column(Integer, nullable=True)
+    cursor = Column(Integer, nullable=True) # Next logs.id to scan
+    deleted = Column(Integer, default=0)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+class SharedStateEntry(Base):
+    """Key/value entry of the database shared-state backend (shared_state.py)."""
+    __tablename__ = "shared_state"
+
+    key = Column(String, primary_key=True) # e.g. "lease/leader", "analysis_status/123"
+    value = Column(Text) # JSON
+    expires_at = Column(DateTime(timezone=True), nullable=True, index=True)
+
+class SharedEvent(Base):
+    """Pub/sub message of the database shared-state backend, polled by every worker."""
+    __tablename__ = "shared_events"
+
+    id = Column(Integer, primary_key=True, index=True)
+    channel = Column(String)
+    payload = Column(Text) # JSON {"origin", "data"}
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
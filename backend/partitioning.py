@@ -0,0 +1,270 @@
+import os
+import re
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import text
+import models
+from database import engine, maintenance_connection, advisory_lock, index_state
+from shared_state import shared_state
+from leadership import leader_election
+
+# Setup logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Postgres only: logs becomes a table partitioned by range of created_at
+LOG_PARTITIONING = os.getenv("LOG_PARTITIONING", "false").lower() == "true"
+LOG_PARTITION_INTERVAL = os.getenv("LOG_PARTITION_INTERVAL", "month") # month | day
+# Partitions created ahead of time (a row without a partition lands in logs_default
+# and moves to its partition once that is created)
+LOG_PARTITION_PREMAKE = int(os.getenv("LOG_PARTITION_PREMAKE", "3"))
+
+LEGACY_PARTITION = "logs_legacy"
+DEFAULT_PARTITION = "logs_default"
+# Session advisory lock so only one process converts the table
+CONVERSION_LOCK_KEY = 4217001
+
+def partition_floor(value: datetime, interval: str = LOG_PARTITION_INTERVAL):
+    """Start (UTC) of the partition holding `value`."""
+    value = value.astimezone(timezone.utc) if value.tzinfo else value.replace(tzinfo=timezone.utc)
+    value = value.replace(hour=0, minute=0, second=0, microsecond=0)
+    return value if interval == "day" else value.replace(day=1)
+
+def next_partition(start: datetime, interval: str = LOG_PARTITION_INTERVAL):
+    if interval == "day":
+        return start + timedelta(days=1)
+    return (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+def partition_name(start: datetime, interval: str = LOG_PARTITION_INTERVAL):
+    return f"logs_p{start:%Y%m%d}" if interval == "day" else f"logs_p{start:%Y%m}"
+
+def is_partitioned(conn, table: str = "logs"):
+    relkind = conn.execute(text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:table)"), {"table": table}).scalar()
+    return relkind == "p"
+
+def parse_bound(value: str):
+    """'2026-11-01 00:00:00+00' (as printed by pg_get_expr) -> aware datetime."""
+    if re.search(r"[+-]\d\d$", value):
+        value += ":00"
+    return datetime.fromisoformat(value)
+
+def list_partitions(conn):
+    """[(name, upper bound or None)] of the partitions of logs (None for the default partition)."""
+    rows = conn.execute(text(
+        "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = 'logs'::regclass"
+    )).all()
+    partitions = []
+    for name, bound in rows:
+        upper = re.search(r"TO \('([^']+)'\)", bound or "")
+        partitions.append((name, parse_bound(upper.group(1)) if upper else None))
+    return partitions
+
+def check_partitioning(engine):
+    """Boot: warns when LOG_PARTITIONING is on but logs hasn't been converted yet (catalog lookup only)."""
+    if not LOG_PARTITIONING or engine.dialect.name != "postgresql":
+        return
+    with engine.connect() as conn:
+        if not is_partitioned(conn):
+            logger.warning("LOG_PARTITIONING is on but logs is not partitioned: call POST /partitioning/convert")
+
+def run_conversion(engine):
+    """
+    Converts logs into a partitioned table if it isn't one yet, then creates the
+    upcoming partitions (blocking). Returns False, without doing anything, if
+    another process holds the conversion lock. A conversion that failed half-way
+    resumes where it stopped (see convert_logs_table).
+    """
+    with advisory_lock(CONVERSION_LOCK_KEY, wait=False, bind=engine) as acquired:
+        if not acquired:
+            logger.info("Partitioning conversion already running in another process")
+            return False
+        with engine.connect() as conn:
+            partitioned = is_partitioned(conn)
+        if not partitioned:
+            convert_logs_table(engine)
+        ensure_partitions(engine)
+    return True
+
+class PartitionConversion:
+    """
+    Explicitly triggered conversion of logs (POST /partitioning/convert). It runs
+    on the leader in a background thread; the other workers hand the request over.
+    """
+
+    def __init__(self):
+        self._task = None
+        self.status = "idle" # idle, running, completed, busy (another process converting), failed
+        self.last_error = None
+        shared_state.subscribe("partitioning_convert", self._requested)
+
+    async def request(self):
+        if leader_election.is_leader:
+            self._start()
+        else:
+            await shared_state.publish("partitioning_convert", None)
+
+    def stats(self):
+        return {"enabled": LOG_PARTITIONING, "conversion": self.status, "last_error": self.last_error}
+
+    def _requested(self, _):
+        if leader_election.is_leader:
+            self._start()
+
+    def _start(self):
+        if self._task is not None and not self._task.done():
+            return
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        self.status = "running"
+        try:
+            done = await asyncio.to_thread(run_conversion, engine)
+            self.status = "completed" if done else "busy"
+            self.last_error = None
+        except Exception as e:
+            self.status = "failed"
+            self.last_error = str(e)
+            logger.error(f"Partitioning conversion failed (trigger it again to resume): {e}")
+
+def convert_logs_table(engine):
+    """
+    Turns the existing logs table into a partitioned one without copying rows:
+    the old table is attached as partition logs_legacy covering everything
+    before `cutover`, new partitions start there. The full-table checks
+    (NOT NULL, the range CHECK, the (id, created_at) unique index) run before
+    the swap without blocking writes; the swap itself is catalog-only, in one
+    transaction. Every step before it can run again, so a failed conversion
+    resumes when triggered again.
+    """
+    cutover = next_partition(next_partition(partition_floor(datetime.now(timezone.utc))))
+    bound = cutover.isoformat()
+    logger.info(f"Converting logs into a partitioned table (existing rows go to {LEGACY_PARTITION}, before {bound})")
+
+    with maintenance_connection(engine) as conn:
+        conn.execute(text("UPDATE logs SET created_at = now() WHERE created_at IS NULL"))
+        # The partition key must be part of the primary key. An interrupted build leaves an
+        # INVALID index that IF NOT EXISTS would keep and the primary key can't use
+        if index_state(conn, "logs_id_created_at") == "invalid":
+            conn.execute(text("DROP INDEX CONCURRENTLY IF EXISTS logs_id_created_at"))
+        conn.execute(text("CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS logs_id_created_at ON logs (id, created_at)"))
+        # A validated CHECK lets both SET NOT NULL and ATTACH PARTITION skip their table scans
+        conn.execute(text("ALTER TABLE logs DROP CONSTRAINT IF EXISTS logs_legacy_range"))
+        conn.execute(text(
+            f"ALTER TABLE logs ADD CONSTRAINT logs_legacy_range "
+            f"CHECK (created_at IS NOT NULL AND created_at < '{bound}') NOT VALID"
+        ))
+        conn.execute(text("ALTER TABLE logs VALIDATE CONSTRAINT logs_legacy_range"))
+        conn.execute(text("ALTER TABLE logs ALTER COLUMN created_at SET NOT NULL"))
+
+    with engine.begin() as conn:
+        conn.execute(text("SET LOCAL statement_timeout = 0"))
+        sequence = conn.execute(text("SELECT pg_get_serial_sequence('logs', 'id')")).scalar()
+        primary_key = conn.execute(text(
+            "SELECT conname FROM pg_constraint WHERE conrelid = 'logs'::regclass AND contype = 'p'"
+        )).scalar()
+        index_defs = conn.execute(text(
+            "SELECT indexname, indexdef FROM pg_indexes WHERE schemaname = current_schema() AND tablename = 'logs' "
+            "AND indexname NOT IN (:primary_key, 'logs_id_created_at')"
+        ), {"primary_key": primary_key}).all()
+
+        # Unique constraints can't span partitions, so foreign keys to logs.id go away (reports.log_id)
+        for table, constraint in conn.execute(text(
+            "SELECT conrelid::regclass::text, conname FROM pg_constraint WHERE confrelid = 'logs'::regclass AND contype = 'f'"
+        )).all():
+            conn.execute(text(f'ALTER TABLE {table} DROP CONSTRAINT "{constraint}"'))
+
+        conn.execute(text(f'ALTER TABLE logs DROP CONSTRAINT "{primary_key}"'))
+        conn.execute(text(f"ALTER TABLE logs ADD CONSTRAINT {LEGACY_PARTITION}_pkey PRIMARY KEY USING INDEX logs_id_created_at"))
+        conn.execute(text(f"ALTER TABLE logs RENAME TO {LEGACY_PARTITION}"))
+        for name, _ in index_defs:
+            conn.execute(text(f'ALTER INDEX "{name}" RENAME TO "{name}_legacy"'))
+
+        conn.execute(text(f"CREATE TABLE logs (LIKE {LEGACY_PARTITION} INCLUDING DEFAULTS) PARTITION BY RANGE (created_at)"))
+        if sequence:
+            conn.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY logs.id"))
+        conn.execute(text("ALTER TABLE logs ADD CONSTRAINT logs_pkey PRIMARY KEY (id, created_at)"))
+        conn.execute(text("ALTER TABLE logs ADD CONSTRAINT logs_system_id_fkey FOREIGN KEY (system_id) REFERENCES systems (id)"))
+        # Same definitions as the old indexes, so ATTACH adopts them instead of rebuilding
+        for _, definition in index_defs:
+            conn.execute(text(re.sub(r" ON (\S+\.)?logs ", " ON logs ", definition, count=1)))
+
+        conn.execute(text(f"ALTER TABLE logs ATTACH PARTITION {LEGACY_PARTITION} FOR VALUES FROM (MINVALUE) TO ('{bound}')"))
+        conn.execute(text(f"ALTER TABLE {LEGACY_PARTITION} DROP CONSTRAINT logs_legacy_range"))
+        conn.execute(text(f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF logs DEFAULT"))
+    logger.info("logs is now partitioned by created_at")
+
+def ensure_partitions(engine, now: datetime | None = None):
+    """Creates the partitions from the current one up to LOG_PARTITION_PREMAKE ahead. Returns the new names."""
+    now = now or datetime.now(timezone.utc)
+    created = []
+    with engine.begin() as conn:
+        covered = max((upper for _, upper in list_partitions(conn) if upper), default=None)
+    start = partition_floor(now)
+    if covered is not None and covered > start:
+        start = covered
+    end = partition_floor(now)
+    for _ in range(LOG_PARTITION_PREMAKE + 1):
+        end = next_partition(end)
+
+    while start < end:
+        upper = next_partition(start)
+        name = partition_name(start)
+        bounds = f"FOR VALUES FROM ('{start.isoformat()}') TO ('{upper.isoformat()}')"
+        with engine.begin() as conn:
+            in_default = conn.execute(text(
+                f"SELECT EXISTS (SELECT 1 FROM {DEFAULT_PARTITION} WHERE created_at >= :start AND created_at < :upper)"
+            ), {"start": start, "upper": upper}).scalar()
+            if not in_default:
+                conn.execute(text(f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF logs {bounds}"))
+            else:
+                # Logs with a future created_at landed in logs_default, and Postgres refuses a
+                # partition overlapping them: move them into the new table before attaching it
+                conn.execute(text(f"CREATE TABLE {name} (LIKE logs INCLUDING DEFAULTS)"))
+                moved = conn.execute(text(
+                    f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} WHERE created_at >= :start AND created_at < :upper "
+                    f"RETURNING *) INSERT INTO {name} SELECT * FROM moved"
+                ), {"start": start, "upper": upper}).rowcount
+                conn.execute(text(f"ALTER TABLE logs ATTACH PARTITION {name} {bounds}"))
+                logger.info(f"Moved {moved} logs from {DEFAULT_PARTITION} into the new partition {name}")
+        created.append(name)
+        start = upper
+    if created:
+        logger.info(f"Created log partitions: {', '.join(created)}")
+    return created
+
+def drop_partitions_before(engine, horizon: datetime, archive: bool = False):
+    """
+    Detaches every partition whose rows are all older than `horizon` and drops
+    it (or keeps it as a standalone table when `archive`). Catalog-only, so the
+    cost doesn't depend on the number of rows, except for the logs a report
+    points to: like the row-by-row retention, those are kept, copied back into
+    logs (the detached range has no partition left, so they go to logs_default).
+    Returns the affected names.
+    """
+    with engine.begin() as conn:
+        expired = [name for name, upper in list_partitions(conn) if upper is not None and upper <= horizon]
+
+    removed = []
+    for name in sorted(expired):
+        with engine.begin() as conn:
+            # Don't queue behind long queries on logs: retry on the next run instead
+            conn.execute(text("SET LOCAL lock_timeout = '5s'"))
+            conn.execute(text(f'ALTER TABLE logs DETACH PARTITION "{name}"'))
+            # Explicit columns: logs_legacy keeps the column order of the original table
+            columns = ", ".join(f'"{column.name}"' for column in models.Log.__table__.columns)
+            kept = conn.execute(text(
+                f'INSERT INTO logs ({columns}) SELECT {columns} FROM "{name}" '
+                f'WHERE id IN (SELECT log_id FROM reports WHERE log_id IS NOT NULL)'
+            )).rowcount
+            if kept:
+                logger.info(f"Kept {kept} logs referenced by reports from expired partition {name}")
+            if not archive:
+                conn.execute(text(f'DROP TABLE "{name}"'))
+        removed.append(name)
+    if removed:
+        logger.info(f"{'Detached' if archive else 'Dropped'} expired log partitions: {', '.join(removed)}")
+    return removed
+
+partition_conversion = PartitionConversion()
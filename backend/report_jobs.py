@@ -0,0 +1,170 @@
+import os
+import asyncio
+import logging
+import models
+import ai_service
+from database import SessionLocal
+from live_tail import log_broadcaster
+from shared_state import shared_state, INSTANCE_ID
+
+# Setup logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Reports generated at the same time by one worker; the others wait for a slot
+REPORT_MAX_CONCURRENCY = int(os.getenv("REPORT_MAX_CONCURRENCY", "2"))
+# Seconds a worker owns a report generation; if it dies, another may take over after this
+REPORT_LOCK_TTL = float(os.getenv("REPORT_LOCK_TTL", "600"))
+# Seconds a log stays in GET /logs/status after its last change
+REPORT_STATUS_TTL = float(os.getenv("REPORT_STATUS_TTL", "3600"))
+# How often a worker checks whether another worker finished the same report
+REPORT_POLL_INTERVAL = float(os.getenv("REPORT_POLL_INTERVAL", "1"))
+
+# Shared hash behind GET /logs/status: log id -> queued | analyzing | completed | failed
+ANALYSIS_STATUS = "analysis_status"
+
+def find_report(log_id: int):
+    """Returns (system_id, latest report as a dict or None); system_id is None if the log doesn't exist (blocking)."""
+    db = SessionLocal()
+    try:
+        log = db.query(models.Log.system_id).filter(models.Log.id == log_id).first()
+        if log is None:
+            return None, None
+        report = db.query(models.Report.id, models.Report.content) \
+            .filter(models.Report.log_id == log_id) \
+            .order_by(models.Report.id.desc()).first()
+        return log.system_id, ({"report_id": report.id, "content": report.content} if report else None)
+    finally:
+        db.close()
+
+def report_result(status: str, log_id: int, report: dict | None = None):
+    return {"status": status, "log_id": log_id, **(report or {"report_id": None, "content": None})}
+
+class ReportJobs:
+    """
+    Generates AI reports in background jobs. A log that already has a report
+    is answered from the reports table unless a regeneration is asked for;
+    concurrent requests for the same log share one job (single-flight), also
+    across workers through a lock in SHARED_STATE, and at most
+    REPORT_MAX_CONCURRENCY generations run at once. Each step is written to
+    the ANALYSIS_STATUS hash and pushed to /logs/stream as a 'status' event.
+    """
+
+    def __init__(self, max_concurrency: int):
+        self.max_concurrency = max_concurrency
+        self._semaphore = None
+        self._jobs = {} # log_id -> task
+        self.generated = 0
+        self.cached = 0
+        self.coalesced = 0
+        self.failed = 0
+
+    async def request(self, log_id: int, regenerate: bool = False, wait: bool = True):
+        """
+        Returns the log's report (status 'cached' or 'completed'), 'failed' or
+        'not_found'. With wait=False a new or running job answers 'queued'
+        right away; follow it with join() or GET /logs/status.
+        """
+        task = self._jobs.get(log_id)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            system_id, report = await asyncio.to_thread(find_report, log_id)
+            if system_id is None:
+                return report_result("not_found", log_id)
+            if report is not None and not regenerate:
+                self.cached += 1
+                return report_result("cached", log_id, report)
+            task = self._jobs.get(log_id) # Started by another request in the meantime
+            if task is not None:
+                self.coalesced += 1
+            else:
+                task = self._start(log_id, system_id)
+
+        if not wait:
+            return report_result("queued", log_id)
+        # A caller that goes away doesn't cancel the job the others are waiting for
+        return await asyncio.shield(task)
+
+    async def join(self, log_id: int):
+        """Waits for the running job of `log_id`, or returns its stored report."""
+        task = self._jobs.get(log_id)
+        if task is not None:
+            return await asyncio.shield(task)
+        return await self.request(log_id)
+
+    async def stop(self):
+        tasks = list(self._jobs.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._jobs = {}
+
+    def stats(self):
+        return {
+            "running": len(self._jobs),
+            "max_concurrency": self.max_concurrency,
+            "generated": self.generated,
+            "cached": self.cached,
+            "coalesced": self.coalesced,
+            "failed": self.failed,
+        }
+
+    def _start(self, log_id: int, system_id: str):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        task = asyncio.create_task(self._run(log_id, system_id))
+        self._jobs[log_id] = task
+        task.add_done_callback(lambda _: self._jobs.pop(log_id, None))
+        return task
+
+    async def _run(self, log_id: int, system_id: str):
+        lock = f"report/{log_id}"
+        try:
+            if not await shared_state.add(lock, INSTANCE_ID, ttl=REPORT_LOCK_TTL):
+                return await self._wait_for_other_worker(log_id, lock)
+        except Exception as e:
+            logger.error(f"Error locking report of log {log_id}: {e}")
+            return report_result("failed", log_id)
+
+        try:
+            await self._set_status(log_id, system_id, "queued")
+            async with self._semaphore:
+                await self._set_status(log_id, system_id, "analyzing")
+                generated = await ai_service.generate_ai_report(system_id, log_id)
+            if generated is None:
+                self.failed += 1
+                await self._set_status(log_id, system_id, "failed")
+                return report_result("failed", log_id)
+            report_id, content = generated
+            self.generated += 1
+            await self._set_status(log_id, system_id, "completed")
+            return report_result("completed", log_id, {"report_id": report_id, "content": content})
+        except asyncio.CancelledError:
+            await shared_state.hdel(ANALYSIS_STATUS, log_id)
+            raise
+        except Exception as e:
+            self.failed += 1
+            logger.error(f"Report job for log {log_id} failed: {e}")
+            return report_result("failed", log_id)
+        finally:
+            try:
+                await shared_state.delete(lock)
+            except Exception as e:
+                logger.error(f"Error unlocking report of log {log_id}: {e}")
+
+    async def _wait_for_other_worker(self, log_id: int, lock: str):
+        """Another worker is generating this report: wait for its lock, then read the result."""
+        while await shared_state.get(lock) is not None:
+            await asyncio.sleep(REPORT_POLL_INTERVAL)
+        _, report = await asyncio.to_thread(find_report, log_id)
+        return report_result("completed", log_id, report) if report else report_result("failed", log_id)
+
+    async def _set_status(self, log_id: int, system_id: str, status: str):
+        try:
+            await shared_state.hset(ANALYSIS_STATUS, log_id, status, ttl=REPORT_STATUS_TTL)
+        except Exception as e:
+            logger.error(f"Error updating analysis status of log {log_id}: {e}")
+        log_broadcaster.publish_status(log_id, system_id, status)
+
+report_jobs = ReportJobs(max_concurrency=REPORT_MAX_CONCURRENCY)
@@ -0,0 +1,78 @@
+import os
+import json
+import hashlib
+import threading
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from cache import LRUCache
+
+# Short TTL: dashboards poll these endpoints, a few seconds of staleness is fine
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "5"))
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "256"))
+
+class CachedResponse:
+    __slots__ = ("body", "etag")
+
+    def __init__(self, body: bytes, etag: str):
+        self.body = body
+        self.etag = etag
+
+class ResponseCache:
+    """
+    Serialized JSON responses of one read endpoint, keyed by the query params.
+    Concurrent misses on the same key are coalesced (single flight): one thread
+    runs the query, the others wait for its result.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.entries = LRUCache(max_size=max_size, ttl=ttl)
+        self._inflight = {} # key -> threading.Event
+        self._lock = threading.Lock()
+        self.coalesced = 0
+
+    def get_or_compute(self, key, compute):
+        while True:
+            cached = self.entries.get(key)
+            if cached is not None:
+                return cached
+            with self._lock:
+                event = self._inflight.get(key)
+                if event is None:
+                    event = self._inflight[key] = threading.Event()
+                    leader = True
+                else:
+                    self.coalesced += 1
+                    leader = False
+            if leader:
+                break
+            # Another request is computing it; if it failed, retry as the leader
+            event.wait()
+
+        try:
+            body = json.dumps(jsonable_encoder(compute()), ensure_ascii=False).encode("utf-8")
+            cached = CachedResponse(body, f'"{hashlib.sha1(body).hexdigest()}"')
+            self.entries.set(key, cached)
+            return cached
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            event.set()
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self):
+        return {**self.entries.stats(), "coalesced": self.coalesced}
+
+def cached_json_response(request: Request, cache: ResponseCache, key, compute):
+    """JSON response served from `cache`, or 304 when the client's ETag still matches."""
+    cached = cache.get_or_compute(key, compute)
+    headers = {"ETag": cached.etag, "Cache-Control": "no-cache"}
+    if_none_match = request.headers.get("if-none-match", "")
+    if cached.etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(",")):
+        return Response(status_code=304, headers=headers)
+    return Response(content=cached.body, media_type="application/json", headers=headers)
+
+stats_responses = ResponseCache(max_size=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL)
+systems_responses = ResponseCache(max_size=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL)
+reports_responses = ResponseCache(max_size=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL)
@@ -0,0 +1,145 @@
+import os
+import time
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import exists, select
+from sqlalchemy.orm import aliased
+import models
+from database import SessionLocal, engine
+from partitioning import is_partitioned, ensure_partitions, drop_partitions_before
+from leadership import leader_election
+
+# Setup logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+RETENTION = os.getenv("RETENTION", "true").lower() == "true"
+RETENTION_INTERVAL = float(os.getenv("RETENTION_INTERVAL", "3600"))
+# Default for systems without retention_days (0 = keep forever)
+LOG_RETENTION_DAYS = int(os.getenv("LOG_RETENTION_DAYS", "0"))
+# Expired partitions are detached and kept as plain tables instead of dropped
+LOG_RETENTION_ARCHIVE = os.getenv("LOG_RETENTION_ARCHIVE", "false").lower() == "true"
+# Rows per transaction when retention has to delete row by row
+RETENTION_DELETE_BATCH = int(os.getenv("RETENTION_DELETE_BATCH", "5000"))
+
+class RetentionScheduler:
+    """
+    Enforces the per-system log retention every RETENTION_INTERVAL. On a
+    partitioned logs table (see partitioning.py) it also creates the upcoming
+    partitions and removes whole partitions once every system's retention has
+    passed them; systems with a shorter retention than that (and every system
+    on an unpartitioned table) get their expired rows deleted in small batches.
+    Every worker runs the loop, only the leader does the work.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._task = None
+        self.runs = 0
+        self.dropped_partitions = 0
+        self.deleted_rows = 0
+        self.last_run_ms = 0.0
+        self.last_error = None
+
+    @property
+    def running(self):
+        return self._task is not None
+
+    def start(self):
+        if self.running:
+            return
+        self._task = asyncio.create_task(self._loop())
+        logger.info("Retention scheduler started")
+
+    async def stop(self):
+        if not self.running:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    def stats(self):
+        return {
+            "enabled": RETENTION,
+            "running": self.running,
+            "runs": self.runs,
+            "dropped_partitions": self.dropped_partitions,
+            "deleted_rows": self.deleted_rows,
+            "last_run_ms": round(self.last_run_ms, 2),
+            "last_error": self.last_error,
+        }
+
+    async def _loop(self):
+        while True:
+            if not leader_election.is_leader:
+                await leader_election.wait_for_leadership(self.interval)
+                continue
+            start = time.perf_counter()
+            try:
+                await asyncio.to_thread(self.run)
+                self.runs += 1
+                self.last_run_ms = (time.perf_counter() - start) * 1000
+            except Exception as e:
+                self.last_error = str(e)
+                logger.error(f"Error enforcing log retention: {e}")
+            await asyncio.sleep(self.interval)
+
+    def run(self):
+        """One retention pass (blocking)."""
+        now = datetime.now(timezone.utc)
+        db = SessionLocal()
+        try:
+            policies = {
+                system_id: days if days is not None else LOG_RETENTION_DAYS
+                for system_id, days in db.query(models.System.id, models.System.retention_days)
+            }
+        finally:
+            db.close()
+
+        # Partitions hold every system's rows: they can only go once the longest retention passed them
+        partition_days = 0
+        partitioned = False
+        if engine.dialect.name == "postgresql":
+            with engine.connect() as conn:
+                partitioned = is_partitioned(conn)
+        if partitioned:
+            ensure_partitions(engine, now)
+            if policies and all(days > 0 for days in policies.values()):
+                partition_days = max(policies.values())
+                dropped = drop_partitions_before(engine, now - timedelta(days=partition_days), archive=LOG_RETENTION_ARCHIVE)
+                self.dropped_partitions += len(dropped)
+
+        for system_id, days in policies.items():
+            if days > 0 and days != partition_days:
+                self.deleted_rows += delete_expired_logs(system_id, now - timedelta(days=days))
+
+def delete_expired_logs(system_id: str, cutoff: datetime, batch_size: int = RETENTION_DELETE_BATCH):
+    """
+    Deletes the logs of one system older than `cutoff`, one batch per transaction
+    (uses ix_logs_system_id_created_at). Logs referenced by a report are kept.
+    Returns the number of deleted rows.
+    """
+    deleted = 0
+    while True:
+        db = SessionLocal()
+        try:
+            expired = aliased(models.Log)
+            batch = select(expired.id).where(
+                expired.system_id == system_id,
+                expired.created_at < cutoff,
+                ~exists().where(models.Report.log_id == expired.id),
+            ).limit(batch_size)
+            count = db.query(models.Log).filter(models.Log.created_at < cutoff, models.Log.id.in_(batch)) \
+                .delete(synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+        deleted += count
+        if count < batch_size:
+            break
+    if deleted:
+        logger.info(f"Retention removed {deleted} logs of system {system_id} older than {cutoff:%Y-%m-%d %H:%M}")
+    return deleted
+
+retention_scheduler = RetentionScheduler(interval=RETENTION_INTERVAL)
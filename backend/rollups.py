@@ -0,0 +1,260 @@
+import os
+import time
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import func, insert
+import models
+from database import SessionLocal
+from timeseries import bucket_expression, parse_bucket, floor_bucket, naive_utc
+from classification_queue import PENDING_LEVEL
+from shared_state import shared_state
+from leadership import leader_election
+
+# Setup logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+ROLLUPS = os.getenv("ROLLUPS", "true").lower() == "true"
+ROLLUP_INTERVAL = float(os.getenv("ROLLUP_INTERVAL", "60"))
+# Trailing window recomputed on every run (late classifications, write-behind flushes)
+ROLLUP_LOOKBACK_MINUTES = int(os.getenv("ROLLUP_LOOKBACK_MINUTES", "10"))
+ROLLUP_MINUTE_RETENTION_DAYS = int(os.getenv("ROLLUP_MINUTE_RETENTION_DAYS", "2"))
+ROLLUP_HOUR_RETENTION_DAYS = int(os.getenv("ROLLUP_HOUR_RETENTION_DAYS", "90"))
+
+# Finest to coarsest: (granularity, table, retention in days or None)
+LEVELS = [
+    ("minute", models.LogRollupMinute, ROLLUP_MINUTE_RETENTION_DAYS),
+    ("hour", models.LogRollupHour, ROLLUP_HOUR_RETENTION_DAYS),
+    ("day", models.LogRollupDay, None),
+]
+
+# Table /stats reads for each range
+RANGE_TABLES = {"1h": "minute", "24h": "hour", "7d": "day", "30d": "day"}
+
+# Set by the compacting worker, tells the others the rollups can serve /stats and up to
+# when they are complete (ISO start of the minute the last run happened in)
+ROLLUPS_READY_KEY = "rollups_ready"
+
+class RollupCompactor:
+    """
+    Keeps log_rollups_{minute,hour,day} up to date. Every ROLLUP_INTERVAL the
+    minute table is recomputed from logs over a trailing window, widened to
+    cover rows inserted since the last run, rows that were still 'pending' and
+    ranges invalidated explicitly (cleanup, spool replay). Hours and days are
+    then rebuilt from the finer table, so a run costs O(buckets) past the
+    minute window. Only the leader compacts; the other workers follow its
+    readiness through the shared state.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.ready = False # True once the first full refresh completed
+        self.covered_until = None # Rollups are complete before this minute; /stats counts later logs live
+        self._task = None
+        self._watermark = None # Highest log id seen by the last run
+        self._pending_floor = None # Oldest 'pending' log at the last run
+        self._dirty_since = None
+        self.runs = 0
+        self.last_run_ms = 0.0
+        self.last_error = None
+
+    @property
+    def running(self):
+        return self._task is not None
+
+    def start(self):
+        if self.running:
+            return
+        self._task = asyncio.create_task(self._loop())
+        logger.info("Rollup compactor started")
+
+    async def stop(self):
+        if not self.running:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    def invalidate_since(self, since: datetime):
+        """Marks every bucket from `since` on for recomputation on the next run."""
+        if since is None:
+            return
+        if isinstance(since, str): # Relayed by another worker (shared_state.invalidate)
+            since = datetime.fromisoformat(since)
+        since = naive_utc(since)
+        if self._dirty_since is None or since < self._dirty_since:
+            self._dirty_since = since
+
+    def stats(self):
+        return {
+            "enabled": ROLLUPS,
+            "running": self.running,
+            "ready": self.ready,
+            "runs": self.runs,
+            "last_run_ms": round(self.last_run_ms, 2),
+            "last_error": self.last_error,
+        }
+
+    async def _loop(self):
+        while True:
+            if not leader_election.is_leader:
+                # Forget the watermarks: another worker may compact until we lead again
+                self._watermark = None
+                self._pending_floor = None
+                try:
+                    covered_until = await shared_state.get(ROLLUPS_READY_KEY)
+                    self.covered_until = datetime.fromisoformat(covered_until) if isinstance(covered_until, str) else None
+                    self.ready = self.covered_until is not None
+                except Exception as e:
+                    logger.error(f"Error reading rollup readiness: {e}")
+                await leader_election.wait_for_leadership(self.interval)
+                continue
+
+            start = time.perf_counter()
+            try:
+                await asyncio.to_thread(self.refresh)
+                self.ready = True
+                self.runs += 1
+                self.last_run_ms = (time.perf_counter() - start) * 1000
+                await shared_state.set(ROLLUPS_READY_KEY, self.covered_until.isoformat(), ttl=self.interval * 3)
+            except Exception as e:
+                self.last_error = str(e)
+                logger.error(f"Error refreshing rollups: {e}")
+            await asyncio.sleep(self.interval)
+
+    def refresh(self):
+        """One compaction run (blocking)."""
+        dirty_since, self._dirty_since = self._dirty_since, None
+        db = SessionLocal()
+        try:
+            now = naive_utc(datetime.now(timezone.utc))
+            max_id = db.query(func.max(models.Log.id)).scalar()
+            pending_floor = naive_utc(
+                db.query(func.min(models.Log.created_at)).filter(models.Log.level == PENDING_LEVEL).scalar()
+            )
+
+            candidates = [now - timedelta(minutes=ROLLUP_LOOKBACK_MINUTES), dirty_since, self._pending_floor]
+            if self._watermark is None:
+                # First run: continue from the existing rollups, or backfill everything
+                last_bucket = db.query(func.max(models.LogRollupMinute.bucket_start)).scalar()
+                if last_bucket is None:
+                    last_bucket = db.query(func.min(models.Log.created_at)).scalar()
+                candidates += [last_bucket, pending_floor]
+            elif max_id is not None and max_id > self._watermark:
+                candidates.append(
+                    db.query(func.min(models.Log.created_at)).filter(models.Log.id > self._watermark).scalar()
+                )
+            start = min(naive_utc(c) for c in candidates if c is not None)
+
+            for index, (granularity, table, _) in enumerate(LEVELS):
+                level_start = floor_bucket(start, granularity)
+                previous = LEVELS[index - 1] if index else None
+                if previous is None or level_start < now - timedelta(days=previous[2]):
+                    rebuild_from_logs(db, table, granularity, level_start)
+                else:
+                    rebuild(db, table, granularity, previous[1], level_start, None)
+                    db.commit()
+
+            for granularity, table, retention_days in LEVELS:
+                if retention_days:
+                    db.query(table).filter(table.bucket_start < now - timedelta(days=retention_days)) \
+                        .delete(synchronize_session=False)
+            db.commit()
+        except Exception:
+            db.rollback()
+            if dirty_since is not None:
+                self.invalidate_since(dirty_since)
+            raise
+        finally:
+            db.close()
+
+        self._watermark = max_id or 0
+        self._pending_floor = pending_floor
+        # Rows of the current minute may still arrive: it's read from logs until the next run
+        self.covered_until = floor_bucket(now, "minute")
+
+def rebuild(db, table, granularity: str, source, start: datetime, end: datetime | None):
+    """Replaces the buckets of `table` in [start, end) with counts aggregated from `source`."""
+    if source is models.Log:
+        time_column, weight = models.Log.created_at, func.count(models.Log.id)
+    else:
+        time_column, weight = source.bucket_start, func.sum(source.count)
+
+    bucket = bucket_expression(db.bind.dialect.name, time_column, granularity)
+    query = db.query(bucket, source.system_id, source.level, weight).filter(time_column >= start)
+    if end is not None:
+        query = query.filter(time_column < end)
+    rows = [
+        {
+            "system_id": system_id or "",
+            "level": level or "",
+            "bucket_start": parse_bucket(bucket_value, granularity),
+            "count": count,
+        }
+        for bucket_value, system_id, level, count in query.group_by(bucket, source.system_id, source.level)
+    ]
+
+    delete = db.query(table).filter(table.bucket_start >= start)
+    if end is not None:
+        delete = delete.filter(table.bucket_start < end)
+    delete.delete(synchronize_session=False)
+    if rows:
+        db.execute(insert(table), rows)
+
+def rebuild_from_logs(db, table, granularity: str, start: datetime):
+    """Rebuilds from the raw logs one day at a time (one transaction per day)."""
+    chunk_start = start
+    now = naive_utc(datetime.now(timezone.utc))
+    while True:
+        chunk_end = floor_bucket(chunk_start, "day") + timedelta(days=1)
+        last = chunk_end > now
+        rebuild(db, table, granularity, models.Log, chunk_start, None if last else chunk_end)
+        db.commit()
+        if last:
+            return
+        chunk_start = chunk_end
+
+def log_counts(db, granularity: str, start: datetime):
+    """[(bucket, system name, level, count)] aggregated from the raw logs since `start` (range scan on created_at)."""
+    bucket = bucket_expression(db.bind.dialect.name, models.Log.created_at, granularity)
+    counts = db.query(
+        bucket.label('time_bucket'),
+        models.Log.system_id,
+        models.Log.level,
+        func.count(models.Log.id).label('count')
+    ).filter(models.Log.created_at >= start) \
+     .group_by(bucket, models.Log.system_id, models.Log.level).subquery()
+
+    return db.query(counts.c.time_bucket, models.System.name, counts.c.level, counts.c.count) \
+        .join(models.System, models.System.id == counts.c.system_id).all()
+
+def rollup_counts(db, table, granularity: str, start: datetime, end: datetime):
+    """Like log_counts, from a rollup table over [start, end), re-bucketed when it is finer than `granularity`."""
+    if start >= end:
+        return []
+    bucket = table.bucket_start
+    if table is not next(t for g, t, _ in LEVELS if g == granularity):
+        bucket = bucket_expression(db.bind.dialect.name, table.bucket_start, granularity)
+    return db.query(bucket, models.System.name, table.level, func.sum(table.count)) \
+        .join(models.System, models.System.id == table.system_id) \
+        .filter(table.bucket_start >= start, table.bucket_start < end) \
+        .group_by(bucket, models.System.name, table.level).all()
+
+def stats_from_rollups(db, range: str, start_date: datetime, covered_until: datetime):
+    """
+    (bucket label granularity, [(bucket_start, system name, level, count)]) from the
+    rollup tables up to `covered_until`, plus the logs written since then, so /stats
+    doesn't wait for the next compaction. Callers merge rows of the same bucket.
+    """
+    granularity = RANGE_TABLES.get(range, "day")
+    table = next(table for g, table, _ in LEVELS if g == granularity)
+    start = floor_bucket(naive_utc(start_date), granularity)
+    # The coarse bucket holding covered_until is partial: take it from the minute table
+    boundary = max(start, floor_bucket(covered_until, granularity))
+    rows = rollup_counts(db, table, granularity, start, boundary)
+    rows += rollup_counts(db, models.LogRollupMinute, granularity, boundary, covered_until)
+    rows += log_counts(db, granularity, max(start, covered_until))
+    return granularity, rows
+
+rollup_compactor = RollupCompactor(interval=ROLLUP_INTERVAL)
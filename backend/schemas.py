@@ -1,4 +1,4 @@
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, Field
 from datetime import datetime
 
 class SystemCreate(BaseModel):
@@ -9,6 +9,7 @@ class SystemCreate(BaseModel):
     maintenance_email: EmailStr
     status: str = "development"
     technical_info: str | None = None
+    retention_days: int | None = Field(default=None, ge=1)
 
 class SystemUpdate(BaseModel):
     name: str | None = None
@@ -18,6 +19,7 @@ class SystemUpdate(BaseModel):
     maintenance_email: EmailStr | None = None
     status: str | None = None
     technical_info: str | None = None
+    retention_days: int | None = Field(default=None, ge=1)
 
 class SystemResponse(BaseModel):
     id: str
@@ -28,6 +30,7 @@ class SystemResponse(BaseModel):
     maintenance_email: str
     status: str
     technical_info: str | None
+    retention_days: int | None = None
     created_at: datetime
 
     class Config:
@@ -44,11 +47,16 @@ class LogResponse(BaseModel):
     system_id: str
     content: dict | str
     level: str
+    container: str | None = None
     created_at: datetime
 
     class Config:
         from_attributes = True
 
+class LogSearchResult(LogResponse):
+    rank: float
+    highlight: str | None = None # Matched terms wrapped in <mark></mark>
+
 class ReportResponse(BaseModel):
     id: int
     system_id: str
@@ -61,11 +69,13 @@ class ReportResponse(BaseModel):
 
 class FilterCreate(BaseModel):
     pattern: str
+    is_regex: bool = False
 
 class FilterResponse(BaseModel):
     id: int
     system_id: str
     pattern: str
+    is_regex: bool | None = False
     created_at: datetime
 
     class Config:
@@ -73,3 +83,16 @@ class FilterResponse(BaseModel):
 
 class CleanupRequest(BaseModel):
     pattern: str
+    dry_run: bool = False # Only estimate how many logs match
+
+class JobResponse(BaseModel):
+    id: str
+    kind: str
+    system_id: str
+    params: dict | None
+    status: str
+    deleted: int
+    progress: float # 0..1 of the id range scanned
+    error: str | None
+    created_at: datetime
+    finished_at: datetime | None
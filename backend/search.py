@@ -0,0 +1,120 @@
+import os
+import logging
+from sqlalchemy import text, func, literal_column, tuple_, table, column
+from sqlalchemy.orm import Session
+import models
+from migrations import build_index
+from pagination import encode_cursor, decode_cursor, parse_cursor_datetime
+
+# Setup logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SEARCH_MAX_LIMIT = int(os.getenv("SEARCH_MAX_LIMIT", "200"))
+
+HIGHLIGHT_START = "<mark>"
+HIGHLIGHT_STOP = "</mark>"
+
+# Postgres: GIN index over this exact expression ('simple' config: logs mix languages,
+# no stemming). Queries must repeat it verbatim for the index to be used.
+PG_SEARCH_VECTOR = "to_tsvector('simple', coalesce(logs.payload->>'message', ''))"
+PG_SEARCH_INDEX = "ix_logs_search_vector"
+
+# SQLite (development): FTS5 table keyed by logs.id, kept in sync by triggers
+SQLITE_MESSAGE = "coalesce(json_extract({row}.payload, '$.message'), {row}.content)"
+SQLITE_SETUP = [
+    "CREATE VIRTUAL TABLE logs_fts USING fts5(message)",
+    f"INSERT INTO logs_fts(rowid, message) SELECT id, {SQLITE_MESSAGE.format(row='logs')} FROM logs",
+    f"""CREATE TRIGGER logs_fts_insert AFTER INSERT ON logs BEGIN
+        INSERT INTO logs_fts(rowid, message) VALUES (new.id, {SQLITE_MESSAGE.format(row='new')});
+    END""",
+    f"""CREATE TRIGGER logs_fts_update AFTER UPDATE OF payload, content ON logs BEGIN
+        DELETE FROM logs_fts WHERE rowid = old.id;
+        INSERT INTO logs_fts(rowid, message) VALUES (new.id, {SQLITE_MESSAGE.format(row='new')});
+    END""",
+    """CREATE TRIGGER logs_fts_delete AFTER DELETE ON logs BEGIN
+        DELETE FROM logs_fts WHERE rowid = old.id;
+    END""",
+]
+
+logs_fts = table("logs_fts", column("rowid"))
+
+def setup_search(engine):
+    """
+    Boot: creates the SQLite full-text table if it doesn't exist yet. The Postgres
+    GIN index is built later in the background (build_search_index); until then
+    searches work, just without the index.
+    """
+    if engine.dialect.name == "postgresql":
+        return
+
+    with engine.begin() as conn:
+        exists = conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'logs_fts'")).scalar()
+        if not exists:
+            for statement in SQLITE_SETUP:
+                conn.execute(text(statement))
+            logger.info("Created the logs_fts full-text table")
+
+def build_search_index(engine):
+    """Postgres: builds (or rebuilds, if invalid) the GIN index, via migrations.build_indexes."""
+    if build_index(engine, PG_SEARCH_INDEX, "logs", f"USING GIN ({PG_SEARCH_VECTOR})"):
+        logger.info("Built the full-text index of logs")
+
+def fts5_query(q: str):
+    """User text -> FTS5 query: every term quoted (no syntax errors), all terms required."""
+    terms = [term.replace('"', '""') for term in q.split()]
+    return " ".join(f'"{term}"' for term in terms)
+
+def search_logs(
+    db: Session, q: str, sort: str = "rank", limit: int = 50, cursor: str | None = None,
+    system_id: str | None = None, level: str | None = None, since=None, until=None
+):
+    """
+    Full-text search over log messages. Returns (rows, next_cursor) where rows are
+    (Log, rank, highlight) ordered by rank (or by recency with sort='recent').
+    """
+    limit = max(1, min(limit, SEARCH_MAX_LIMIT))
+
+    if db.bind.dialect.name == "postgresql":
+        vector = literal_column(PG_SEARCH_VECTOR)
+        tsquery = func.websearch_to_tsquery(literal_column("'simple'"), q)
+        rank = func.ts_rank_cd(vector, tsquery)
+        highlight = func.ts_headline(
+            literal_column("'simple'"), func.coalesce(models.Log.content["message"].as_string(), ""), tsquery,
+            f"StartSel={HIGHLIGHT_START}, StopSel={HIGHLIGHT_STOP}, MaxFragments=2"
+        )
+        query = db.query(models.Log, rank.label("rank"), highlight.label("highlight")).filter(vector.op("@@")(tsquery))
+    else:
+        fts_table = literal_column("logs_fts")
+        rank = -func.bm25(fts_table) # bm25: lower is better
+        highlight = func.highlight(fts_table, 0, HIGHLIGHT_START, HIGHLIGHT_STOP)
+        query = db.query(models.Log, rank.label("rank"), highlight.label("highlight")) \
+            .join(logs_fts, logs_fts.c.rowid == models.Log.id) \
+            .filter(fts_table.op("MATCH")(fts5_query(q)))
+
+    if system_id:
+        query = query.filter(models.Log.system_id == system_id)
+    if level:
+        query = query.filter(models.Log.level.in_([l.strip() for l in level.split(",") if l.strip()]))
+    if since:
+        query = query.filter(models.Log.created_at >= since)
+    if until:
+        query = query.filter(models.Log.created_at < until)
+
+    if sort == "recent":
+        keys = (models.Log.created_at, models.Log.id)
+        if cursor:
+            created_at, log_id = decode_cursor(cursor, 2)
+            query = query.filter(tuple_(*keys) < tuple_(parse_cursor_datetime(created_at), log_id))
+    else:
+        keys = (rank, models.Log.id)
+        if cursor:
+            query = query.filter(tuple_(*keys) < tuple_(*decode_cursor(cursor, 2)))
+
+    rows = query.order_by(*(key.desc() for key in keys)).limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        log, rank_value, _ = rows[-1]
+        next_cursor = encode_cursor(log.created_at if sort == "recent" else rank_value, log.id)
+    return rows, next_cursor
@@ -0,0 +1,482 @@
+import os
+import json
+import time
+import uuid
+import socket
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import or_, func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects import postgresql, sqlite
+import models
+from database import SessionLocal
+
+# Optional dependency: only needed with SHARED_STATE=redis
+try:
+    import redis.asyncio as aioredis
+except ImportError:
+    aioredis = None
+
+# Setup logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Where state shared by the uvicorn workers lives: memory (single worker) | database | redis
+SHARED_STATE = os.getenv("SHARED_STATE", "memory").lower()
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+# Namespace of the keys and channels, lets several deployments share one Redis
+SHARED_STATE_PREFIX = os.getenv("SHARED_STATE_PREFIX", "logsdb:")
+# database backend: how often workers poll shared_events for pub/sub messages
+SHARED_STATE_POLL_MS = float(os.getenv("SHARED_STATE_POLL_MS", "500"))
+# database backend: seconds published messages (and expired keys) are kept
+SHARED_EVENTS_TTL = float(os.getenv("SHARED_EVENTS_TTL", "60"))
+
+# Identifies this worker process in leases and published messages
+INSTANCE_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+INVALIDATE_CHANNEL = "invalidate"
+
+# Redis: renew / release a lease only while we still own it
+RENEW_LEASE_SCRIPT = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('pexpire', KEYS[1], ARGV[2]) else return 0 end"
+RELEASE_LEASE_SCRIPT = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) else return 0 end"
+
+class SharedState:
+    """
+    State shared by every worker: JSON values with an optional TTL (keys and
+    hashes), pub/sub and leases. Subscription handlers run in the event loop
+    and receive the messages published by the other workers; the publishing
+    worker acts on its own changes directly.
+    """
+
+    name = None
+    distributed = True
+
+    def __init__(self):
+        self._handlers = {} # channel -> [handler(message)]
+        self._invalidators = {} # cache name -> handler(key)
+        self._loop = None
+        self._pending = set() # publish_soon() tasks, referenced until done
+        self.published = 0
+        self.received = 0
+        self.subscribe(INVALIDATE_CHANNEL, self._apply_invalidation)
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+
+    async def stop(self):
+        pass
+
+    def subscribe(self, channel: str, handler):
+        """Registers handler(message) for `channel`; call before start()."""
+        self._handlers.setdefault(channel, []).append(handler)
+
+    def publish_soon(self, channel: str, message):
+        """publish() without waiting for it, callable from worker threads and sync code."""
+        if self._loop is None or not self.distributed:
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            task = self._loop.create_task(self._publish_logged(channel, message))
+            self._pending.add(task)
+            task.add_done_callback(self._pending.discard)
+        else:
+            asyncio.run_coroutine_threadsafe(self._publish_logged(channel, message), self._loop)
+
+    def on_invalidate(self, cache: str, handler):
+        """handler(key) drops entries of a local cache; invalidate() runs it in every worker."""
+        self._invalidators[cache] = handler
+
+    def invalidate(self, cache: str, key=None):
+        """Invalidates `key` (or everything) of a cache here and in the other workers."""
+        self._invalidators[cache](key)
+        self.publish_soon(INVALIDATE_CHANNEL, {"cache": cache, "key": key})
+
+    def stats(self):
+        return {
+            "backend": self.name,
+            "instance": INSTANCE_ID,
+            "published": self.published,
+            "received": self.received,
+        }
+
+    def _deliver(self, channel: str, envelope: dict):
+        if envelope.get("origin") == INSTANCE_ID:
+            return
+        self.received += 1
+        for handler in self._handlers.get(channel, []):
+            try:
+                handler(envelope["data"])
+            except Exception as e:
+                logger.error(f"Error handling shared '{channel}' message: {e}")
+
+    def _apply_invalidation(self, message: dict):
+        handler = self._invalidators.get(message["cache"])
+        if handler is not None:
+            handler(message.get("key"))
+
+    async def _publish_logged(self, channel: str, message):
+        try:
+            await self.publish(channel, message)
+        except Exception as e:
+            logger.error(f"Error publishing shared '{channel}' message: {e}")
+
+    def _envelope(self, message):
+        self.published += 1
+        return json.dumps({"origin": INSTANCE_ID, "data": message}, default=str, ensure_ascii=False)
+
+class MemoryState(SharedState):
+    """Process-local backend: correct with a single worker, the default."""
+
+    name = "memory"
+    distributed = False
+
+    def __init__(self):
+        super().__init__()
+        self._values = {} # key -> (value, expires_at or None)
+        self._hashes = {} # name -> {field: (value, expires_at or None)}
+
+    async def get(self, key: str, default=None):
+        entry = self._values.get(key)
+        return entry[0] if entry and alive(entry[1]) else default
+
+    async def set(self, key: str, value, ttl: float | None = None):
+        self._values[key] = (value, expiry(ttl))
+
+    async def add(self, key: str, value, ttl: float | None = None):
+        """Sets `key` only if it's absent or expired; returns whether it did."""
+        entry = self._values.get(key)
+        if entry and alive(entry[1]):
+            return False
+        self._values[key] = (value, expiry(ttl))
+        return True
+
+    async def delete(self, key: str):
+        self._values.pop(key, None)
+
+    async def hset(self, name: str, field, value, ttl: float | None = None):
+        self._hashes.setdefault(name, {})[str(field)] = (value, expiry(ttl))
+
+    async def hdel(self, name: str, field):
+        self._hashes.get(name, {}).pop(str(field), None)
+
+    async def hgetall(self, name: str):
+        entries = self._hashes.get(name, {})
+        for field in [field for field, (_, expires_at) in entries.items() if not alive(expires_at)]:
+            del entries[field]
+        return {field: value for field, (value, _) in entries.items()}
+
+    async def publish(self, channel: str, message):
+        pass # No other worker to tell
+
+    async def acquire_lease(self, name: str, ttl: float):
+        return True
+
+    async def release_lease(self, name: str):
+        pass
+
+class DatabaseState(SharedState):
+    """
+    Backend on the application database (shared_state / shared_events tables),
+    for deployments without Redis. Pub/sub is polled every SHARED_STATE_POLL_MS
+    and best effort, which fits cache invalidation and live views.
+    """
+
+    name = "database"
+
+    def __init__(self, poll_ms: float):
+        super().__init__()
+        self.poll_interval = poll_ms / 1000
+        self._last_event_id = 0
+        self._last_purge = 0.0
+        self._task = None
+
+    async def start(self):
+        await super().start()
+        self._last_event_id = await asyncio.to_thread(latest_event_id)
+        self._task = asyncio.create_task(self._poll_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def get(self, key: str, default=None):
+        value = await asyncio.to_thread(db_get, key)
+        return default if value is None else json.loads(value)
+
+    async def set(self, key: str, value, ttl: float | None = None):
+        await asyncio.to_thread(db_set, key, json.dumps(value, default=str), expiry_datetime(ttl))
+
+    async def add(self, key: str, value, ttl: float | None = None):
+        """Sets `key` only if it's absent or expired; returns whether it did."""
+        return await asyncio.to_thread(db_claim, key, json.dumps(value, default=str), expiry_datetime(ttl), None)
+
+    async def delete(self, key: str):
+        await asyncio.to_thread(db_delete, key)
+
+    async def hset(self, name: str, field, value, ttl: float | None = None):
+        await self.set(hash_key(name, field), value, ttl)
+
+    async def hdel(self, name: str, field):
+        await self.delete(hash_key(name, field))
+
+    async def hgetall(self, name: str):
+        prefix = hash_key(name, "")
+        rows = await asyncio.to_thread(db_get_prefix, prefix)
+        return {key[len(prefix):]: json.loads(value) for key, value in rows}
+
+    async def publish(self, channel: str, message):
+        await asyncio.to_thread(db_publish, channel, self._envelope(message))
+
+    async def acquire_lease(self, name: str, ttl: float):
+        owner = json.dumps(INSTANCE_ID)
+        return await asyncio.to_thread(db_claim, lease_key(name), owner, expiry_datetime(ttl), owner)
+
+    async def release_lease(self, name: str):
+        await asyncio.to_thread(db_delete, lease_key(name), json.dumps(INSTANCE_ID))
+
+    async def _poll_loop(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                events = await asyncio.to_thread(db_read_events, self._last_event_id, list(self._handlers))
+                for event_id, channel, payload in events:
+                    self._last_event_id = event_id
+                    self._deliver(channel, json.loads(payload))
+                if time.monotonic() - self._last_purge > SHARED_EVENTS_TTL:
+                    await asyncio.to_thread(db_purge, SHARED_EVENTS_TTL)
+                    self._last_purge = time.monotonic()
+            except Exception as e:
+                logger.error(f"Error polling shared events: {e}")
+
+class RedisState(SharedState):
+    """Backend on Redis or any compatible server (Valkey, KeyDB, Dragonfly)."""
+
+    name = "redis"
+
+    def __init__(self, url: str, prefix: str):
+        super().__init__()
+        if aioredis is None:
+            raise RuntimeError("SHARED_STATE=redis requires the 'redis' package")
+        self.client = aioredis.from_url(url, decode_responses=True)
+        self.prefix = prefix
+        self._task = None
+
+    async def start(self):
+        await super().start()
+        self._task = asyncio.create_task(self._listen_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.client.aclose()
+
+    async def get(self, key: str, default=None):
+        value = await self.client.get(self.prefix + key)
+        return default if value is None else json.loads(value)
+
+    async def set(self, key: str, value, ttl: float | None = None):
+        await self.client.set(self.prefix + key, json.dumps(value, default=str), px=milliseconds(ttl))
+
+    async def add(self, key: str, value, ttl: float | None = None):
+        """Sets `key` only if it's absent or expired; returns whether it did."""
+        return bool(await self.client.set(self.prefix + key, json.dumps(value, default=str), px=milliseconds(ttl), nx=True))
+
+    async def delete(self, key: str):
+        await self.client.delete(self.prefix + key)
+
+    async def hset(self, name: str, field, value, ttl: float | None = None):
+        # Hash fields can't expire on older servers: the expiry travels with the value
+        entry = {"value": value, "expires_at": time.time() + ttl if ttl else None}
+        await self.client.hset(self.prefix + name, str(field), json.dumps(entry, default=str))
+
+    async def hdel(self, name: str, field):
+        await self.client.hdel(self.prefix + name, str(field))
+
+    async def hgetall(self, name: str):
+        result, expired = {}, []
+        for field, raw in (await self.client.hgetall(self.prefix + name)).items():
+            entry = json.loads(raw)
+            if alive(entry["expires_at"]):
+                result[field] = entry["value"]
+            else:
+                expired.append(field)
+        if expired:
+            await self.client.hdel(self.prefix + name, *expired)
+        return result
+
+    async def publish(self, channel: str, message):
+        await self.client.publish(self.prefix + channel, self._envelope(message))
+
+    async def acquire_lease(self, name: str, ttl: float):
+        key = self.prefix + lease_key(name)
+        if await self.client.set(key, INSTANCE_ID, px=milliseconds(ttl), nx=True):
+            return True
+        return bool(await self.client.eval(RENEW_LEASE_SCRIPT, 1, key, INSTANCE_ID, milliseconds(ttl)))
+
+    async def release_lease(self, name: str):
+        await self.client.eval(RELEASE_LEASE_SCRIPT, 1, self.prefix + lease_key(name), INSTANCE_ID)
+
+    async def _listen_loop(self):
+        channels = [self.prefix + channel for channel in self._handlers]
+        while True:
+            pubsub = self.client.pubsub()
+            try:
+                await pubsub.subscribe(*channels)
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        self._deliver(message["channel"][len(self.prefix):], json.loads(message["data"]))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Messages sent while disconnected are lost; TTLs bound the resulting staleness
+                logger.error(f"Shared state subscription lost, reconnecting: {e}")
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.aclose()
+
+def alive(expires_at):
+    return expires_at is None or expires_at > time.time()
+
+def expiry(ttl: float | None):
+    return time.time() + ttl if ttl else None
+
+def expiry_datetime(ttl: float | None):
+    return datetime.now(timezone.utc) + timedelta(seconds=ttl) if ttl else None
+
+def milliseconds(ttl: float | None):
+    return int(ttl * 1000) if ttl else None
+
+def hash_key(name: str, field):
+    return f"{name}/{field}"
+
+def lease_key(name: str):
+    return f"lease/{name}"
+
+def not_expired(now: datetime):
+    return or_(models.SharedStateEntry.expires_at.is_(None), models.SharedStateEntry.expires_at > now)
+
+def db_get(key: str):
+    db = SessionLocal()
+    try:
+        return db.query(models.SharedStateEntry.value).filter(
+            models.SharedStateEntry.key == key, not_expired(datetime.now(timezone.utc))
+        ).scalar()
+    finally:
+        db.close()
+
+def db_get_prefix(prefix: str):
+    db = SessionLocal()
+    try:
+        return db.query(models.SharedStateEntry.key, models.SharedStateEntry.value).filter(
+            models.SharedStateEntry.key.startswith(prefix, autoescape=True),
+            not_expired(datetime.now(timezone.utc)),
+        ).all()
+    finally:
+        db.close()
+
+def db_set(key: str, value: str, expires_at: datetime | None):
+    db = SessionLocal()
+    try:
+        dialect = postgresql if db.bind.dialect.name == "postgresql" else sqlite
+        stmt = dialect.insert(models.SharedStateEntry).values(key=key, value=value, expires_at=expires_at)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["key"], set_={"value": stmt.excluded.value, "expires_at": stmt.excluded.expires_at}
+        )
+        db.execute(stmt)
+        db.commit()
+    finally:
+        db.close()
+
+def db_claim(key: str, value: str, expires_at: datetime | None, owner: str | None):
+    """
+    Writes `key` if it's missing, expired or (with `owner`) still holds `owner`.
+    Returns whether it did; concurrent claimers are serialized by the row.
+    """
+    entry = models.SharedStateEntry
+    db = SessionLocal()
+    try:
+        claimable = entry.expires_at < datetime.now(timezone.utc)
+        if owner is not None:
+            claimable = or_(claimable, entry.value == owner)
+        updated = db.query(entry).filter(entry.key == key, claimable).update(
+            {entry.value: value, entry.expires_at: expires_at}, synchronize_session=False
+        )
+        if not updated:
+            if db.query(func.count()).select_from(entry).filter(entry.key == key).scalar():
+                db.rollback()
+                return False
+            db.add(entry(key=key, value=value, expires_at=expires_at))
+        db.commit()
+        return True
+    except IntegrityError:
+        db.rollback() # Another worker inserted it first
+        return False
+    finally:
+        db.close()
+
+def db_delete(key: str, owner: str | None = None):
+    db = SessionLocal()
+    try:
+        query = db.query(models.SharedStateEntry).filter(models.SharedStateEntry.key == key)
+        if owner is not None:
+            query = query.filter(models.SharedStateEntry.value == owner)
+        query.delete(synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+def db_publish(channel: str, payload: str):
+    db = SessionLocal()
+    try:
+        db.add(models.SharedEvent(channel=channel, payload=payload, created_at=datetime.now(timezone.utc)))
+        db.commit()
+    finally:
+        db.close()
+
+def latest_event_id():
+    db = SessionLocal()
+    try:
+        return db.query(func.max(models.SharedEvent.id)).scalar() or 0
+    finally:
+        db.close()
+
+def db_read_events(after_id: int, channels: list):
+    db = SessionLocal()
+    try:
+        return db.query(models.SharedEvent.id, models.SharedEvent.channel, models.SharedEvent.payload) \
+            .filter(models.SharedEvent.id > after_id, models.SharedEvent.channel.in_(channels)) \
+            .order_by(models.SharedEvent.id).limit(1000).all()
+    finally:
+        db.close()
+
+def db_purge(max_age: float):
+    """Removes old messages and expired keys (any worker may run it)."""
+    now = datetime.now(timezone.utc)
+    db = SessionLocal()
+    try:
+        db.query(models.SharedEvent).filter(models.SharedEvent.created_at < now - timedelta(seconds=max_age)) \
+            .delete(synchronize_session=False)
+        db.query(models.SharedStateEntry).filter(models.SharedStateEntry.expires_at < now) \
+            .delete(synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+def create_shared_state(backend: str):
+    if backend == "redis":
+        return RedisState(REDIS_URL, SHARED_STATE_PREFIX)
+    if backend == "database":
+        return DatabaseState(SHARED_STATE_POLL_MS)
+    if backend != "memory":
+        logger.warning(f"Unknown SHARED_STATE '{backend}', using memory")
+    return MemoryState()
+
+shared_state = create_shared_state(SHARED_STATE)
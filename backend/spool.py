@@ -0,0 +1,429 @@
+import os
+import json
+import zlib
+import glob
+import fcntl
+import struct
+import itertools
+import asyncio
+import logging
+from datetime import datetime
+from sqlalchemy import text
+from sqlalchemy.dialects import postgresql, sqlite
+import models
+from database import SessionLocal, is_connection_error
+from fingerprint import Fingerprint
+from log_writer import register_templates, remember_templates, insert_log_rows, parse_legacy_content, strip_nul
+from classification_queue import classification_queue
+from live_tail import log_broadcaster
+from shared_state import shared_state
+
+# Setup logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# off | fallback: spool only while the database is failing | always: every log goes through the spool
+SPOOL_MODE = os.getenv("SPOOL_MODE", "fallback").lower()
+SPOOL_DIR = os.getenv("SPOOL_DIR", "spool")
+SPOOL_SEGMENT_BYTES = int(os.getenv("SPOOL_SEGMENT_BYTES", str(16 * 1024 * 1024)))
+# Appends are acknowledged after the next group fsync
+SPOOL_FSYNC_INTERVAL_MS = float(os.getenv("SPOOL_FSYNC_INTERVAL_MS", "20"))
+SPOOL_REPLAY_INTERVAL = float(os.getenv("SPOOL_REPLAY_INTERVAL", "5" if SPOOL_MODE != "always" else "1"))
+SPOOL_REPLAY_BATCH = int(os.getenv("SPOOL_REPLAY_BATCH", "1000"))
+# Records the database refuses (bad data, not an outage) are moved here, one JSON object per line
+SPOOL_QUARANTINE_FILE = os.getenv("SPOOL_QUARANTINE_FILE", os.path.join(SPOOL_DIR, "quarantine.jsonl"))
+
+# Record framing: payload length + crc32 of the payload, then the JSON payload
+HEADER = struct.Struct(">II")
+
+def encode_record(record: dict):
+    payload = json.dumps(record, default=str, ensure_ascii=False).encode("utf-8")
+    return HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+def read_segment(path: str):
+    """Returns the valid records of a segment file, stopping at a torn tail write."""
+    records = []
+    with open(path, "rb") as f:
+        data = f.read()
+    offset = 0
+    while offset + HEADER.size <= len(data):
+        length, crc = HEADER.unpack_from(data, offset)
+        payload = data[offset + HEADER.size:offset + HEADER.size + length]
+        if len(payload) < length:
+            logger.warning(f"Truncated record at offset {offset} in {path}, ignoring the tail")
+            break
+        offset += HEADER.size + length
+        if zlib.crc32(payload) != crc:
+            logger.error(f"Corrupted record at offset {offset} in {path}, skipping it")
+            continue
+        records.append(json.loads(payload))
+    return records
+
+def highest_spooled_id(base_directory: str = SPOOL_DIR):
+    """Highest pre-allocated log id still waiting in any spool segment under `base_directory`, or 0."""
+    paths = glob.glob(os.path.join(base_directory, "segment-*.log")) + \
+        glob.glob(os.path.join(base_directory, "worker-*", "segment-*.log"))
+    highest = 0
+    for path in paths:
+        try:
+            records = read_segment(path)
+        except FileNotFoundError: # Replayed meanwhile, its rows are in the table now
+            continue
+        for record in records:
+            log_id = record.get("row", {}).get("id")
+            if isinstance(log_id, int):
+                highest = max(highest, log_id)
+    return highest
+
+def spool_record(row: dict, fp: Fingerprint):
+    """Spool representation of a logs row (plus its template, registered on replay)."""
+    row = dict(row)
+    if isinstance(row.get("created_at"), datetime):
+        row["created_at"] = row["created_at"].isoformat()
+    # Not in any classification queue: the recovery sweep claims it after the replay
+    row.pop("claimed_at", None)
+    return {"row": row, "template_id": fp.template_id, "template": fp.template}
+
+def lock_directory(directory: str):
+    """Exclusive, non-blocking lock on `directory` (released when the returned file closes), or None."""
+    os.makedirs(directory, exist_ok=True)
+    lock = open(os.path.join(directory, ".lock"), "a")
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return lock
+    except BlockingIOError:
+        lock.close()
+        return None
+
+def claim_slot(base_directory: str):
+    """
+    Locks the first free worker-N subdirectory for this process, so uvicorn
+    workers sharing SPOOL_DIR never write or replay the same segments.
+    Returns (slot, directory, lock).
+    """
+    for slot in itertools.count():
+        directory = os.path.join(base_directory, f"worker-{slot}")
+        lock = lock_directory(directory)
+        if lock is not None:
+            return slot, directory, lock
+
+class Spool:
+    """
+    Append-only local spool of length-prefixed, checksummed records split in
+    segment files. Appends are written immediately and acknowledged after a
+    group fsync; a replayer streams sealed segments into the logs table once the
+    database is reachable and deletes them. Each worker process owns one slot
+    directory under SPOOL_DIR.
+    """
+
+    def __init__(self, directory: str, segment_bytes: int, fsync_interval_ms: float):
+        self.base_directory = directory
+        self.directory = None
+        self._lock = None
+        self.segment_bytes = segment_bytes
+        self.fsync_interval = fsync_interval_ms / 1000.0
+        self.db_healthy = True
+        self._file = None
+        self._path = None
+        self._size = 0
+        self._next_seq = 0
+        self._sealed = []
+        self._closing = [] # (file, path) waiting for the final fsync
+        self._waiter = None
+        self._dirty = False
+        self._tasks = []
+        self.records_written = 0
+        self.records_replayed = 0
+        self.records_quarantined = 0
+        self.last_error = None
+
+    @property
+    def enabled(self):
+        return bool(self._tasks)
+
+    @property
+    def diverting(self):
+        """True when new logs should skip the database and go straight to the spool."""
+        return self.enabled and (SPOOL_MODE == "always" or not self.db_healthy)
+
+    def start(self):
+        if self.enabled:
+            return
+        slot, self.directory, self._lock = claim_slot(self.base_directory)
+        # Segments left by a previous run are sealed and replayed first
+        self._sealed = sorted(glob.glob(os.path.join(self.directory, "segment-*.log")))
+        if self._sealed:
+            self._next_seq = int(os.path.basename(self._sealed[-1])[8:-4]) + 1
+        if slot == 0:
+            # Written before the per-worker slots existed
+            self._sealed = sorted(glob.glob(os.path.join(self.base_directory, "segment-*.log"))) + self._sealed
+        self._open_segment()
+        self._tasks = [
+            asyncio.create_task(self._sync_loop()),
+            asyncio.create_task(self._replay_loop()),
+        ]
+        logger.info(f"Spool started in '{self.directory}' ({len(self._sealed)} segments to replay)")
+
+    async def stop(self):
+        if not self.enabled:
+            return
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._sync_pending()
+        self._file.close()
+        if self._size == 0:
+            os.remove(self._path)
+        self._lock.close()
+
+    def mark_db_unhealthy(self, error):
+        if self.db_healthy:
+            logger.error(f"Database unavailable, spooling logs to disk: {error}")
+        self.db_healthy = False
+        self.last_error = str(error)
+
+    def quarantine(self, rejected: list):
+        """
+        Appends (record, error) pairs the database refused to SPOOL_QUARANTINE_FILE, so
+        they don't block the replay (blocking). Works whether or not the spool is running.
+        """
+        if not rejected:
+            return
+        os.makedirs(os.path.dirname(SPOOL_QUARANTINE_FILE) or ".", exist_ok=True)
+        lines = "".join(
+            json.dumps({"error": str(error), "record": record}, default=str, ensure_ascii=False) + "\n"
+            for record, error in rejected
+        )
+        with open(SPOOL_QUARANTINE_FILE, "a", encoding="utf-8") as f:
+            f.write(lines)
+            f.flush()
+            os.fsync(f.fileno())
+        self.records_quarantined += len(rejected)
+        logger.error(f"Quarantined {len(rejected)} logs the database rejected in {SPOOL_QUARANTINE_FILE}: {rejected[0][1]}")
+
+    async def append(self, records: list):
+        """Appends records and returns once they are fsynced to disk."""
+        data = b"".join(encode_record(record) for record in records)
+        self._file.write(data)
+        self._size += len(data)
+        self._dirty = True
+        self.records_written += len(records)
+        if self._size >= self.segment_bytes:
+            self._rotate()
+
+        if self._waiter is None:
+            self._waiter = asyncio.get_running_loop().create_future()
+        await asyncio.shield(self._waiter)
+
+    def stats(self):
+        return {
+            "mode": SPOOL_MODE,
+            "enabled": self.enabled,
+            "directory": self.directory,
+            "db_healthy": self.db_healthy,
+            "pending_segments": len(self._sealed) + len(self._closing) + (1 if self._size else 0),
+            "active_segment_bytes": self._size,
+            "records_written": self.records_written,
+            "records_replayed": self.records_replayed,
+            "records_quarantined": self.records_quarantined,
+            "last_error": self.last_error,
+        }
+
+    def _open_segment(self):
+        self._path = os.path.join(self.directory, f"segment-{self._next_seq:012d}.log")
+        self._next_seq += 1
+        self._file = open(self._path, "ab")
+        self._size = 0
+
+    def _rotate(self):
+        self._closing.append((self._file, self._path))
+        self._open_segment()
+
+    def _sync_pending(self):
+        """Flushes + fsyncs the active segment and seals rotated ones (blocking)."""
+        closing, self._closing = self._closing, []
+        for f, _ in closing + [(self._file, self._path)]:
+            f.flush()
+            os.fsync(f.fileno())
+        for f, path in closing:
+            f.close()
+            self._sealed.append(path)
+
+    async def _sync_loop(self):
+        while True:
+            await asyncio.sleep(self.fsync_interval)
+            if not self._dirty and not self._closing:
+                continue
+            waiter, self._waiter = self._waiter, None
+            self._dirty = False
+            try:
+                await asyncio.to_thread(self._sync_pending)
+                if waiter is not None:
+                    waiter.set_result(None)
+            except Exception as e:
+                logger.error(f"Spool fsync failed: {e}")
+                if waiter is not None:
+                    waiter.set_exception(e)
+
+    async def _replay_loop(self):
+        while True:
+            await asyncio.sleep(SPOOL_REPLAY_INTERVAL)
+            try:
+                if not self.db_healthy:
+                    await asyncio.to_thread(ping_database)
+                    self.db_healthy = True
+                    logger.info("Database reachable again, replaying spool")
+
+                if self._size:
+                    self._rotate()
+                    await asyncio.sleep(self.fsync_interval * 2) # Let the sync loop seal it
+
+                replayed = 0
+                while self._sealed:
+                    path = self._sealed[0]
+                    replayed += await asyncio.to_thread(replay_segment, path)
+                    os.remove(path)
+                    self._sealed.pop(0)
+                replayed += await asyncio.to_thread(self._replay_orphans)
+                if replayed:
+                    self.records_replayed += replayed
+                    # Replayed rows are still 'pending': let the classification queue pick them up
+                    classification_queue.request_recovery()
+            except Exception as e:
+                if is_connection_error(e):
+                    self.mark_db_unhealthy(e)
+                    continue
+                self.last_error = str(e)
+                logger.error(f"Error replaying spool: {e}")
+
+    def _replay_orphans(self):
+        """Replays the slots no running worker holds, e.g. after scaling down (blocking)."""
+        replayed = 0
+        for directory in sorted(glob.glob(os.path.join(self.base_directory, "worker-*"))):
+            if directory == self.directory or not glob.glob(os.path.join(directory, "segment-*.log")):
+                continue
+            lock = lock_directory(directory)
+            if lock is None:
+                continue
+            try:
+                for path in sorted(glob.glob(os.path.join(directory, "segment-*.log"))):
+                    replayed += replay_segment(path)
+                    os.remove(path)
+            finally:
+                lock.close()
+        return replayed
+
+def ping_database():
+    db = SessionLocal()
+    try:
+        db.execute(text("SELECT 1"))
+    finally:
+        db.close()
+
+def spooled_row(record: dict):
+    """logs row of a spool record, in the shape the insert expects."""
+    row = dict(record["row"])
+    if isinstance(row.get("content"), str): # Spooled before content became a JSON column
+        row["content"] = parse_legacy_content(row["content"])
+    # Spooled before NUL characters were stripped at ingest
+    row["content"] = strip_nul(row.get("content"))
+    row["container"] = strip_nul(row.get("container"))
+    if row.get("created_at"):
+        row["created_at"] = datetime.fromisoformat(row["created_at"])
+    return row
+
+def record_fingerprint(record: dict):
+    return Fingerprint(record["template"], record["template_id"], [])
+
+def write_spooled_rows(db, dialect, records: list):
+    """
+    Inserts spool records with their templates (no commit). Returns the rows with
+    a pre-allocated id that were actually inserted, the rows without one and their new ids.
+    """
+    template_ids = register_templates(db, [record_fingerprint(record) for record in records])
+    rows = [spooled_row(record) for record in records]
+    # Rows with a pre-allocated id (write-behind mode) are idempotent on replay. No conflict
+    # target: the key is (id, created_at) when logs is partitioned
+    with_id = [row for row in rows if row.get("id") is not None]
+    without_id = [{k: v for k, v in row.items() if k != "id"} for row in rows if row.get("id") is None]
+    inserted_ids = set()
+    for i in range(0, len(with_id), SPOOL_REPLAY_BATCH):
+        # RETURNING only yields the rows actually inserted, not the ones already stored
+        stmt = dialect.insert(models.Log).on_conflict_do_nothing().returning(models.Log.id)
+        inserted_ids.update(db.scalars(stmt, with_id[i:i + SPOOL_REPLAY_BATCH]).all())
+    new_ids = []
+    for i in range(0, len(without_id), SPOOL_REPLAY_BATCH):
+        new_ids += insert_log_rows(db, without_id[i:i + SPOOL_REPLAY_BATCH])
+    inserted = [row for row in with_id if row["id"] in inserted_ids]
+    return template_ids, inserted, without_id, new_ids
+
+def replay_records(records: list, isolate: bool):
+    """
+    Writes spool records in one transaction (blocking). With `isolate`, each record
+    gets its own savepoint and the ones the database refuses are returned as
+    (record, error) instead of failing the whole transaction.
+    """
+    db = SessionLocal()
+    template_ids, inserted, without_id, new_ids, rejected = [], [], [], [], []
+    try:
+        dialect = postgresql if db.bind.dialect.name == "postgresql" else sqlite
+        if not isolate:
+            template_ids, inserted, without_id, new_ids = write_spooled_rows(db, dialect, records)
+        else:
+            for record in records:
+                try:
+                    with db.begin_nested():
+                        result = write_spooled_rows(db, dialect, [record])
+                except Exception as e:
+                    if is_connection_error(e):
+                        raise
+                    rejected.append((record, e))
+                    continue
+                template_ids += result[0]
+                inserted += result[1]
+                without_id += result[2]
+                new_ids += result[3]
+        db.commit()
+        remember_templates(template_ids)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+    return inserted, without_id, new_ids, rejected
+
+def replay_segment(path: str):
+    """
+    Writes all records of a segment in one transaction (blocking). When that
+    fails for a reason other than the database being unreachable, the records
+    are retried one by one and the ones still refused go to the quarantine file,
+    so a single bad record can't hold up the spool. Returns the record count.
+    """
+    records = read_segment(path)
+    if not records:
+        return 0
+
+    try:
+        inserted, without_id, new_ids, rejected = replay_records(records, isolate=False)
+    except Exception as e:
+        if is_connection_error(e):
+            raise
+        logger.warning(f"Replaying {os.path.basename(path)} failed ({e}), retrying record by record")
+        inserted, without_id, new_ids, rejected = replay_records(records, isolate=True)
+    spool.quarantine(rejected)
+
+    log_broadcaster.publish_logs(inserted)
+    log_broadcaster.publish_logs(without_id, new_ids)
+    # Pre-allocated ids may be below the compactor's watermark: recount their buckets
+    oldest = min((row["created_at"] for row in inserted + without_id if row.get("created_at")), default=None)
+    if oldest is not None:
+        shared_state.invalidate("rollups", oldest)
+    logger.info(f"Replayed {len(records) - len(rejected)} spooled logs from {os.path.basename(path)}")
+    return len(records) - len(rejected)
+
+spool = Spool(
+    directory=SPOOL_DIR,
+    segment_bytes=SPOOL_SEGMENT_BYTES,
+    fsync_interval_ms=SPOOL_FSYNC_INTERVAL_MS,
+)
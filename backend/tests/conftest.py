@@ -0,0 +1,51 @@
+import os
+import sys
+import tempfile
+
+# The backend modules are imported flat, as in the Dockerfile (WORKDIR backend)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_tmp = tempfile.mkdtemp(prefix="logs_db_tests_")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_tmp, 'test.db')}")
+os.environ.setdefault("MASTER_KEY", "test-master-key")
+os.environ.setdefault("SPOOL_DIR", os.path.join(_tmp, "spool"))
+os.environ.setdefault("SHARED_STATE", "memory")
+os.environ.setdefault("RETENTION", "false")
+
+import pytest
+import ai_service
+import discord_client
+
+MASTER_HEADERS = {"x-master-key": os.environ["MASTER_KEY"]}
+
+async def _classify_batch(batch, fallback="normal"):
+    return ["normal" for _ in batch]
+
+async def _classify_one(message, fallback="normal"):
+    return "normal"
+
+async def _noop(*args, **kwargs):
+    return None
+
+# No network in tests: the AI and Discord are stubbed out
+ai_service.classify_logs_batch = _classify_batch
+ai_service.classify_log_with_ai = _classify_one
+discord_client.login = _noop
+discord_client.close = _noop
+discord_client.send_message = _noop
+
+@pytest.fixture(scope="session")
+def client():
+    from fastapi.testclient import TestClient
+    import main
+    with TestClient(main.app) as test_client:
+        yield test_client
+
+@pytest.fixture
+def api_headers(client):
+    """x-api-key header of a freshly registered system."""
+    response = client.post("/register", headers=MASTER_HEADERS, json={
+        "name": "test", "client_email": "test@example.com", "maintenance_email": "test@example.com"
+    })
+    assert response.status_code == 200
+    return {"x-api-key": response.json()["id"]}
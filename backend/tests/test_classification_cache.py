@@ -0,0 +1,15 @@
+from classification_cache import ClassificationCache, cache_key
+
+def test_messages_differing_in_status_code_do_not_share_a_label():
+    cache = ClassificationCache(max_size=100, ttl=60, persist=False)
+    cache.set("GET /api returned 500", "erro")
+
+    assert cache.get("GET /api returned 200") is None
+    assert cache.get("GET /api returned 500") == "erro"
+    assert cache_key("exit code 1") != cache_key("exit code 0")
+
+def test_timestamps_and_request_ids_share_a_label():
+    first = "2026-10-17T10:00:01Z request 3f2b9c1e-8a4d-4e6f-9b0a-1c2d3e4f5a6b failed with 500"
+    second = "2026-10-17T11:42:59Z request 7d1e0f2a-1b3c-4d5e-8f9a-0b1c2d3e4f5a failed with 500"
+
+    assert cache_key(first) == cache_key(second)
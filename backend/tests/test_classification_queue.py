@@ -0,0 +1,31 @@
+from datetime import datetime, timedelta, timezone
+import models
+from database import SessionLocal
+from classification_queue import claim_pending_jobs, store_classification, PENDING_LEVEL, CLASSIFY_CLAIM_TIMEOUT
+
+def add_pending_log(system_id, message, claimed_at=None):
+    with SessionLocal() as db:
+        log = models.Log(system_id=system_id, content={"message": message, "container": None},
+                         level=PENDING_LEVEL, claimed_at=claimed_at)
+        db.add(log)
+        db.commit()
+        return log.id
+
+def test_sweep_skips_logs_queued_in_another_worker(client, api_headers):
+    system_id = api_headers["x-api-key"]
+    now = datetime.now(timezone.utc)
+    unclaimed = add_pending_log(system_id, "left behind by a restart")
+    queued_elsewhere = add_pending_log(system_id, "in another worker's queue", claimed_at=now)
+    stale = add_pending_log(system_id, "claimed by a dead worker", claimed_at=now - timedelta(seconds=CLASSIFY_CLAIM_TIMEOUT + 1))
+
+    claimed = {job.log_id for job in claim_pending_jobs(1000)}
+
+    assert {unclaimed, stale} <= claimed
+    assert queued_elsewhere not in claimed
+    assert not {unclaimed, stale} & {job.log_id for job in claim_pending_jobs(1000)}
+
+def test_a_log_is_only_classified_once(client, api_headers):
+    log_id = add_pending_log(api_headers["x-api-key"], "classified twice")
+
+    assert store_classification(log_id, "erro")
+    assert not store_classification(log_id, "normal")
@@ -0,0 +1,74 @@
+import asyncio
+from ingest_buffer import IngestBuffer, BufferFull
+
+def test_concurrent_appends_never_overflow_the_buffer():
+    buffer = IngestBuffer(max_size=10, flush_rows=1000, flush_interval_ms=1000, id_block=1)
+    next_id = iter(range(1, 1000))
+
+    async def slow_allocate(count):
+        await asyncio.sleep(0.01) # Every append waits for its ids at the same time
+        return [next(next_id) for _ in range(count)]
+    buffer.ids.allocate = slow_allocate
+
+    async def append():
+        try:
+            return await buffer.append([({}, None, None) for _ in range(4)])
+        except BufferFull:
+            return None
+
+    async def run():
+        buffer._wakeup = asyncio.Event()
+        return await asyncio.gather(*(append() for _ in range(5)))
+
+    results = asyncio.run(run())
+
+    assert sum(result is not None for result in results) == 2
+    assert len(buffer._entries) == 8
+    assert buffer.free_slots() == 2
+
+def test_spool_failure_keeps_rows_and_the_flusher_alive(monkeypatch):
+    import ingest_buffer
+    from spool import spool
+
+    def database_down(entries, isolate=False):
+        raise ConnectionRefusedError("database down")
+
+    async def disk_full(records):
+        raise OSError(28, "No space left on device")
+
+    monkeypatch.setattr(ingest_buffer, "write_entries", database_down)
+    monkeypatch.setattr(ingest_buffer, "INGEST_RETRY_DELAY", 0.01)
+    monkeypatch.setattr(spool, "_tasks", [object()]) # Spool reported as running
+    monkeypatch.setattr(spool, "append", disk_full)
+    monkeypatch.setattr(spool, "db_healthy", True) # Restored afterwards: the flush marks it down
+    buffer = IngestBuffer(max_size=10, flush_rows=2, flush_interval_ms=5, id_block=10)
+
+    async def run():
+        buffer.ids.allocate = lambda count: asyncio.sleep(0, result=list(range(1, count + 1)))
+        buffer.start()
+        await buffer.append([({}, None, None) for _ in range(3)])
+        await asyncio.sleep(0.1)
+        alive = not buffer._task.done()
+        buffer._task.cancel()
+        return alive
+
+    assert asyncio.run(run())
+    assert len(buffer._entries) == 3
+    assert buffer.failed_flushes >= 2
+
+def test_sqlite_ids_skip_the_ones_still_in_the_spool(client, tmp_path, monkeypatch):
+    import ingest_buffer
+    import spool as spool_module
+    from sqlalchemy import func
+    import models
+    from database import SessionLocal
+
+    with SessionLocal() as db:
+        table_max = db.query(func.coalesce(func.max(models.Log.id), 0)).scalar()
+    segment = tmp_path / "worker-0" / "segment-000000000000.log"
+    segment.parent.mkdir()
+    segment.write_bytes(spool_module.encode_record({"row": {"id": table_max + 500}, "template_id": "t", "template": "t"}))
+    monkeypatch.setattr(ingest_buffer, "highest_spooled_id", lambda: spool_module.highest_spooled_id(str(tmp_path)))
+    monkeypatch.setattr(ingest_buffer, "_sqlite_next_id", 0) # As after a restart
+
+    assert ingest_buffer.reserve_ids(3) == [table_max + 501, table_max + 502, table_max + 503]
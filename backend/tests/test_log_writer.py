@@ -0,0 +1,18 @@
+import json
+from log_writer import parse_legacy_content
+
+def test_nul_characters_are_stripped_at_ingest(client, api_headers):
+    response = client.post("/webhook", headers=api_headers, json={"message": "boot\x00 ok", "container": "api\x00"})
+    assert response.status_code == 200
+    batch = [{"message": {"line": "disk\x00 full", "fields": ["a\x00b"]}}]
+    assert client.post("/webhook/batch", headers=api_headers, json=batch).status_code == 200
+
+    logs = client.get("/logs", params={"system_id": api_headers["x-api-key"]}).json()
+
+    assert "\x00" not in json.dumps([log["content"] for log in logs], ensure_ascii=False)
+    assert {"message": "boot ok", "container": "api"} in [log["content"] for log in logs]
+
+def test_backfilled_legacy_content_has_no_nul_characters():
+    legacy = json.dumps({"message": "stack\x00trace", "container": "worker"})
+
+    assert parse_legacy_content(legacy) == {"message": "stacktrace", "container": "worker"}
@@ -0,0 +1,59 @@
+import os
+from datetime import datetime, timedelta, timezone
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+import models
+from database import SessionLocal
+from retention import delete_expired_logs
+
+# Dedicated, disposable Postgres database: the partitioning test recreates its schema
+TEST_POSTGRES_URL = os.getenv("TEST_POSTGRES_URL")
+
+def add_logs_with_report(db, system_id, created_at):
+    """Two old logs of `system_id`, the first one referenced by a report. Returns their ids."""
+    kept = models.Log(system_id=system_id, content={"message": "reported", "container": None}, level="erro", created_at=created_at)
+    expired = models.Log(system_id=system_id, content={"message": "expired", "container": None}, level="normal", created_at=created_at)
+    db.add_all([kept, expired])
+    db.flush()
+    db.add(models.Report(system_id=system_id, log_id=kept.id, content="report"))
+    db.commit()
+    return kept.id, expired.id
+
+def test_row_retention_keeps_logs_referenced_by_reports(client, api_headers):
+    system_id = api_headers["x-api-key"]
+    now = datetime.now(timezone.utc)
+    with SessionLocal() as db:
+        kept, expired = add_logs_with_report(db, system_id, now - timedelta(days=30))
+
+    delete_expired_logs(system_id, now - timedelta(days=7))
+
+    with SessionLocal() as db:
+        remaining = {log_id for (log_id,) in db.query(models.Log.id).filter(models.Log.id.in_([kept, expired]))}
+    assert remaining == {kept}
+
+@pytest.mark.skipif(not TEST_POSTGRES_URL, reason="TEST_POSTGRES_URL not set")
+def test_partition_retention_keeps_logs_referenced_by_reports():
+    from partitioning import run_conversion, drop_partitions_before
+
+    engine = create_engine(TEST_POSTGRES_URL)
+    with engine.begin() as conn:
+        conn.execute(text("DROP SCHEMA public CASCADE"))
+        conn.execute(text("CREATE SCHEMA public"))
+    models.Base.metadata.create_all(bind=engine)
+    now = datetime.now(timezone.utc)
+    with Session(engine) as db:
+        db.add(models.System(id="retention-test", name="retention", client_email="a@b.c", maintenance_email="a@b.c"))
+        db.commit()
+        kept, expired = add_logs_with_report(db, "retention-test", now - timedelta(days=30))
+    assert run_conversion(engine)
+
+    # Every partition, logs_legacy included, is past this horizon
+    dropped = drop_partitions_before(engine, now + timedelta(days=400))
+
+    assert "logs_legacy" in dropped
+    with engine.connect() as conn:
+        remaining = conn.execute(text("SELECT id, tableoid::regclass::text FROM logs WHERE id IN (:kept, :expired)"),
+                                 {"kept": kept, "expired": expired}).all()
+    assert remaining == [(kept, "logs_default")]
+    engine.dispose()
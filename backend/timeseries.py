@@ -0,0 +1,44 @@
+from datetime import datetime, timezone
+from sqlalchemy import func, literal_column
+
+# Bucket label formats returned to the dashboard (same strings the old substr() produced)
+BUCKET_FORMATS = {
+    "minute": "%Y-%m-%d %H:%M",
+    "hour": "%Y-%m-%d %H",
+    "day": "%Y-%m-%d",
+}
+
+def bucket_expression(dialect_name: str, column, granularity: str):
+    """
+    Truncates a timestamp column to the bucket start with the database's native
+    function, so the range filter on the column can still use its index.
+    """
+    if dialect_name == "postgresql":
+        # Unit inlined (not bound) so SELECT and GROUP BY are the same expression
+        return func.date_trunc(literal_column(f"'{granularity}'"), column)
+    return func.strftime(BUCKET_FORMATS[granularity], column)
+
+def format_bucket(value, granularity: str):
+    """date_trunc returns a datetime, SQLite's strftime already a string."""
+    if isinstance(value, str):
+        return value
+    return value.strftime(BUCKET_FORMATS[granularity])
+
+def parse_bucket(value, granularity: str):
+    """Bucket expression result -> naive UTC datetime of the bucket start."""
+    if isinstance(value, str):
+        return datetime.strptime(value, BUCKET_FORMATS[granularity])
+    return naive_utc(value)
+
+def floor_bucket(value: datetime, granularity: str):
+    value = value.replace(second=0, microsecond=0)
+    if granularity in ("hour", "day"):
+        value = value.replace(minute=0)
+    if granularity == "day":
+        value = value.replace(hour=0)
+    return value
+
+def naive_utc(value: datetime):
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
@@ -27,6 +27,12 @@ const LogItem = ({ log, onAnalyze, isAnalyzing, isAnalyzed }) => {
           className: 'badge-success',
           label: 'Sucesso'
         };
+      case 'pending':
+        return {
+          icon: <Brain size={18} className="text-blue-400 animate-pulse" />,
+          className: 'badge-normal',
+          label: 'Classificando'
+        };
       case 'info':
       case 'normal':
       default:
@@ -40,7 +40,7 @@ const Dashboard = ({ apiUrl }) => {
         const keys = new Set();
         stats.forEach(day => {
             Object.keys(day).forEach(key => {
-                if (key !== 'date') keys.add(key);
+                if (key !== 'date' && key !== 'levels') keys.add(key);
             });
         });
         return Array.from(keys);
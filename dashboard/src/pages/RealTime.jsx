@@ -13,6 +13,8 @@ const RealTime = ({ apiUrl }) => {
     const [isLive, setIsLive] = useState(true);
     const scrollRef = useRef(null);
 
+    const lastIdRef = useRef(null);
+
     const fetchData = async () => {
         try {
             const [logsRes, statusRes] = await Promise.all([
@@ -21,6 +23,7 @@ const RealTime = ({ apiUrl }) => {
             ]);
             setLogs(logsRes.data);
             setAnalyzingStatus(statusRes.data);
+            if (logsRes.data.length > 0) lastIdRef.current = logsRes.data[0].id;
         } catch (err) {
             console.error("Error fetching live logs", err);
         } finally {
@@ -30,11 +33,29 @@ const RealTime = ({ apiUrl }) => {
 
     useEffect(() => {
         fetchData();
-        let interval;
-        if (isLive) {
-            interval = setInterval(fetchData, 2000); // Poll every 2 seconds
-        }
-        return () => clearInterval(interval);
+    }, [apiUrl]);
+
+    useEffect(() => {
+        if (!isLive) return;
+        // Server push: new logs and classification updates arrive over SSE, resuming after the last id seen
+        const params = lastIdRef.current !== null ? `?last_id=${lastIdRef.current}` : '';
+        const source = new EventSource(`${apiUrl}/logs/stream${params}`);
+
+        source.addEventListener('log', (e) => {
+            const log = JSON.parse(e.data);
+            lastIdRef.current = log.id;
+            setLogs(prev => [log, ...prev.filter(l => l.id !== log.id)].slice(0, 20));
+        });
+        source.addEventListener('level', (e) => {
+            const update = JSON.parse(e.data);
+            setLogs(prev => prev.map(l => l.id === update.id ? { ...l, level: update.level } : l));
+        });
+        source.addEventListener('status', (e) => {
+            const update = JSON.parse(e.data);
+            setAnalyzingStatus(prev => ({ ...prev, [update.id]: update.status }));
+        });
+
+        return () => source.close();
     }, [apiUrl, isLive]);
 
     return (
@@ -75,7 +96,7 @@ const RealTime = ({ apiUrl }) => {
                         </div>
                         <div className="w-1 h-1 bg-slate-700 rounded-full" />
                         <div className="flex items-center gap-1.5">
-                            <Pulse size={14} className="text-blue-500" /> Latência: 2s
+                            <Pulse size={14} className="text-blue-500" /> Push (SSE)
                         </div>
                     </div>
                     <div className="text-[10px] font-black text-slate-600 uppercase tracking-widest italic">
@@ -97,7 +118,7 @@ const RealTime = ({ apiUrl }) => {
                                         log={log}
                                         onAnalyze={() => { }}
                                         isAnalyzed={analyzingStatus[log.id] === 'completed'}
-                                        isAnalyzing={analyzingStatus[log.id] === 'analyzing'}
+                                        isAnalyzing={['queued', 'analyzing'].includes(analyzingStatus[log.id])}
                                     />
                                 </div>
                             ))}
@@ -13,6 +13,8 @@ const SystemDetail = ({ apiUrl }) => {
     const navigate = useNavigate();
     const [system, setSystem] = useState(null);
     const [logs, setLogs] = useState([]);
+    const [nextCursor, setNextCursor] = useState(null);
+    const [loadingMore, setLoadingMore] = useState(false);
     const [loading, setLoading] = useState(true);
     const [showFichaEditor, setShowFichaEditor] = useState(false);
     const [techInfo, setTechInfo] = useState('');
@@ -21,6 +23,7 @@ const SystemDetail = ({ apiUrl }) => {
     const [isSaving, setIsSaving] = useState(false);
     const [filters, setFilters] = useState([]);
     const [newFilterPattern, setNewFilterPattern] = useState('');
+    const [newFilterIsRegex, setNewFilterIsRegex] = useState(false);
     const [cleanupPattern, setCleanupPattern] = useState('');
     const [isCleaning, setIsCleaning] = useState(false);
 
@@ -32,6 +35,7 @@ const SystemDetail = ({ apiUrl }) => {
             ]);
             setSystem(sysRes.data);
             setLogs(logsRes.data);
+            setNextCursor(logsRes.headers['x-next-cursor'] || null);
             setTechInfo(sysRes.data.technical_info || '');
         } catch (err) {
             console.error("Error fetching system detail", err);
@@ -40,6 +44,20 @@ const SystemDetail = ({ apiUrl }) => {
         }
     };
 
+    const loadMoreLogs = async () => {
+        if (!nextCursor) return;
+        setLoadingMore(true);
+        try {
+            const res = await axios.get(`${apiUrl}/logs`, { params: { system_id: id, cursor: nextCursor } });
+            setLogs(prev => [...prev, ...res.data]);
+            setNextCursor(res.headers['x-next-cursor'] || null);
+        } catch (err) {
+            console.error("Error loading more logs", err);
+        } finally {
+            setLoadingMore(false);
+        }
+    };
+
     const fetchFilters = async () => {
         try {
             const res = await axios.get(`${apiUrl}/systems/${id}/filters`);
@@ -80,10 +98,11 @@ const SystemDetail = ({ apiUrl }) => {
         if (!masterKey) return;
 
         try {
-            await axios.post(`${apiUrl}/systems/${id}/filters`, { pattern: newFilterPattern }, {
+            await axios.post(`${apiUrl}/systems/${id}/filters`, { pattern: newFilterPattern, is_regex: newFilterIsRegex }, {
                 headers: { 'x-master-key': masterKey }
             });
             setNewFilterPattern('');
+            setNewFilterIsRegex(false);
             fetchFilters();
         } catch (err) {
             alert("Erro ao adicionar filtro.");
@@ -117,7 +136,14 @@ const SystemDetail = ({ apiUrl }) => {
             const res = await axios.post(`${apiUrl}/systems/${id}/cleanup`, { pattern: cleanupPattern }, {
                 headers: { 'x-master-key': masterKey }
             });
-            alert(`Limpeza concluída! ${res.data.cleaned_count} logs removidos.`);
+            // The cleanup runs as a background job: poll until it finishes
+            let job;
+            do {
+                await new Promise(resolve => setTimeout(resolve, 2000));
+                job = (await axios.get(`${apiUrl}/jobs/${res.data.job_id}`)).data;
+            } while (job.status === 'queued' || job.status === 'running');
+            if (job.status !== 'completed') throw new Error(job.error);
+            alert(`Limpeza concluída! ${job.deleted} logs removidos.`);
             setCleanupPattern('');
             fetchData();
         } catch (err) {
@@ -231,7 +257,9 @@ const SystemDetail = ({ apiUrl }) => {
                             <div className="space-y-2 mb-4">
                                 {filters.map(f => (
                                     <div key={f.id} className="flex items-center justify-between bg-slate-950 p-2 px-3 rounded-lg border border-slate-800 group">
-                                        <span className="text-xs font-mono text-slate-300 truncate max-w-[150px]">{f.pattern}</span>
+                                        <span className="text-xs font-mono text-slate-300 truncate max-w-[150px]">
+                                            {f.is_regex && <span className="text-blue-400 mr-1">/re/</span>}{f.pattern}
+                                        </span>
                                         <button onClick={() => handleDeleteFilter(f.id)} className="p-1 text-slate-600 hover:text-red-500 transition-colors opacity-0 group-hover:opacity-100">
                                             <X size={14} />
                                         </button>
@@ -251,6 +279,14 @@ const SystemDetail = ({ apiUrl }) => {
                                     <Save size={16} />
                                 </button>
                             </div>
+                            <label className="flex items-center gap-2 mt-2 text-[10px] text-slate-500 cursor-pointer">
+                                <input
+                                    type="checkbox"
+                                    checked={newFilterIsRegex}
+                                    onChange={(e) => setNewFilterIsRegex(e.target.checked)}
+                                />
+                                Padrão é uma expressão regular (regex)
+                            </label>
                         </div>
 
                         <div className="pt-6 border-t border-slate-800">
@@ -319,6 +355,15 @@ const SystemDetail = ({ apiUrl }) => {
                                         onAnalyze={(l) => setAnalyzingLog(l)}
                                     />
                                 ))}
+                                {nextCursor && (
+                                    <button
+                                        onClick={loadMoreLogs}
+                                        disabled={loadingMore}
+                                        className="m-4 py-2 bg-slate-800 border-slate-700 text-slate-400 text-xs font-bold uppercase rounded-md hover:bg-slate-700"
+                                    >
+                                        {loadingMore ? 'Carregando...' : 'Carregar mais'}
+                                    </button>
+                                )}
                             </div>
                         ) : (
                             <div className="flex flex-col items-center justify-center py-20 text-slate-600">
@@ -0,0 +1,91 @@
+import os
+import sys
+import time
+import random
+import sqlite3
+import argparse
+
+# Use the backend modules directly (no database / API needed)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+from local_classifier import LocalClassifier, LOCAL_CLASSIFIER_THRESHOLD
+
+DB_NAME = "finetune_logs.db"
+CATEGORIES = ["normal", "atenção", "erro", "sucesso"]
+
+def load_dataset(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("SELECT message, category FROM training_logs").fetchall()
+    finally:
+        conn.close()
+
+def percentile(values, p):
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[index]
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline accuracy/latency benchmark for the local classifier tier")
+    parser.add_argument("--db", default=DB_NAME, help="Labeled set generated by generate_finetune_data.py")
+    parser.add_argument("--test-split", type=float, default=0.2, help="Fraction of the set held out for evaluation")
+    parser.add_argument("--threshold", type=float, default=LOCAL_CLASSIFIER_THRESHOLD)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        print(f"Error: {args.db} not found. Run generate_finetune_data.py first.")
+        return
+
+    rows = load_dataset(args.db)
+    random.Random(args.seed).shuffle(rows)
+    split = int(len(rows) * (1 - args.test_split))
+    train, test = rows[:split], rows[split:]
+    print(f"Dataset: {len(rows)} logs ({len(train)} train / {len(test)} test), threshold {args.threshold}")
+
+    classifier = LocalClassifier(threshold=args.threshold)
+    start = time.perf_counter()
+    trained = classifier.train([m for m, _ in train], [c for _, c in train])
+    print(f"Model trained: {trained} ({(time.perf_counter() - start) * 1000:.0f} ms)")
+
+    latencies = []
+    answered = correct = 0
+    overall_correct = 0
+    per_tier = {} # tier -> [answered, correct]
+    confusion = {expected: {predicted: 0 for predicted in CATEGORIES + [None]} for expected in CATEGORIES}
+
+    for message, expected in test:
+        start = time.perf_counter()
+        category, confidence, tier = classifier.predict(message)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+        overall_correct += category == expected
+        if category is not None and confidence >= args.threshold:
+            answered += 1
+            correct += category == expected
+            tier_stats = per_tier.setdefault(tier, [0, 0])
+            tier_stats[0] += 1
+            tier_stats[1] += category == expected
+            confusion[expected][category] += 1
+        else:
+            confusion[expected][None] += 1
+
+    total = len(test)
+    print("\n--- Accuracy ---")
+    print(f"Overall (ignoring threshold): {overall_correct}/{total} ({overall_correct / total:.1%})")
+    print(f"Answered locally (>= threshold): {answered}/{total} ({answered / total:.1%}), would go to OpenAI: {total - answered}")
+    if answered:
+        print(f"Accuracy on answered: {correct}/{answered} ({correct / answered:.1%})")
+    for tier, (tier_answered, tier_correct) in per_tier.items():
+        print(f"  {tier}: {tier_correct}/{tier_answered} ({tier_correct / tier_answered:.1%})")
+
+    print("\n--- Confusion (rows = expected, None = sent to OpenAI) ---")
+    columns = CATEGORIES + [None]
+    print("expected".ljust(10) + "".join(str(c).rjust(10) for c in columns))
+    for expected in CATEGORIES:
+        print(expected.ljust(10) + "".join(str(confusion[expected][c]).rjust(10) for c in columns))
+
+    print("\n--- Latency per log ---")
+    print(f"p50: {percentile(latencies, 50):.3f} ms | p99: {percentile(latencies, 99):.3f} ms | max: {max(latencies):.3f} ms")
+
+if __name__ == "__main__":
+    main()